@@ -0,0 +1,167 @@
+"""
+Batch API submission for offline API judging.
+
+Requests are written as JSONL batch files (one {"custom_id", "method", "url", "body"} line per
+request) split to stay within the per-batch line and byte limits, uploaded with files.create
+and submitted with batches.create. BatchRunner then polls the batches with exponential backoff,
+hands each finished batch's results to the caller, and resubmits lines that failed or were
+left unprocessed (e.g. by an expired batch) up to max_attempts times.
+
+Submitted batch ids are checkpointed next to the output file, so a restarted job resumes
+polling its in-flight batches instead of paying for them twice.
+"""
+import io
+import json
+import os
+import time
+
+BATCH_ENDPOINT = "/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Below the service limits of 50,000 requests and 200 MB per batch input file
+MAX_BATCH_LINES = 50000
+MAX_BATCH_BYTES = 190 * 2**20
+
+
+def batch_line(custom_id, body):
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}, ensure_ascii=False)
+
+def split_batches(lines, max_lines=MAX_BATCH_LINES, max_bytes=MAX_BATCH_BYTES):
+    """Group (custom_id, line) pairs into batches within the line and byte limits."""
+    batch, batch_bytes = [], 0
+    for custom_id, line in lines:
+        line_bytes = len(line.encode()) + 1
+        if batch and (len(batch) >= max_lines or batch_bytes + line_bytes > max_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append((custom_id, line))
+        batch_bytes += line_bytes
+    if batch:
+        yield batch
+
+def parse_result_line(line):
+    """(custom_id, body or None, error or None) for one line of a batch output or error file."""
+    record = json.loads(line)
+    response = record.get("response") or {}
+    if record.get("error") is None and response.get("status_code") == 200:
+        return record["custom_id"], response["body"], None
+    return record["custom_id"], None, record.get("error") or response.get("body") or "unknown error"
+
+
+class BatchRunner:
+    def __init__(self, client, checkpoint_file, completion_window="24h",
+                 max_lines=MAX_BATCH_LINES, max_bytes=MAX_BATCH_BYTES,
+                 poll_interval=30.0, max_poll_interval=600.0, max_attempts=3, logger=None):
+        self.client = client
+        self.checkpoint_file = checkpoint_file
+        self.completion_window = completion_window
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_attempts = max_attempts
+        self.logger = logger
+        self.bodies = {}
+        # batches: batch id -> {"custom_ids", "status"}; attempts: custom id -> submissions so far
+        self.checkpoint = {"batches": {}, "attempts": {}}
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file, "r") as f:
+                self.checkpoint = json.load(f)
+
+    def log(self, message):
+        if self.logger:
+            self.logger.info(message)
+
+    def save_checkpoint(self):
+        tmp_path = self.checkpoint_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_file)
+
+    def in_flight(self):
+        return [batch_id for batch_id, batch in self.checkpoint["batches"].items() if batch["status"] not in TERMINAL_STATUSES]
+
+    def in_flight_ids(self):
+        return {custom_id for batch_id in self.in_flight() for custom_id in self.checkpoint["batches"][batch_id]["custom_ids"]}
+
+    def submit(self, requests):
+        """Submit {custom_id: body} requests not already in an in-flight batch; returns the number of lines submitted."""
+        self.bodies.update(requests)
+        already_submitted = self.in_flight_ids()
+        lines = ((custom_id, batch_line(custom_id, body)) for custom_id, body in requests.items()
+                 if custom_id not in already_submitted)
+        submitted = 0
+        for batch in split_batches(lines, self.max_lines, self.max_bytes):
+            data = ("\n".join(line for _, line in batch) + "\n").encode()
+            input_file = self.client.files.create(file=("batch_input.jsonl", io.BytesIO(data)), purpose="batch")
+            created = self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=self.completion_window
+            )
+            custom_ids = [custom_id for custom_id, _ in batch]
+            self.checkpoint["batches"][created.id] = {"custom_ids": custom_ids, "status": created.status}
+            for custom_id in custom_ids:
+                self.checkpoint["attempts"][custom_id] = self.checkpoint["attempts"].get(custom_id, 0) + 1
+            self.save_checkpoint()
+            submitted += len(batch)
+            self.log(f"Submitted batch {created.id} with {len(batch)} requests ({len(data) / 2**20:.1f} MB)")
+        return submitted
+
+    def download(self, file_id):
+        if not file_id:
+            return []
+        text = self.client.files.content(file_id).text
+        return [parse_result_line(line) for line in text.splitlines() if line.strip()]
+
+    def collect(self, batch_id, batch, on_results):
+        """Hand a finished batch's successes to on_results and resubmit its failed or missing lines."""
+        results = self.download(batch.output_file_id) + self.download(batch.error_file_id)
+        succeeded = {custom_id: body for custom_id, body, error in results if body is not None}
+        errors = {custom_id: error for custom_id, _, error in results if custom_id not in succeeded}
+        if succeeded:
+            on_results(succeeded)
+
+        retry = {}
+        for custom_id in self.checkpoint["batches"][batch_id]["custom_ids"]:
+            if custom_id in succeeded:
+                continue
+            if self.checkpoint["attempts"].get(custom_id, 0) >= self.max_attempts:
+                if self.logger:
+                    self.logger.warning(f"Giving up on {custom_id} after {self.max_attempts} attempts: {errors.get(custom_id, 'not processed')}")
+                continue
+            if custom_id in self.bodies:
+                retry[custom_id] = self.bodies[custom_id]
+        self.checkpoint["batches"][batch_id]["status"] = batch.status
+        self.save_checkpoint()
+        self.log(f"Batch {batch_id} {batch.status}: {len(succeeded)} succeeded, {len(retry)} to resubmit")
+        if retry:
+            self.submit(retry)
+
+    def run(self, on_results, should_stop=None):
+        """
+        Poll until every submitted batch has finished, with exponential backoff between rounds.
+        Returns early once should_stop() is true; the batches keep running and are resumed from
+        the checkpoint.
+        """
+        interval = self.poll_interval
+        while self.in_flight():
+            if should_stop is not None and should_stop():
+                self.log(f"Stopped polling with {len(self.in_flight())} batches in flight")
+                return
+            progressed = False
+            for batch_id in self.in_flight():
+                batch = self.client.batches.retrieve(batch_id)
+                if batch.status in TERMINAL_STATUSES:
+                    self.collect(batch_id, batch, on_results)
+                    progressed = True
+                elif batch.status != self.checkpoint["batches"][batch_id]["status"]:
+                    self.checkpoint["batches"][batch_id]["status"] = batch.status
+                    self.save_checkpoint()
+            if not self.in_flight():
+                break
+            # Back off while nothing changes, check again soon after a batch finished
+            interval = self.poll_interval if progressed else min(interval * 2, self.max_poll_interval)
+            deadline = time.time() + interval
+            while time.time() < deadline and not (should_stop is not None and should_stop()):
+                time.sleep(max(0.0, min(1.0, deadline - time.time())))
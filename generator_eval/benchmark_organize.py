@@ -1,161 +1,237 @@
-from datasets import load_dataset
 import json
-import random
 import os
-import re
-from tqdm import tqdm
-
-data = []
-instance_num = {
-    "Physics": 0,
-    "RealMath": 0,
-    "TheoremQA": 0,
-    "SciBench": 0,
-    "u-Math": 0
+import hashlib
+import inspect
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from storage import save_items
+from snapshots import load_split, file_digest, split_fingerprint
+
+# Hub datasets used by each benchmark: (hub name, [splits])
+HUB_SOURCES = {
+    "RealMath": ("ethz-spylab/RealMath", ["Math_arXiv", "CS_arXiv", "Math_StackExchange"]),
+    "TheoremQA": ("TIGER-Lab/TheoremQA", ["test"]),
+    "SciBench": ("xw27/scibench", ["train"]),
+    "u-Math": ("toloka/u-math", ["test"]),
 }
 
+
 ### Benchmark 1: Physics
-physics_dir = "./physics"
-
-# Check if the directory exists
-if not os.path.exists(physics_dir):
-    print(f"Error: Directory '{physics_dir}' does not exist")
-    exit(1)
-
-# Get all jsonl files in the directory
-jsonl_files = [f for f in os.listdir(physics_dir) if f.endswith('.jsonl')]
-
-if not jsonl_files:
-    print(f"No JSONL files found in '{physics_dir}'")
-    exit(0)
-
-# Process each jsonl file
-for file_name in jsonl_files:
-    file_path = os.path.join(physics_dir, file_name)
-    print(f"Processing file: {file_path}")
-    
-    # Open and read the jsonl file
-    with open(file_path, 'r') as file:
-        # Read line by line since jsonl format has one JSON object per line
-        for line_num, line in enumerate(file, 1):
-            try:
-                # Parse the JSON object
-                json_obj = json.loads(line.strip())
-                # Here you can process each JSON object
-                # For example, print the keys:
-                print(f"  Line {line_num}: Contains keys {list(json_obj.keys())}")
-            except json.JSONDecodeError:
-                print(f"  Error parsing JSON at line {line_num}")
-
-idx =0
-for file_name in jsonl_files:
-    file_path = os.path.join(physics_dir, file_name)
-    with open(file_path, 'r') as file:
-        for line in file:
-            try:
-                json_obj = json.loads(line.strip())
-                if json_obj["graphs"] == None:
-                    if len(json_obj["final_answers"]) >=2:
-                        formatted_answers = "\n".join([f"* answer {i+1}: {ans.replace('text{ ','text{')}".strip() for i, ans in enumerate(json_obj["final_answers"])])
-                        for trial_idx in range(4):
-                            data.append({
-                                "idx": f"Physics/instance_{idx}/trial_{trial_idx}",
-                                "question": json_obj["questions"],
-                                "answer": formatted_answers.strip(),
-                                "answer_type": "Diverse",
-                                "category": file_name.split("_test")[0]
-                            })
-                        
-                    else:
-                        for trial_idx in range(4):
-                            data.append({
-                                "idx": f"Physics/instance_{idx}/trial_{trial_idx}",
-                                "question": json_obj["questions"],
-                                "answer": json_obj["final_answers"][0].replace("text{ ","text{").strip(),
-                                "answer_type": "Diverse",
-                                "category": file_name.split("_test")[0]
-                            })
-                    idx +=1
-                    instance_num["Physics"] += 1
-            except json.JSONDecodeError:
-                print(f"Error parsing JSON in file {file_name}")
+def build_physics(physics_dir, snapshot_dir, offline):
+    # Keep os.listdir order so instance numbering matches earlier benchmarks.json files
+    jsonl_files = [f for f in os.listdir(physics_dir) if f.endswith('.jsonl')]
+    if not jsonl_files:
+        print(f"No JSONL files found in '{physics_dir}'")
+
+    instances = []
+    idx = 0
+    for file_name in jsonl_files:
+        file_path = os.path.join(physics_dir, file_name)
+        with open(file_path, 'r') as file:
+            for line_num, line in enumerate(file, 1):
+                try:
+                    json_obj = json.loads(line.strip())
+                except json.JSONDecodeError:
+                    print(f"Error parsing JSON in file {file_name} at line {line_num}")
+                    continue
+                if json_obj["graphs"] is not None:
+                    continue
+                if len(json_obj["final_answers"]) >= 2:
+                    answer_ = "\n".join([f"* answer {i+1}: {ans.replace('text{ ','text{')}".strip() for i, ans in enumerate(json_obj["final_answers"])])
+                else:
+                    answer_ = json_obj["final_answers"][0].replace("text{ ", "text{")
+                instances.append({
+                    "idx": f"Physics/instance_{idx}",
+                    "question": json_obj["questions"],
+                    "answer": answer_.strip(),
+                    "answer_type": "Diverse",
+                    "category": file_name.split("_test")[0]
+                })
+                idx += 1
+    return instances
 
 ### Benchmark 2: RealMath
-for s in ["Math_arXiv","CS_arXiv","Math_StackExchange"]:
-    init_data = load_dataset("ethz-spylab/RealMath", split=s)
-
-    for idx,item in enumerate(init_data):    
-        answer_ = item["answer"]
-        if answer_.startswith("$$") and answer_.endswith("$$"):
-            answer_ = answer_[2:-2].strip()
-        elif answer_.startswith("$") and answer_.endswith("$"):
-            answer_ = answer_[1:-1].strip()
-
-        for trial_idx in range(4):
-            data.append({
-                "idx": f"RealMath/instance_{idx}/trial_{trial_idx}",
+def build_realmath(physics_dir, snapshot_dir, offline):
+    hub_name, splits = HUB_SOURCES["RealMath"]
+    instances = []
+    for s in splits:
+        init_data = load_split(snapshot_dir, hub_name, s, offline)
+        # Instance numbering restarts per split, as in earlier benchmarks.json files
+        for idx, item in enumerate(init_data):
+            answer_ = item["answer"]
+            if answer_.startswith("$$") and answer_.endswith("$$"):
+                answer_ = answer_[2:-2].strip()
+            elif answer_.startswith("$") and answer_.endswith("$"):
+                answer_ = answer_[1:-1].strip()
+            instances.append({
+                "idx": f"RealMath/instance_{idx}",
                 "question": item["question"],
                 "answer": answer_.strip(),
                 "answer_type": "Diverse",
                 "category": s
             })
-        instance_num["RealMath"] += 1
+    return instances
 
 ### Benchmark 3: TheoremQA
-init_data = load_dataset("TIGER-Lab/TheoremQA", split="test")
-
-idx =0
-for item in init_data:
-    if item["Picture"] == None:
-        for trial_idx in range(4):
-            data.append({
-                "idx": f"TheoremQA/instance_{idx}/trial_{trial_idx}",
+def build_theoremqa(physics_dir, snapshot_dir, offline):
+    hub_name, splits = HUB_SOURCES["TheoremQA"]
+    init_data = load_split(snapshot_dir, hub_name, splits[0], offline)
+    instances = []
+    idx = 0
+    for item in init_data:
+        if item["Picture"] is None:
+            instances.append({
+                "idx": f"TheoremQA/instance_{idx}",
                 "question": item["Question"],
                 "answer": item["Answer"].strip(),
                 "answer_type": "Diverse",
                 "category": item["Answer_type"]
             })
-        idx +=1
-        instance_num["TheoremQA"] += 1
+            idx += 1
+    return instances
 
 ### Benchmark 4: SciBench
-init_data = load_dataset("xw27/scibench", split="train")
-for idx,item in enumerate(init_data):
-    if item["unit"] == "":
-        answer_ = item["answer_number"]
-    else:
-        answer_ = item["answer_number"] + " " + item["unit"]
-    
-    for trial_idx in range(4):
-        data.append({
-            "idx": f"SciBench/instance_{idx}/trial_{trial_idx}",
+def build_scibench(physics_dir, snapshot_dir, offline):
+    hub_name, splits = HUB_SOURCES["SciBench"]
+    init_data = load_split(snapshot_dir, hub_name, splits[0], offline)
+    instances = []
+    for idx, item in enumerate(init_data):
+        if item["unit"] == "":
+            answer_ = item["answer_number"]
+        else:
+            answer_ = item["answer_number"] + " " + item["unit"]
+        instances.append({
+            "idx": f"SciBench/instance_{idx}",
             "question": item["problem_text"],
             "answer": answer_.strip(),
             "answer_type": "Numerical",
             "category": item['source']
         })
-    instance_num["SciBench"] += 1
-
+    return instances
 
 ### Benchmark 5: u-Math
-init_data = load_dataset("toloka/u-math", split="test")
-idx=0
-for item in init_data:
-    if item["image"] is None:
-        for trial_idx in range(4):
-            data.append({
-                "idx": f"u-Math/instance_{idx}/trial_{trial_idx}",
+def build_umath(physics_dir, snapshot_dir, offline):
+    hub_name, splits = HUB_SOURCES["u-Math"]
+    init_data = load_split(snapshot_dir, hub_name, splits[0], offline)
+    instances = []
+    idx = 0
+    for item in init_data:
+        if item["image"] is None:
+            instances.append({
+                "idx": f"u-Math/instance_{idx}",
                 "question": item["problem_statement"],
                 "answer": item["golden_answer"].split("The final answer: ")[-1].strip(),
                 "answer_type": "Diverse",
                 "category": item["subject"]
             })
-        idx += 1
-        instance_num["u-Math"] += 1
-
+            idx += 1
+    return instances
+
+BUILDERS = {
+    "Physics": build_physics,
+    "RealMath": build_realmath,
+    "TheoremQA": build_theoremqa,
+    "SciBench": build_scibench,
+    "u-Math": build_umath,
+}
 
-print(instance_num)
-print(f"Total items processed: {len(data)}")
 
-with open("benchmarks.json", "w") as f:
-    json.dump(data, f, indent=4)
\ No newline at end of file
+def source_cache_key(name, physics_dir, snapshot_dir):
+    """
+    Hash of everything a source's output depends on: its transform code and its input data.
+    Returns None when the input has no local snapshot yet (it must be built to create one).
+    """
+    digest = hashlib.sha256()
+    digest.update(name.encode())
+    digest.update(inspect.getsource(BUILDERS[name]).encode())
+    if name == "Physics":
+        for file_name in os.listdir(physics_dir):
+            if file_name.endswith('.jsonl'):
+                digest.update(file_name.encode())
+                digest.update(file_digest(os.path.join(physics_dir, file_name)).encode())
+    else:
+        hub_name, splits = HUB_SOURCES[name]
+        for split in splits:
+            fingerprint = split_fingerprint(snapshot_dir, hub_name, split)
+            if fingerprint is None:
+                return None
+            digest.update(f"{split}:{fingerprint}".encode())
+    return digest.hexdigest()[:16]
+
+def build_source(name, physics_dir, snapshot_dir, cache_dir, offline):
+    """Build one source's instances, reusing the cached output when its inputs and code are unchanged."""
+    start_time = time.time()
+    cache_key = source_cache_key(name, physics_dir, snapshot_dir)
+    if cache_key is not None:
+        cache_file = os.path.join(cache_dir, f"{name}.{cache_key}.json")
+        if os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                instances = json.load(f)
+            return name, instances, True, time.time() - start_time
+
+    instances = BUILDERS[name](physics_dir, snapshot_dir, offline)
+
+    # The snapshot exists now if it was just downloaded
+    cache_key = source_cache_key(name, physics_dir, snapshot_dir)
+    cache_file = os.path.join(cache_dir, f"{name}.{cache_key}.json")
+    for stale_file in os.listdir(cache_dir):
+        if stale_file.startswith(f"{name}.") and stale_file.endswith(".json"):
+            os.remove(os.path.join(cache_dir, stale_file))
+    with open(cache_file, "w") as f:
+        json.dump(instances, f, ensure_ascii=False)
+    return name, instances, False, time.time() - start_time
+
+def expand_trials(instances, num_trials):
+    """Write each instance num_trials times as idx/trial_k; num_trials=0 keeps one row per instance."""
+    if num_trials == 0:
+        return list(instances)
+    data = []
+    for instance in instances:
+        for trial_idx in range(num_trials):
+            item = dict(instance)
+            item["idx"] = f"{instance['idx']}/trial_{trial_idx}"
+            data.append(item)
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build benchmarks.json from local dataset snapshots.")
+    parser.add_argument("--physics_dir", type=str, default="./physics", help="Directory with the physics JSONL files.")
+    parser.add_argument("--snapshot_dir", type=str, default="./snapshots", help="Directory with local Arrow/JSONL snapshots of hub datasets.")
+    parser.add_argument("--cache_dir", type=str, default="./.benchmark_cache", help="Directory for per-source cached outputs.")
+    parser.add_argument("--output_file", type=str, default="benchmarks.json", help="Path to the output JSON file, or a normalized *.trials.jsonl table.")
+    parser.add_argument("--num_trials", type=int, default=4, help="Trial rows per instance (0 writes one row per instance for --num_samples).")
+    parser.add_argument("--sources", type=str, nargs="+", default=list(BUILDERS.keys()), help="Benchmarks to include.")
+    parser.add_argument("--offline", action="store_true", help="Fail instead of downloading missing snapshots.")
+    parser.add_argument("--num_workers", type=int, default=len(BUILDERS), help="Sources built in parallel.")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.physics_dir):
+        print(f"Error: Directory '{args.physics_dir}' does not exist")
+        exit(1)
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        futures = [
+            executor.submit(build_source, name, args.physics_dir, args.snapshot_dir, args.cache_dir, args.offline)
+            for name in args.sources
+        ]
+        for future in futures:
+            name, instances, cached, duration = future.result()
+            results[name] = instances
+            print(f"{name}: {len(instances)} instances ({'cached' if cached else 'rebuilt'}, {duration:.2f}s)")
+
+    data = []
+    instance_num = {}
+    for name in args.sources:
+        instance_num[name] = len(results[name])
+        data.extend(expand_trials(results[name], args.num_trials))
+
+    print(instance_num)
+    print(f"Total items processed: {len(data)}")
+
+    # A *.trials.jsonl output also writes the shared *.instances.jsonl table next to it
+    save_items(data, args.output_file, indent=None)
@@ -0,0 +1,288 @@
+"""
+Browse the items two judges disagree on, straight from an on-disk index of each result file.
+
+The first time a result file is opened, one pass writes <file>.idx: a fixed-size record per item
+(key hash, byte offset and length in the file, benchmark, category, verdict) plus a small
+<file>.idx.json with the string tables and the size/mtime of the indexed file. Later opens
+memory-map the index and the result file, join the judges on the key hashes and read only the
+items that are displayed, so a 500 MB result set opens instantly. Compressed (.zst/.gz) files
+are decompressed once into <file>.idx.data since they cannot be read at an offset.
+
+Items are keyed by idx plus its occurrence number, because RealMath repeats idx across splits.
+
+    python3 browse_disagreements.py o3=./qwen3_4b_think_responses/o3_detailed_few_shot_results.json \\
+        qwen=./qwen3_4b_think_responses/qwen25_14b_eval.json --benchmark Physics
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+from storage import compression_of, format_idx, is_normalized, load_instance_table, open_file, TrialRecord
+
+# key hash, offset, length, benchmark id, category id, verdict (1 / 0 / -1 for not judged)
+RECORD = struct.Struct("<QQIHHb3x")
+INDEX_VERSION = 1
+VERDICTS = {1: "Equivalent", 0: "Not Equivalent", -1: "Not judged"}
+
+
+def key_hash(idx, occurrence):
+    return int.from_bytes(hashlib.blake2b(f"{idx}#{occurrence}".encode(), digest_size=8).digest(), "little")
+
+def verdict_of(item):
+    if "is_it_correct" not in item:
+        return -1
+    return 1 if item["is_it_correct"] else 0
+
+def scan_plain(f):
+    """(offset, length) of each top-level object of an indented JSON list, line by line."""
+    f.seek(0)
+    offset = 0
+    start = None
+    indent = None
+    for line in f:
+        stripped = line.strip()
+        if indent is None and stripped == b"{":
+            indent = len(line) - len(line.lstrip())
+        if indent is not None and len(line) - len(line.lstrip()) == indent:
+            if stripped == b"{":
+                start = offset + indent
+            elif stripped in (b"}", b"},"):
+                yield start, offset + indent + 1 - start
+        offset += len(line)
+    if indent is None:
+        raise ValueError("not an indented JSON list")
+
+def scan_compact(f):
+    """(offset, length) of each object of a JSON list written without indent (slower, one-off)."""
+    f.seek(0)
+    text = f.read().decode("utf-8")
+    decoder = json.JSONDecoder()
+    position = text.index("[") + 1
+    byte_offset = len(text[:position].encode())
+    while True:
+        while text[position] in " \r\n\t,":
+            position += 1
+            byte_offset += 1
+        if text[position] == "]":
+            return
+        _, end = decoder.raw_decode(text, position)
+        length = len(text[position:end].encode())
+        yield byte_offset, length
+        byte_offset += length
+        position = end
+
+def scan_lines(f):
+    """(offset, length) of each row of a trial table, after its header line."""
+    f.seek(0)
+    offset = len(f.readline())
+    for line in f:
+        if line.strip():
+            yield offset, len(line.rstrip(b"\r\n"))
+        offset += len(line)
+
+
+class IndexedResults:
+    """One judge's result file, opened through its offset index."""
+
+    def __init__(self, name, path, rebuild=False):
+        self.name = name
+        self.path = path
+        self.data_path = path
+        if compression_of(path):
+            self.data_path = path + ".idx.data"
+            if rebuild or not os.path.exists(self.data_path) or os.path.getmtime(self.data_path) < os.path.getmtime(path):
+                with open_file(path, "r") as source, open(self.data_path, "w") as target:
+                    shutil.copyfileobj(source, target, 1 << 24)
+        self.index_path = path + ".idx"
+        self.meta_path = path + ".idx.json"
+        if rebuild or not self.index_is_current():
+            self.build_index()
+        with open(self.meta_path, "r") as f:
+            self.meta = json.load(f)
+
+        self.data_file = open(self.data_path, "rb")
+        self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index_file = open(self.index_path, "rb")
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ) if self.meta["count"] else b""
+        self.instances = None
+
+    def index_is_current(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.meta_path)):
+            return False
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        stat = os.stat(self.path)
+        return (meta.get("version") == INDEX_VERSION and meta["size"] == stat.st_size
+                and meta["mtime"] == stat.st_mtime)
+
+    def build_index(self):
+        benchmarks, categories = {}, {}
+        occurrences = {}
+        normalized = is_normalized(self.path)
+        instances = None
+        if normalized:
+            with open(self.data_path, "rb") as f:
+                header = json.loads(f.readline())
+            instances = load_instance_table(os.path.join(os.path.dirname(self.path), header["instances"]))
+
+        count = 0
+        tmp_path = self.index_path + ".tmp"
+        with open(self.data_path, "rb") as f, open(tmp_path, "wb") as index:
+            if normalized:
+                spans = scan_lines(f)
+            else:
+                f.readline()
+                spans = scan_plain(f) if f.readline().strip() == b"{" else scan_compact(f)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            for offset, length in spans:
+                item = json.loads(data[offset:offset + length])
+                if normalized:
+                    instance = instances[item["instance_id"]]
+                    idx = format_idx(instance, item["trial"])
+                    benchmark, category = instance["benchmark"], instance.get("category", "")
+                else:
+                    idx = item.get("idx", "")
+                    benchmark, category = idx.split("/")[0] if "/" in idx else "unknown", item.get("category", "")
+                occurrence = occurrences.get(idx, 0)
+                occurrences[idx] = occurrence + 1
+                index.write(RECORD.pack(
+                    key_hash(idx, occurrence), offset, length,
+                    benchmarks.setdefault(benchmark, len(benchmarks)),
+                    categories.setdefault(category or "", len(categories)),
+                    verdict_of(item)
+                ))
+                count += 1
+            data.close()
+        os.replace(tmp_path, self.index_path)
+
+        stat = os.stat(self.path)
+        meta = {
+            "version": INDEX_VERSION, "size": stat.st_size, "mtime": stat.st_mtime, "count": count,
+            "benchmarks": list(benchmarks), "categories": list(categories),
+        }
+        with open(self.meta_path, "w") as f:
+            json.dump(meta, f)
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def record(self, row):
+        key, offset, length, benchmark, category, verdict = RECORD.unpack_from(self.index, row * RECORD.size)
+        return key, offset, length, self.meta["benchmarks"][benchmark], self.meta["categories"][category], verdict
+
+    def rows_by_key(self):
+        return {RECORD.unpack_from(self.index, row * RECORD.size)[0]: row for row in range(len(self))}
+
+    def item(self, row):
+        """The full item at a row, read from the file only now."""
+        _, offset, length, _, _, _ = self.record(row)
+        item = json.loads(self.data[offset:offset + length])
+        if not is_normalized(self.path):
+            return item
+        if self.instances is None:
+            header = json.loads(self.data[:self.data.find(b"\n")])
+            self.instances_path = os.path.normpath(os.path.join(os.path.dirname(self.path), header["instances"]))
+            self.instances = load_instance_table(self.instances_path)
+        return TrialRecord(self.instances_path, self.instances, item.pop("instance_id"), item.pop("trial"), item)
+
+
+def disagreements(first, second, benchmarks=None, categories=None, show="disagree"):
+    """
+    (row in first, row in second) pairs in file order. show is "disagree", "agree" or "all";
+    items the second judge has no record of are skipped.
+    """
+    second_rows = second.rows_by_key()
+    pairs = []
+    for row in range(len(first)):
+        key, _, _, benchmark, category, verdict = first.record(row)
+        if benchmarks and benchmark not in benchmarks:
+            continue
+        if categories and category not in categories:
+            continue
+        other = second_rows.get(key)
+        if other is None:
+            continue
+        differ = verdict != second.record(other)[5]
+        if show == "all" or differ == (show == "disagree"):
+            pairs.append((row, other))
+    return pairs
+
+def print_pair(position, total, judges, rows, show_judgment):
+    items = [judge.item(row) for judge, row in zip(judges, rows)]
+    item = items[0]
+    print(f"[{position + 1}/{total}] {item['idx']} ({item.get('category', '')})")
+    print()
+    print("Question:")
+    print(item["question"])
+    print()
+    print("Reference Answer:")
+    print(item["answer"])
+    print()
+    print("Candidate:")
+    print(item.get("extracted_answer"))
+    print()
+    for judge, judged in zip(judges, items):
+        print(f"{judge.name}: {VERDICTS[verdict_of(judged)]}")
+        if show_judgment and judged.get("judgment"):
+            print(judged["judgment"])
+            print()
+
+def print_summary(judges, pairs):
+    counts = {}
+    for row, _ in pairs:
+        benchmark = judges[0].record(row)[3]
+        counts[benchmark] = counts.get(benchmark, 0) + 1
+    print(f"{len(pairs)} items between {judges[0].name} and {judges[1].name}")
+    for benchmark, count in sorted(counts.items()):
+        print(f"  {benchmark}: {count}")
+
+def browse(judges, pairs, start, show_judgment):
+    """Enter: next, p: previous, <n>: jump to item n, q: quit."""
+    # Further judges are looked up by the first judge's key hashes
+    lookups = [judge.rows_by_key() for judge in judges[2:]]
+    position = start
+    while 0 <= position < len(pairs):
+        row, other = pairs[position]
+        key = judges[0].record(row)[0]
+        rows = [row, other] + [lookup.get(key) for lookup in lookups]
+        shown = [(judge, judge_row) for judge, judge_row in zip(judges, rows) if judge_row is not None]
+        print_pair(position, len(pairs), [judge for judge, _ in shown], [judge_row for _, judge_row in shown], show_judgment)
+        command = input("Enter: next, p: previous, <n>: jump, q: quit > ").strip()
+        if command == "q":
+            break
+        elif command == "p":
+            position = max(0, position - 1)
+        elif command.isdigit():
+            position = min(len(pairs) - 1, max(0, int(command) - 1))
+        else:
+            position += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Browse judge disagreements through an on-disk index of each result file.")
+    parser.add_argument("results", type=str, nargs="+", help="Result files as name=path (or path); the first two are compared, later ones are shown alongside.")
+    parser.add_argument("--benchmark", type=str, nargs="+", help="Only these benchmarks.")
+    parser.add_argument("--category", type=str, nargs="+", help="Only these categories.")
+    parser.add_argument("--show", type=str, default="disagree", choices=["disagree", "agree", "all"], help="Which items of the judge pair to browse.")
+    parser.add_argument("--start", type=int, default=1, help="Item to start browsing at (1-based).")
+    parser.add_argument("--show_judgment", action="store_true", help="Also print each judge's reasoning.")
+    parser.add_argument("--summary", action="store_true", help="Only print the number of items per benchmark.")
+    parser.add_argument("--rebuild_index", action="store_true", help="Rebuild the indexes even if they are current.")
+
+    args = parser.parse_args()
+    if len(args.results) < 2:
+        parser.error("need at least two result files")
+
+    judges = []
+    for spec in args.results:
+        name, _, path = spec.rpartition("=")
+        judges.append(IndexedResults(name or os.path.basename(path), path, args.rebuild_index))
+
+    pairs = disagreements(judges[0], judges[1], args.benchmark, args.category, args.show)
+    if args.summary:
+        print_summary(judges, pairs)
+    else:
+        browse(judges, pairs, args.start - 1, args.show_judgment)
@@ -0,0 +1,153 @@
+"""
+Token and cost accounting for API judge runs.
+
+UsageBudget keeps running totals of the chat.completions usage (prompt, cached, completion and
+reasoning tokens) and the estimated spend, and tells the dispatcher when to stop sending new
+requests. Requests already in flight are accounted for with the running mean cost per request,
+so a run overshoots its budget by at most the estimation error of the last few requests. Until
+the first usage comes back, the mean is seeded with a prior (expect()): the prompt tokens of a
+typical request and the expected completion tokens, by default the max_tokens it may use.
+
+balanced_order interleaves the items of each benchmark (shuffled within the benchmark) so a run
+cut short by its budget still covers every benchmark evenly.
+"""
+import random
+
+# USD per 1M tokens; reasoning tokens are billed as output tokens. Override with --price_* flags.
+DEFAULT_PRICES = {"input": 2.0, "cached_input": 0.5, "output": 8.0}
+
+
+def usage_summary(usage):
+    """Flatten a chat.completions usage dict (model_dump) into the counts kept per item."""
+    if not usage:
+        return None
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    completion_details = usage.get("completion_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "cached_tokens": prompt_details.get("cached_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "reasoning_tokens": completion_details.get("reasoning_tokens") or 0,
+    }
+
+def usage_cost(summary, prices=DEFAULT_PRICES):
+    uncached_tokens = summary["prompt_tokens"] - summary["cached_tokens"]
+    return (uncached_tokens * prices["input"]
+            + summary["cached_tokens"] * prices["cached_input"]
+            + summary["completion_tokens"] * prices["output"]) / 1e6
+
+
+class UsageBudget:
+    def __init__(self, max_tokens=None, max_usd=None, prices=None, metrics=None, logger=None, log_every=100):
+        self.max_tokens = max_tokens
+        self.max_usd = max_usd
+        self.prices = dict(DEFAULT_PRICES, **(prices or {}))
+        self.metrics = metrics
+        self.logger = logger
+        self.log_every = log_every
+        self.totals = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "reasoning_tokens": 0}
+        self.cost_usd = 0.0
+        self.requests = 0
+        self.prior = None
+
+    @property
+    def total_tokens(self):
+        return self.totals["prompt_tokens"] + self.totals["completion_tokens"]
+
+    def charge(self, summary, live=True):
+        """Add one request's usage; live=False counts usage recorded by an earlier run."""
+        if summary is None:
+            return
+        for name in self.totals:
+            self.totals[name] += summary[name]
+        cost = usage_cost(summary, self.prices)
+        self.cost_usd += cost
+        self.requests += 1
+        if live and self.metrics is not None:
+            self.metrics.add_tokens(summary["prompt_tokens"], summary["completion_tokens"])
+            self.metrics.count("cached_tokens", summary["cached_tokens"])
+            self.metrics.count("reasoning_tokens", summary["reasoning_tokens"])
+            self.metrics.count("cost_usd", cost)
+        if live and self.logger and self.requests % self.log_every == 0:
+            self.log()
+
+    @property
+    def limited(self):
+        return self.max_tokens is not None or self.max_usd is not None
+
+    def expect(self, prompt_tokens, completion_tokens):
+        """Prior usage of one request, used for projections until real usage is known."""
+        self.prior = {"prompt_tokens": prompt_tokens, "cached_tokens": 0,
+                      "completion_tokens": completion_tokens, "reasoning_tokens": 0}
+
+    def per_request(self):
+        """Expected (tokens, USD) of one request: the mean so far, else the prior, else nothing."""
+        if self.requests:
+            return self.total_tokens / self.requests, self.cost_usd / self.requests
+        if self.prior is not None:
+            return self.prior["prompt_tokens"] + self.prior["completion_tokens"], usage_cost(self.prior, self.prices)
+        return 0, 0.0
+
+    def request_estimate(self, prompt_tokens):
+        """Expected (tokens, USD) of a request with this many prompt tokens, its completion as per_request's."""
+        if self.requests:
+            completion_tokens = self.totals["completion_tokens"] / self.requests
+        else:
+            completion_tokens = self.prior["completion_tokens"] if self.prior is not None else 0
+        usage = {"prompt_tokens": prompt_tokens, "cached_tokens": 0, "completion_tokens": completion_tokens, "reasoning_tokens": 0}
+        return prompt_tokens + completion_tokens, usage_cost(usage, self.prices)
+
+    def projected_over(self, tokens=0, usd=0.0):
+        """True once spend plus the given projected tokens and cost reaches a limit."""
+        if self.max_tokens is not None and self.total_tokens + tokens >= self.max_tokens:
+            return True
+        if self.max_usd is not None and self.cost_usd + usd >= self.max_usd:
+            return True
+        return False
+
+    def exhausted(self, in_flight=0):
+        """True once spend plus the expected cost of in-flight requests reaches a limit."""
+        tokens, usd = self.per_request()
+        return self.projected_over(in_flight * tokens, in_flight * usd)
+
+    def summary(self):
+        return dict(self.totals, requests=self.requests, total_tokens=self.total_tokens, cost_usd=round(self.cost_usd, 4))
+
+    def log(self):
+        if not self.logger:
+            return
+        limits = []
+        if self.max_tokens is not None:
+            limits.append(f"{self.total_tokens / self.max_tokens:.1%} of {self.max_tokens} tokens")
+        if self.max_usd is not None:
+            limits.append(f"{self.cost_usd / self.max_usd:.1%} of ${self.max_usd:.2f}")
+        self.logger.info(
+            f"Usage: {self.requests} requests, {self.totals['prompt_tokens']} prompt tokens "
+            f"({self.totals['cached_tokens']} cached), {self.totals['completion_tokens']} completion tokens "
+            f"({self.totals['reasoning_tokens']} reasoning), ${self.cost_usd:.2f}"
+            + (f" [{', '.join(limits)}]" if limits else "")
+        )
+
+
+def balanced_order(indexed_items, benchmark_of, priority=None, seed=0):
+    """
+    Interleave (index, item) pairs round-robin across benchmarks, shuffling within each
+    benchmark. Benchmarks listed in priority are interleaved first, the rest after them.
+    """
+    rng = random.Random(seed)
+    groups = {}
+    for pair in indexed_items:
+        groups.setdefault(benchmark_of(pair[1]), []).append(pair)
+    for group in groups.values():
+        rng.shuffle(group)
+
+    priority = [name for name in (priority or []) if name in groups]
+    tiers = [priority, sorted(name for name in groups if name not in priority)]
+    ordered = []
+    for tier in tiers:
+        queues = [groups[name] for name in tier]
+        for position in range(max((len(queue) for queue in queues), default=0)):
+            for queue in queues:
+                if position < len(queue):
+                    ordered.append(queue[position])
+    return ordered
@@ -0,0 +1,357 @@
+from vllm import SamplingParams
+import json
+import os
+import argparse
+import math
+from transformers import AutoTokenizer
+from storage import load_items, save_items, merge_completed, benchmark_of
+from metrics import RunMetrics, get_logger
+from replay import open_llm
+from template_compiler import ChatPromptFormat, PromptRenderer, judge_fields
+from preflight import Preflight, context_length_of
+from qwen_eval import CONCISE_ZERO_SHOT, DETAILED_ZERO_SHOT, DETAILED_FEW_SHOT, init_llm, extract_judgment, validate_output, calculate_tokens
+
+
+logger = get_logger("cascade_eval")
+
+LOCAL_TEMPLATES = {
+    "concise_zero_shot": CONCISE_ZERO_SHOT,
+    "detailed_zero_shot": DETAILED_ZERO_SHOT,
+    "detailed_few_shot": DETAILED_FEW_SHOT,
+}
+
+
+def tally_votes(texts):
+    """
+    Self-consistency over one item's samples: the majority judgment, its text and its confidence
+    (share of all samples that agree; samples without a valid decision count against it).
+    """
+    votes = {"yes": 0, "no": 0, "invalid": 0}
+    first_text = {}
+    for text in texts:
+        valid, decision = validate_output(text)
+        vote = "invalid" if not valid else ("yes" if decision == "Final Judgment: Yes" else "no")
+        votes[vote] += 1
+        first_text.setdefault(vote, text)
+    majority = "yes" if votes["yes"] >= votes["no"] else "no"
+    confidence = votes[majority] / len(texts) if texts else 0.0
+    return votes, majority, first_text.get(majority, first_text.get("invalid", "")), confidence
+
+def should_escalate(tier_result, threshold, item, hard_categories):
+    if item.get("category") in hard_categories:
+        return "hard_category"
+    if tier_result["confidence"] < threshold:
+        return "low_confidence"
+    return None
+
+def run_local_tier(llm, renderer, tier, sampling_params, tier_items, metrics, preflight=None, num_sections=4):
+    """Judge (index, item) pairs with the local model; stores item["cascade"]["tier<k>"]. Yields after each section."""
+    section_size = math.ceil(len(tier_items) / num_sections) if tier_items else 0
+    for section_idx in range(num_sections):
+        section_items = tier_items[section_idx * section_size:(section_idx + 1) * section_size]
+        if not section_items:
+            break
+        logger.info(f"Tier {tier}: section {section_idx + 1}/{num_sections} with {len(section_items)} items")
+        with metrics.phase("render"):
+            prompt_token_ids = renderer.render(judge_fields(item) for _, item in section_items)
+        if preflight is not None:
+            with metrics.phase("preflight"):
+                section_items, prompt_token_ids = preflight.admit(section_items, prompt_token_ids, judge_fields)
+        try:
+            metrics.set_queue_depth(len(prompt_token_ids))
+            # Prompts that leave less room than max_tokens in the context get max_tokens clamped
+            section_params = sampling_params if preflight is None else preflight.sampling_params(section_items, sampling_params)
+            with metrics.phase("generate"):
+                batch_outputs = llm.generate(prompt_token_ids=prompt_token_ids, sampling_params=section_params)
+            metrics.record_vllm_outputs(batch_outputs)
+            with metrics.phase("parse"):
+                for (_, item), output in zip(section_items, batch_outputs):
+                    votes, majority, text, confidence = tally_votes([completion.text.strip() for completion in output.outputs])
+                    item.setdefault("cascade", {})[f"tier{tier}"] = {
+                        "votes": votes,
+                        "majority": majority,
+                        "confidence": round(confidence, 4),
+                        "judgment": text,
+                    }
+            metrics.count(f"tier{tier}_items", len(section_items))
+        except Exception as e:
+            logger.error(f"Error processing tier {tier} section {section_idx + 1}: {str(e)}")
+            # For failed items in this section, mark them as failed instead of aborting the run
+            for _, item in section_items:
+                if "judgment" not in item:
+                    item["judgment"] = "[FAILED_TO_PROCESS]"
+                if "is_it_correct" not in item:
+                    item["is_it_correct"] = False
+        yield section_idx
+
+def settle(item, tier, judgment_text, is_correct):
+    judgment, _ = extract_judgment(judgment_text)
+    item["judgment"] = judgment
+    item["is_it_correct"] = is_correct
+    item["cascade"]["settled_at"] = tier
+
+def cascade_report(items, thresholds, hard_categories, max_tier):
+    """Thresholds plus how many items each tier judged, settled and passed on."""
+    report = {"thresholds": thresholds, "hard_categories": sorted(hard_categories), "max_tier": max_tier, "tiers": {}}
+    judged_items = [item for item in items if "cascade" in item]
+    for tier in range(1, max_tier + 1):
+        key = f"tier{tier}"
+        at_tier = [item for item in judged_items if key in item["cascade"]]
+        settled = [item for item in at_tier if item["cascade"].get("settled_at") == tier]
+        escalated = [item for item in at_tier if item["cascade"].get("escalated", {}).get(key)]
+        reasons = {}
+        for item in escalated:
+            reason = item["cascade"]["escalated"][key]
+            reasons[reason] = reasons.get(reason, 0) + 1
+        stats = {
+            "judged": len(at_tier),
+            "settled": len(settled),
+            "escalated": len(escalated),
+            "escalation_reasons": reasons,
+            "share_of_items": round(len(at_tier) / len(judged_items), 4) if judged_items else 0.0,
+        }
+        # How often this tier overturned the previous tier's majority on escalated items
+        if tier > 1:
+            previous = f"tier{tier - 1}"
+            compared = [item for item in at_tier if previous in item["cascade"]]
+            stats["flipped_previous"] = sum(
+                1 for item in compared if item["cascade"][key]["majority"] != item["cascade"][previous]["majority"]
+            )
+        report["tiers"][key] = stats
+    return report
+
+def process_benchmarks(model_path, gpu_per_node, input_file, output_file,
+                      temperature, top_p, top_k, min_p, max_tokens,
+                      num_samples=5, tier1_template="concise_zero_shot", tier2_template="detailed_zero_shot",
+                      tier1_threshold=0.8, tier2_threshold=0.8, hard_categories=None, max_tier=3,
+                      o3_max_tokens=16384, report_file=None, metrics_file=None,
+                      record_dir=None, replay_dir=None, replay_latency=0.0,
+                      max_model_len=None, overlength_policy="truncate", routed_file=None):
+    metrics = RunMetrics("cascade_eval", metrics_file, logger)
+    hard_categories = set(hard_categories or [])
+    thresholds = {"tier1": tier1_threshold, "tier2": tier2_threshold, "num_samples": num_samples,
+                  "tier1_template": tier1_template, "tier2_template": tier2_template}
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+    # Load the input file - check if output file exists for resuming
+    with metrics.phase("load"):
+        if os.path.exists(output_file):
+            logger.info(f"Output file {output_file} exists. Loading from it for resuming...")
+            completed_items = load_items(output_file)
+            all_items = load_items(input_file)
+            merge_completed(all_items, completed_items)
+        else:
+            logger.info(f"Loading from input file {input_file}")
+            all_items = load_items(input_file)
+
+    with metrics.phase("tokenize"):
+        failed_to_process_count = 0
+        for item in all_items:
+            if "response_tokens" not in item and "response" in item:
+                item["response_tokens"] = calculate_tokens(tokenizer, item["response"])
+            if ("judgment" not in item or "is_it_correct" not in item) and item.get("extracted_answer") == "[FAILED_TO_PROCESS]":
+                item["judgment"] = ""
+                item["is_it_correct"] = False
+                failed_to_process_count += 1
+    logger.info(f"Processed {failed_to_process_count} '[FAILED_TO_PROCESS]' items")
+
+    def pending(tier):
+        # Items still unsettled that have reached this tier but not been judged by it
+        return [
+            (i, item) for i, item in enumerate(all_items)
+            if "judgment" not in item and item.get("extracted_answer") != "[FAILED_TO_PROCESS]"
+            and item.get("cascade", {}).get("settled_at") is None
+            and (tier == 1 or item.get("cascade", {}).get("escalated", {}).get(f"tier{tier - 1}"))
+            and f"tier{tier}" not in item.get("cascade", {})
+        ]
+
+    def save():
+        with metrics.phase("save"):
+            save_items(all_items, output_file, indent=2)
+        metrics.export()
+
+    def decide(tier, threshold):
+        # Settle confident items at this tier, mark the rest escalated (or settle them if this is the last tier)
+        key = f"tier{tier}"
+        for item in all_items:
+            cascade = item.get("cascade", {})
+            if key not in cascade or cascade.get("settled_at") is not None or cascade.get("escalated", {}).get(key):
+                continue
+            result = cascade[key]
+            reason = should_escalate(result, threshold, item, hard_categories) if tier < max_tier else None
+            if reason is None:
+                settle(item, tier, result["judgment"], result["majority"] == "yes")
+            else:
+                cascade.setdefault("escalated", {})[key] = reason
+
+    tier1_items = pending(1)
+    logger.info(f"Found {len(tier1_items)} items for tier 1 ({tier1_template}, {num_samples} samples)")
+
+    llm = None
+    if tier1_items or pending(2):
+        # A replay run serves recorded outputs and never loads the model
+        llm = open_llm(lambda: init_llm(model_path, gpu_per_node, max_model_len), "cascade_eval",
+                       record_dir, replay_dir, replay_latency, logger)
+        sampling_params = SamplingParams(
+            n=num_samples,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            min_p=min_p,
+            max_tokens=max_tokens,
+            stop=["<End of Judgment>"]
+        )
+
+        # Prompts rendered as in qwen_eval.py: static template and chat scaffolding tokenized once per tier
+        renderers = [PromptRenderer(LOCAL_TEMPLATES[template], ChatPromptFormat(tokenizer), logger=logger, metrics=metrics)
+                     for template in (tier1_template, tier2_template)]
+        try:
+            # Over-length prompts are truncated, skipped or routed per tier instead of failing their section in generate
+            preflights = [None, None]
+            context_length = max_model_len or context_length_of(llm)
+            if context_length:
+                preflights = [Preflight(context_length, max_tokens, renderer.render, len, overlength_policy, logger, metrics)
+                              for renderer in renderers]
+                # Both tiers route into one file
+                preflights[1].routed = preflights[0].routed
+            else:
+                logger.warning("Context length unknown, prompt lengths are not checked; pass --max_model_len to check them")
+
+            for _ in run_local_tier(llm, renderers[0], 1, sampling_params, tier1_items, metrics, preflights[0]):
+                decide(1, tier1_threshold)
+                save()
+
+            if max_tier >= 2:
+                tier2_items = pending(2)
+                logger.info(f"Escalated {len(tier2_items)} items to tier 2 ({tier2_template})")
+                for _ in run_local_tier(llm, renderers[1], 2, sampling_params, tier2_items, metrics, preflights[1]):
+                    decide(2, tier2_threshold)
+                    save()
+
+            for tier, preflight in enumerate(preflights, 1):
+                if preflight is not None:
+                    preflight.log_report()
+                    preflight.save(f"{output_file}.tier{tier}.preflight.json")
+            if preflights[0] is not None:
+                preflights[0].save_routed(routed_file or output_file + ".routed.json")
+        finally:
+            for renderer in renderers:
+                renderer.close()
+
+    if max_tier >= 3:
+        tier3_items = pending(3)
+        logger.info(f"Escalated {len(tier3_items)} items to tier 3 (o3)")
+        if tier3_items:
+            # Imported here so local-only cascades don't need the OpenAI client
+            from o3_eval import openai_inference, judge_prompt
+            from budget import usage_summary
+            prompts = [judge_prompt(item) for _, item in tier3_items]
+            with metrics.phase("api"):
+                outputs = openai_inference(prompts, o3_max_tokens, metrics)
+            with metrics.phase("parse"):
+                for (_, item), output in zip(tier3_items, outputs):
+                    if output is None:
+                        continue
+                    if output["content"] is None and output["retryable"]:
+                        # Out of retries on a rate limit, server or connection error; left unsettled for a rerun
+                        logger.error(f"Tier 3 request for {item['idx']} failed after retrying, left for a rerun: {output['error']}")
+                        item["cascade"]["tier3_error"] = output["error"]
+                        metrics.count("retries_exhausted", 1)
+                        continue
+                    if output["content"] is None:
+                        # The API rejected the request for good (e.g. a 400); not retried on resume
+                        logger.error(f"Tier 3 request for {item['idx']} failed: {output['error']}")
+                        item["judgment"] = "[FAILED_TO_PROCESS]"
+                        item["is_it_correct"] = False
+                        item["cascade"]["tier3_error"] = output["error"]
+                        item["cascade"]["settled_at"] = 3
+                        metrics.count("failed_requests", 1)
+                        continue
+                    item["cascade"].pop("tier3_error", None)
+                    votes, majority, text, confidence = tally_votes([output["content"]])
+                    item["cascade"]["tier3"] = {"votes": votes, "majority": majority, "confidence": confidence,
+                                                "usage": usage_summary(output["usage"])}
+                    settle(item, 3, output["content"], majority == "yes")
+            metrics.count("tier3_items", len(tier3_items))
+            save()
+
+    # Items escalated past the last tier that ran (e.g. o3 unavailable) keep their last local verdict
+    for item in all_items:
+        cascade = item.get("cascade")
+        # Items whose tier 3 request ran out of retries stay unsettled, so a rerun sends them again, and
+        # routed items stay unjudged for the longer-context judge, as in qwen_eval.py
+        if (cascade and cascade.get("settled_at") is None and "tier3_error" not in cascade
+                and item.get("preflight", {}).get("action") != "routed"):
+            last_tier = max(int(key[len("tier"):]) for key in cascade if key.startswith("tier") and key[len("tier"):].isdigit())
+            result = cascade[f"tier{last_tier}"]
+            settle(item, last_tier, result.get("judgment", ""), result["majority"] == "yes")
+    save()
+
+    report = cascade_report(all_items, thresholds, hard_categories, max_tier)
+    for tier, stats in report["tiers"].items():
+        logger.info(f"{tier}: judged {stats['judged']} ({stats['share_of_items']:.1%}), settled {stats['settled']}, "
+                    f"escalated {stats['escalated']} {stats['escalation_reasons']}"
+                    + (f", flipped previous tier {stats['flipped_previous']}" if "flipped_previous" in stats else ""))
+    if report_file:
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # Calculate benchmark-specific statistics
+    benchmark_stats = {}
+    for item in all_items:
+        benchmark = benchmark_of(item)
+        if benchmark not in benchmark_stats:
+            benchmark_stats[benchmark] = {"total": 0, "correct": 0}
+        benchmark_stats[benchmark]["total"] += 1
+        if item.get("is_it_correct") == True:
+            benchmark_stats[benchmark]["correct"] += 1
+
+    logger.info(f"Benchmark-specific statistics:")
+    for benchmark, stats in sorted(benchmark_stats.items()):
+        accuracy = stats["correct"] / stats["total"] if stats["total"] > 0 else 0.0
+        logger.info(f"{benchmark}: {stats['correct']}/{stats['total']} ({accuracy:.4f})")
+
+    metrics.log_summary()
+    metrics.export()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cascaded judging: local self-consistency judge first, escalating uncertain items to detailed templates and then o3.")
+    parser.add_argument("--model_path", type=str, required=True, help="Path to the local judge model.")
+    parser.add_argument("--gpu_per_node", type=int, default=1, help="Number of GPUs per node.")
+    parser.add_argument("--input_file", type=str, required=True, help="Path to the input JSON file.")
+    parser.add_argument("--output_file", type=str, required=True, help="Path to the output JSON file.")
+    parser.add_argument("--temperature", type=float, default=0.7, help="Temperature for the self-consistency samples.")
+    parser.add_argument("--top_p", type=float, default=0.8, help="Top-p for sampling.")
+    parser.add_argument("--top_k", type=int, default=20, help="Top-k for sampling.")
+    parser.add_argument("--min_p", type=float, default=0.0, help="Min-p for sampling.")
+    parser.add_argument("--max_tokens", type=int, default=8192, help="Maximum tokens per local judgment.")
+    parser.add_argument("--num_samples", type=int, default=5, help="Self-consistency samples per item at the local tiers.")
+    parser.add_argument("--tier1_template", type=str, default="concise_zero_shot", choices=list(LOCAL_TEMPLATES), help="Template of the first tier.")
+    parser.add_argument("--tier2_template", type=str, default="detailed_zero_shot", choices=list(LOCAL_TEMPLATES), help="Template of the second tier.")
+    parser.add_argument("--tier1_threshold", type=float, default=0.8, help="Escalate tier 1 items whose majority share is below this.")
+    parser.add_argument("--tier2_threshold", type=float, default=0.8, help="Escalate tier 2 items whose majority share is below this.")
+    parser.add_argument("--hard_categories", type=str, nargs="+", help="Categories always escalated past the local tiers.")
+    parser.add_argument("--max_tier", type=int, default=3, choices=[1, 2, 3], help="Last tier to run (3 = o3).")
+    parser.add_argument("--o3_max_tokens", type=int, default=16384, help="Maximum tokens for o3 judgments.")
+    parser.add_argument("--report_file", type=str, help="Write thresholds and per-tier volumes here as JSON.")
+    parser.add_argument("--metrics_file", type=str, help="Write phase timings, throughput and latency metrics here (.json, or .prom for a Prometheus textfile).")
+    parser.add_argument("--log_level", type=str, help="Logging level (DEBUG, INFO, WARNING, ERROR; default: $LOG_LEVEL, else INFO).")
+    parser.add_argument("--record_dir", type=str, help="Record every generate() request with its outputs into this directory.")
+    parser.add_argument("--replay_dir", type=str, help="Serve outputs recorded with --record_dir instead of loading the model.")
+    parser.add_argument("--replay_latency", type=float, default=0.0, help="Scale of recorded latencies simulated in replay (0 = memory speed, 1 = as recorded).")
+    parser.add_argument("--max_model_len", type=int, help="Context window of the local judge (default: the model's); prompts that leave it less than --max_tokens get max_tokens clamped, those that do not fit are handled by --overlength_policy.")
+    parser.add_argument("--overlength_policy", type=str, default="truncate", choices=["truncate", "skip", "route"], help="Over-length prompts: truncate the candidate, skip the item, or route it to --routed_file for a longer-context judge.")
+    parser.add_argument("--routed_file", type=str, help="Where routed items are written (default: <output_file>.routed.json).")
+
+    args = parser.parse_args()
+    if args.log_level:
+        logger.setLevel(args.log_level.upper())
+
+    process_benchmarks(args.model_path, args.gpu_per_node, args.input_file, args.output_file,
+                      args.temperature, args.top_p, args.top_k, args.min_p, args.max_tokens,
+                      args.num_samples, args.tier1_template, args.tier2_template,
+                      args.tier1_threshold, args.tier2_threshold, args.hard_categories, args.max_tier,
+                      args.o3_max_tokens, args.report_file, args.metrics_file,
+                      args.record_dir, args.replay_dir, args.replay_latency,
+                      args.max_model_len, args.overlength_policy, args.routed_file)
@@ -0,0 +1,536 @@
+"""
+Deterministic stand-ins for vLLM, the HF tokenizer, Harmony and the OpenAI API.
+
+They let the drivers' own overhead (rendering, parsing, checkpointing, resume, stats) be
+measured and exercised without GPUs or network access. Outputs depend only on the prompt, so
+repeated runs produce identical files.
+"""
+import asyncio
+import email
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SPECIAL_TOKEN_PATTERN = re.compile(r"(<\|[a-z_]+\|>)")
+FILLER_WORDS = ("therefore", "consider", "the", "value", "of", "equation", "so", "we", "get", "thus")
+
+
+def prompt_seed(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+def fake_completion_text(prompt, index=0, mean_words=200, min_words=20):
+    """Deterministic completion whose shape depends on the kind of prompt (generation or judging)."""
+    seed = prompt_seed(prompt) + index
+    num_words = min_words + seed % (2 * mean_words)
+    body = " ".join(FILLER_WORDS[(seed >> (i % 48)) % len(FILLER_WORDS)] for i in range(num_words))
+    if "Final Judgment" in prompt or "Candidate 1" in prompt:
+        verdict = "Yes" if seed % 3 else "No"
+        return f"{body}\nFinal Judgment: {verdict} "
+    return f"<think> {body} </think> <answer> {seed % 1000} </answer>"
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer with the parts of the HF tokenizer API the drivers use."""
+
+    def encode(self, text, add_special_tokens=False):
+        # Cheap and deterministic: the id of a word is its length; <|...|> special tokens stand alone
+        return [len(word) for word in SPECIAL_TOKEN_PATTERN.sub(r" \1 ", text).split()]
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return " ".join(FILLER_WORDS[token_id % len(FILLER_WORDS)] for token_id in token_ids)
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True, **kwargs):
+        text = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        if add_generation_prompt:
+            text += "<|im_start|>assistant\n"
+        return self.encode(text) if tokenize else text
+
+
+class FakeAutoTokenizer:
+    @staticmethod
+    def from_pretrained(*args, **kwargs):
+        return FakeTokenizer()
+
+
+class FakeSamplingParams:
+    def __init__(self, n=1, temperature=1.0, top_p=1.0, top_k=-1, min_p=0.0, max_tokens=16,
+                 stop=None, stop_token_ids=None, seed=None, logprobs=None):
+        self.n = n
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.min_p = min_p
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.stop_token_ids = stop_token_ids
+        self.seed = seed
+        self.logprobs = logprobs
+
+    def clone(self):
+        return FakeSamplingParams(**vars(self))
+
+
+class FakeCompletion:
+    def __init__(self, index, text, token_ids, finish_reason):
+        self.index = index
+        self.text = text
+        self.token_ids = token_ids
+        self.finish_reason = finish_reason
+        self.cumulative_logprob = None
+        self.logprobs = None
+
+
+class FakeRequestOutput:
+    def __init__(self, request_id, prompt, prompt_token_ids, outputs):
+        self.request_id = request_id
+        self.prompt = prompt
+        self.prompt_token_ids = prompt_token_ids
+        self.outputs = outputs
+        self.finished = True
+        self.metrics = None
+
+
+class FakeLLM:
+    """
+    Offline vLLM LLM stand-in. Completions are deterministic in (prompt, sample index), honour
+    n and max_tokens (finish_reason "length" when cut), and can simulate per-token decode time.
+    """
+
+    def __init__(self, *args, mean_words=200, seconds_per_token=0.0, **kwargs):
+        self.mean_words = mean_words
+        self.seconds_per_token = seconds_per_token
+        self.tokenizer = FakeTokenizer()
+        self.num_requests = 0
+
+    def get_tokenizer(self):
+        return self.tokenizer
+
+    def complete(self, prompt_text, prompt_token_ids, params):
+        completions = []
+        for index in range(params.n):
+            text = fake_completion_text(prompt_text, index, self.mean_words)
+            if params.stop:
+                for stop in params.stop:
+                    if stop in text:
+                        text = text[:text.index(stop)]
+            words = text.split(" ")
+            finish_reason = "stop"
+            if len(words) > params.max_tokens:
+                words = words[:params.max_tokens]
+                text = " ".join(words)
+                finish_reason = "length"
+            completions.append(FakeCompletion(index, text, [len(word) for word in words], finish_reason))
+        self.num_requests += 1
+        return FakeRequestOutput(str(self.num_requests), prompt_text, prompt_token_ids, completions)
+
+    def generate(self, prompts=None, sampling_params=None, prompt_token_ids=None, use_tqdm=True, **kwargs):
+        if prompts is None:
+            prompts = [{"prompt_token_ids": ids} for ids in prompt_token_ids]
+        single = isinstance(prompts, (str, dict))
+        if single:
+            prompts = [prompts]
+        if not isinstance(sampling_params, list):
+            sampling_params = [sampling_params or FakeSamplingParams()] * len(prompts)
+
+        outputs = []
+        total_tokens = 0
+        for prompt, params in zip(prompts, sampling_params):
+            if isinstance(prompt, dict):
+                ids = list(prompt["prompt_token_ids"])
+                text = " ".join(str(token_id) for token_id in ids[-64:])
+            else:
+                text = prompt
+                ids = self.tokenizer.encode(prompt)
+            output = self.complete(text, ids, params)
+            total_tokens += sum(len(completion.token_ids) for completion in output.outputs)
+            outputs.append(output)
+        if self.seconds_per_token:
+            time.sleep(total_tokens * self.seconds_per_token)
+        return outputs
+
+
+class FakeAsyncEngineArgs:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeAsyncLLMEngine:
+    """
+    AsyncLLMEngine stand-in over FakeLLM. Requests run concurrently, each taking
+    seconds_per_request plus seconds_per_token per generated token.
+    """
+
+    def __init__(self, llm=None, seconds_per_request=0.0, seconds_per_token=0.0):
+        self.llm = llm or FakeLLM()
+        self.seconds_per_request = seconds_per_request
+        self.seconds_per_token = seconds_per_token
+        self.num_running = 0
+        self.max_running = 0
+
+    @classmethod
+    def from_engine_args(cls, engine_args):
+        return cls()
+
+    async def get_tokenizer(self):
+        return self.llm.get_tokenizer()
+
+    async def generate(self, prompt, sampling_params, request_id, **kwargs):
+        if isinstance(prompt, dict):
+            ids = list(prompt["prompt_token_ids"])
+            text = " ".join(str(token_id) for token_id in ids[-64:])
+        else:
+            text, ids = prompt, self.llm.tokenizer.encode(prompt)
+        output = self.llm.complete(text, ids, sampling_params)
+        output.request_id = request_id
+        self.num_running += 1
+        self.max_running = max(self.max_running, self.num_running)
+        try:
+            num_tokens = sum(len(completion.token_ids) for completion in output.outputs)
+            await asyncio.sleep(self.seconds_per_request + num_tokens * self.seconds_per_token)
+        finally:
+            self.num_running -= 1
+        yield output
+
+
+### Harmony stand-in (openai_harmony) for oss_eval.py
+class FakeRole:
+    SYSTEM = "system"
+    DEVELOPER = "developer"
+    USER = "user"
+    ASSISTANT = "assistant"
+
+
+class FakeSystemContent:
+    @staticmethod
+    def new():
+        return "You are ChatGPT, a large language model trained by OpenAI."
+
+
+class FakeMessage:
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+    @classmethod
+    def from_role_and_content(cls, role, content):
+        return cls(role, content)
+
+
+class FakeConversation:
+    def __init__(self, messages):
+        self.messages = messages
+
+    @classmethod
+    def from_messages(cls, messages):
+        return cls(messages)
+
+
+class FakeHarmonyEncoding:
+    def __init__(self):
+        self.tokenizer = FakeTokenizer()
+
+    def render_conversation_for_completion(self, conversation, role):
+        text = "".join(f"<|start|>{m.role}<|message|>{m.content}<|end|>" for m in conversation.messages)
+        return self.tokenizer.encode(text + f"<|start|>{role}")
+
+    def encode(self, text, allowed_special=None):
+        return self.tokenizer.encode(text)
+
+    def stop_tokens_for_assistant_actions(self):
+        return [200002, 200012]
+
+    def parse_messages_from_completion_tokens(self, tokens, role):
+        return [FakeMessage(role, self.tokenizer.decode(tokens) + "\nFinal Judgment: Yes")]
+
+
+def install_fake_modules(force=False):
+    """
+    Register vllm / transformers / openai_harmony stand-ins in sys.modules so the drivers import
+    without the real packages (or instead of them with force=True).
+    """
+    fakes = {
+        "vllm": {"LLM": FakeLLM, "SamplingParams": FakeSamplingParams,
+                 "AsyncLLMEngine": FakeAsyncLLMEngine, "AsyncEngineArgs": FakeAsyncEngineArgs},
+        "transformers": {"AutoTokenizer": FakeAutoTokenizer},
+        "openai_harmony": {
+            "HarmonyEncodingName": types.SimpleNamespace(HARMONY_GPT_OSS="HarmonyGptOss"),
+            "load_harmony_encoding": lambda name: FakeHarmonyEncoding(),
+            "Conversation": FakeConversation,
+            "Message": FakeMessage,
+            "Role": FakeRole,
+            "SystemContent": FakeSystemContent,
+            "DeveloperContent": FakeSystemContent,
+        },
+    }
+    installed = []
+    for name, attributes in fakes.items():
+        if not force:
+            try:
+                __import__(name)
+                continue
+            except ImportError:
+                pass
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+        installed.append(name)
+    return installed
+
+def patch_driver(driver, llm=None):
+    """Point a driver module's engine, tokenizer and sampling params at the fakes."""
+    llm = llm or FakeLLM()
+    driver.init_llm = lambda *args, **kwargs: llm
+    if hasattr(driver, "AutoTokenizer"):
+        driver.AutoTokenizer = FakeAutoTokenizer
+    if hasattr(driver, "SamplingParams"):
+        driver.SamplingParams = FakeSamplingParams
+    if hasattr(driver, "load_harmony_encoding"):
+        driver.load_harmony_encoding = lambda name: FakeHarmonyEncoding()
+        driver.Conversation = FakeConversation
+        driver.Message = FakeMessage
+        driver.Role = FakeRole
+        driver.SystemContent = FakeSystemContent
+    return llm
+
+
+### OpenAI-compatible HTTP stand-in for o3_eval.py
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_bytes(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            self.chat_completions()
+        elif path.endswith("/files"):
+            self.send_json(200, self.server.batches.create_file(self.read_multipart()))
+        elif path.endswith("/batches"):
+            self.send_json(200, self.server.batches.create_batch(self.read_json()))
+        else:
+            self.not_found()
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].rstrip("/").split("/")
+        batches = self.server.batches
+        if parts[-2:-1] == ["batches"] and parts[-1] in batches.batches:
+            self.send_json(200, batches.retrieve_batch(parts[-1]))
+        elif parts[-1] == "content" and parts[-3:-2] == ["files"] and parts[-2] in batches.files:
+            self.send_bytes(200, batches.files[parts[-2]]["data"])
+        else:
+            self.not_found()
+
+    def read_multipart(self):
+        """Form fields of a multipart/form-data upload (files.create) as {name: bytes}."""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        return {
+            part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in message.get_payload()
+        }
+
+    def chat_completions(self):
+        server = self.server
+        request = self.read_json()
+        with server.lock:
+            server.num_requests += 1
+            request_number = server.num_requests
+        if server.error_rate and request_number % int(1 / server.error_rate) == 0:
+            self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+        if server.slots is None:
+            self.send_json(200, fake_chat_completion(request, server.mean_words, server.latency))
+            return
+        # Requests beyond capacity queue for a slot, as on a saturated backend
+        with server.slots:
+            body = fake_chat_completion(request, server.mean_words, server.latency)
+        self.send_json(200, body)
+
+
+def fake_chat_completion(request, mean_words=200, latency=0.0):
+    """Build a chat.completions response body for a request, optionally sleeping to simulate latency."""
+    prompt = "".join(message.get("content", "") for message in request.get("messages", []))
+    content = fake_completion_text(prompt, 0, mean_words) + "<End of Judgment>"
+    prompt_tokens = len(prompt.split())
+    completion_tokens = len(content.split())
+    reasoning_tokens = 4 * completion_tokens
+    if latency:
+        # Latency scales with the reasoning length so there is a realistic tail
+        time.sleep(latency * (0.5 + (prompt_seed(prompt) % 100) / 50))
+    return {
+        "id": f"chatcmpl-{prompt_seed(prompt):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "o3"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens + reasoning_tokens,
+            "total_tokens": prompt_tokens + completion_tokens + reasoning_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+            "completion_tokens_details": {"reasoning_tokens": reasoning_tokens},
+        },
+    }
+
+
+class FakeBatchService:
+    """
+    In-memory Files + Batches API. A batch completes batch_delay seconds after it is created; with
+    line_error_rate every 1/line_error_rate-th line processed lands in the error file with a 500.
+    """
+
+    def __init__(self, mean_words=200, batch_delay=0.0, line_error_rate=0.0):
+        self.mean_words = mean_words
+        self.batch_delay = batch_delay
+        self.line_error_rate = line_error_rate
+        # Re-entrant: completing a batch adds its output files while holding the lock
+        self.lock = threading.RLock()
+        self.files = {}
+        self.batches = {}
+        self.num_lines = 0
+
+    def add_file(self, data, filename, purpose):
+        with self.lock:
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = {"data": data, "filename": filename, "purpose": purpose, "created_at": int(time.time())}
+        return file_id
+
+    def file_object(self, file_id):
+        entry = self.files[file_id]
+        return {
+            "id": file_id, "object": "file", "bytes": len(entry["data"]), "created_at": entry["created_at"],
+            "filename": entry["filename"], "purpose": entry["purpose"], "status": "processed",
+        }
+
+    def create_file(self, fields):
+        return self.file_object(self.add_file(fields["file"], "batch_input.jsonl", fields.get("purpose", b"batch").decode()))
+
+    def create_batch(self, request):
+        with self.lock:
+            batch_id = f"batch_{len(self.batches)}"
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                "status": "validating", "created_at": int(time.time()), "created": time.time(),
+                "output_file_id": None, "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+        return self.retrieve_batch(batch_id)
+
+    def run_batch(self, batch):
+        outputs, errors = [], []
+        for line in self.files[batch["input_file_id"]]["data"].decode().splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            self.num_lines += 1
+            if self.line_error_rate and self.num_lines % int(1 / self.line_error_rate) == 0:
+                errors.append({"id": f"batch_req_{self.num_lines}", "custom_id": request["custom_id"],
+                               "response": {"status_code": 500, "body": {"error": {"message": "Injected server error"}}},
+                               "error": None})
+                continue
+            outputs.append({"id": f"batch_req_{self.num_lines}", "custom_id": request["custom_id"],
+                            "response": {"status_code": 200, "body": fake_chat_completion(request["body"], self.mean_words)},
+                            "error": None})
+        if outputs:
+            batch["output_file_id"] = self.add_file("".join(json.dumps(o) + "\n" for o in outputs).encode(), "output.jsonl", "batch_output")
+        if errors:
+            batch["error_file_id"] = self.add_file("".join(json.dumps(e) + "\n" for e in errors).encode(), "errors.jsonl", "batch_output")
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        batch["status"] = "completed"
+
+    def retrieve_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches[batch_id]
+            elapsed = time.time() - batch["created"]
+            if batch["status"] == "validating":
+                batch["status"] = "in_progress"
+            elif batch["status"] == "in_progress" and elapsed >= self.batch_delay:
+                self.run_batch(batch)
+            return {key: value for key, value in batch.items() if key != "created"}
+
+
+class BackloggedHTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections under 32-way concurrency and adds TCP retransmit stalls
+    request_queue_size = 1024
+
+
+class FakeOpenAIServer:
+    """
+    Threaded local server speaking the chat.completions, Files and Batches APIs; use base_url as the
+    client's base URL. With capacity, at most that many chat completions are served at once.
+    """
+
+    handler_class = FakeOpenAIHandler
+
+    def __init__(self, host="127.0.0.1", port=0, mean_words=200, latency=0.0, error_rate=0.0,
+                 batch_delay=0.0, batch_line_error_rate=0.0, capacity=None):
+        self.httpd = BackloggedHTTPServer((host, port), self.handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.num_requests = 0
+        self.httpd.mean_words = mean_words
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.slots = threading.Semaphore(capacity) if capacity else None
+        self.httpd.batches = FakeBatchService(mean_words, batch_delay, batch_line_error_rate)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def num_requests(self):
+        return self.httpd.num_requests
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
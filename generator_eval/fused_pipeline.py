@@ -0,0 +1,382 @@
+"""
+Generation, answer extraction and judging fused into one job.
+
+response_generation_qwen.py, group_with_extract.py and qwen_eval.py/o3_eval.py each reread and
+rewrite the whole dataset, and judging waits for the slowest generation shard. Here every
+generation section goes through extraction as soon as generate() returns, and its answers are
+queued to the judge, which works in background threads while the next section generates:
+
+    generate        vLLM, --num_sections sections of the pending trial rows, trials of an
+                    instance drawn with SamplingParams(n)
+    extract         <answer> tags, else the last boxed / "Final Answer" answer (the fallback of
+                    group_with_extract.py); rows without either are settled as incorrect
+    judge           a judge_server.py on the same node (--judge server, e.g. on the GPUs the
+                    generator does not use) or the o3 client (--judge o3)
+
+Each trial row is written to a single output file with its response, extracted_answer, judgment
+and is_it_correct, saved after every section, and the accuracy of the rows judged so far is
+logged per benchmark after every section. A rerun resumes: rows without a response are
+generated, rows with an answer but no judgment are judged.
+
+    python3 judge_server.py --model_path /datasets/pretrained-llms/Qwen3-4B --unix_socket /tmp/judge.sock &
+    python3 fused_pipeline.py --model_path /datasets/pretrained-llms/Qwen3-14B --input_file ./benchmarks.json \\
+        --output_file ./qwen3_14b_think_responses/fused_results.json --num_samples 4 --enable_thinking \\
+        --judge server --judge_address unix:/tmp/judge.sock
+"""
+from vllm import SamplingParams
+import os
+import argparse
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from transformers import AutoTokenizer
+from storage import load_items, save_items, merge_completed, benchmark_of
+from metrics import RunMetrics, get_logger
+from replay import open_llm
+from preemption import Preemption
+from budget import usage_summary
+from reward_api import ServerJudge
+from judge_server import TEMPLATES
+from group_with_extract import extract_solution_fast_accurate
+from response_generation_qwen import (init_llm, extract_answer_content, expand_instances, render_groups,
+                                      generate_trials)
+
+
+logger = get_logger("fused_pipeline")
+
+JUDGES = ("server", "o3")
+
+# While only judgments are outstanding, save this often
+DRAIN_SAVE_SECONDS = 300.0
+# After a stop, judgments in flight are waited for this long before they are left to the resumed run
+STOP_GRACE_SECONDS = 15.0
+
+
+def extract_final_answer(response):
+    """The <answer> content, else the last boxed or "Final Answer" answer, else None."""
+    return extract_answer_content(response) or extract_solution_fast_accurate(response)
+
+def wait_for_server(client, timeout, poll_seconds=10.0):
+    """Block until the judge server answers /health; it only listens once its model is loaded."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            client.request("GET", "/health")
+            return
+        except (OSError, RuntimeError) as e:
+            if time.time() > deadline:
+                raise RuntimeError(f"Judge server at {client.address} not up after {timeout:.0f}s: {e}")
+            time.sleep(poll_seconds)
+
+
+class ServerJudgeQueue:
+    """Judgments from a running judge_server.py, which batches the requests of all workers itself."""
+
+    def __init__(self, address, template="detailed_zero_shot", max_workers=256, timeout=600, wait_seconds=3600.0):
+        self.judge = ServerJudge(address, template, priority="normal", max_workers=max_workers, timeout=timeout)
+        logger.info(f"Waiting for the judge server at {address}...")
+        wait_for_server(self.judge.client, wait_seconds)
+
+    def submit(self, item):
+        return self.judge.submit(item["question"], item["answer"], item["extracted_answer"])
+
+    def record(self, item, result, metrics):
+        item["judgment"], item["is_it_correct"] = result
+
+    def close(self):
+        self.judge.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class O3JudgeQueue:
+    """o3 judgments through o3_eval.process_prompt, which retries transient API errors itself."""
+
+    def __init__(self, max_tokens=16384, max_workers=32):
+        # Imported here so server-judged runs don't need the OpenAI client
+        import o3_eval
+        self.o3_eval = o3_eval
+        self.max_tokens = max_tokens
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, item):
+        return self.executor.submit(self.o3_eval.process_prompt, self.o3_eval.judge_prompt(item), self.max_tokens)
+
+    def record(self, item, result, metrics):
+        metrics.observe_latency(result["latency"])
+        if result["content"] is None:
+            raise RuntimeError(result["error"])
+        item["judgment"], item["is_it_correct"] = self.o3_eval.extract_judgment(result["content"])
+        item["usage"] = usage_summary(result["usage"])
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def collect_judgments(judge, in_flight, items, metrics, timeout=0):
+    """
+    Record the judgments that have come back, waiting up to timeout seconds for all of them
+    (None: until every one is back). in_flight maps futures to (original index, item). Returns
+    the number recorded; a failed request settles its item as [FAILED_TO_PROCESS].
+    """
+    if in_flight and timeout != 0:
+        wait(list(in_flight), timeout=timeout)
+    landed = [future for future in in_flight if future.done() and not future.cancelled()]
+    for future in landed:
+        original_idx, item = in_flight.pop(future)
+        try:
+            judge.record(item, future.result(), metrics)
+        except Exception as e:
+            logger.error(f"Judging {item['idx']} failed: {str(e)}")
+            item["judgment"] = "[FAILED_TO_PROCESS]"
+            item["is_it_correct"] = False
+            metrics.count("failed_judgments", 1)
+        items[original_idx] = item
+    metrics.count("judged", len(landed))
+    metrics.set_queue_depth(len(in_flight))
+    return len(landed)
+
+def accuracy_so_far(items):
+    """{benchmark: (correct, judged)} over the rows judged so far."""
+    stats = {}
+    for item in items:
+        if "is_it_correct" not in item:
+            continue
+        correct, judged = stats.get(benchmark_of(item), (0, 0))
+        stats[benchmark_of(item)] = (correct + (item["is_it_correct"] == True), judged + 1)
+    return stats
+
+def process_benchmarks(model_path, gpu_per_node, input_file, output_file,
+                      temperature, top_p, top_k, min_p, max_tokens, enable_thinking,
+                      judge="server", judge_address=None, judge_template="detailed_zero_shot",
+                      judge_workers=None, judge_wait=3600.0, o3_max_tokens=16384,
+                      start_index=None, end_index=None, num_samples=None, num_sections=20,
+                      continue_truncated_responses=False, continuation_tokens=4096, max_total_tokens=None,
+                      metrics_file=None, record_dir=None, replay_dir=None, replay_latency=0.0,
+                      requeue=False, walltime_margin=300.0):
+    metrics = RunMetrics("fused_pipeline", metrics_file, logger)
+    # Stop between sections on SIGTERM/SIGUSR1 or before the walltime, instead of losing a section
+    preemption = Preemption(output_file, requeue, walltime_margin, logger=logger, metrics=metrics)
+    start_time = time.time()
+
+    # Load the input file - check if output file exists for resuming
+    with metrics.phase("load"):
+        all_items = load_items(input_file)
+        if num_samples:
+            all_items = expand_instances(all_items, num_samples)
+        if os.path.exists(output_file):
+            logger.info(f"Output file {output_file} exists. Loading from it for resuming...")
+            merge_completed(all_items, load_items(output_file))
+        else:
+            logger.info(f"Loaded {len(all_items)} trial rows from {input_file}")
+
+    # Apply start_index and end_index slicing
+    if start_index is not None or end_index is not None:
+        items = all_items[start_index:end_index]
+        logger.info(f"Processing slice [{start_index}:{end_index}] = {len(items)} items from {input_file}")
+    else:
+        items = all_items
+        logger.info(f"Processing all {len(items)} items from {input_file}")
+
+    # Rows to generate, and rows a previous run generated but did not get judged
+    items_to_generate = []
+    items_to_judge = []
+    for i, item in enumerate(items):
+        if "response" not in item or "extracted_answer" not in item:
+            items_to_generate.append((i, item))
+        elif "judgment" not in item or "is_it_correct" not in item:
+            if item["extracted_answer"] == "[FAILED_TO_PROCESS]":
+                item["judgment"] = ""
+                item["is_it_correct"] = False
+            else:
+                items_to_judge.append((i, item))
+
+    logger.info(f"Found {len(items_to_generate)} items to generate and {len(items_to_judge)} generated items to judge")
+
+    if not items_to_generate and not items_to_judge:
+        logger.info("All items already processed. Exiting.")
+        preemption.finish()
+        return
+
+    judge_queue = (O3JudgeQueue(o3_max_tokens, judge_workers or 32) if judge == "o3"
+                   else ServerJudgeQueue(judge_address, judge_template, judge_workers or 256, wait_seconds=judge_wait))
+    in_flight = {}
+    for original_idx, item in items_to_judge:
+        in_flight[judge_queue.submit(item)] = (original_idx, item)
+
+    if max_total_tokens is None:
+        max_total_tokens = 2 * max_tokens
+
+    def save(label):
+        with metrics.phase("save"):
+            save_items(items, output_file, indent=2)
+        judged_count = sum(1 for item in items if "judgment" in item and "is_it_correct" in item)
+        logger.info(f"Saved {len(items)} total items ({judged_count} judged, {len(in_flight)} being judged) to {output_file} ({label})")
+        stats = accuracy_so_far(items)
+        if stats:
+            logger.info(f"Accuracy so far after {time.time() - start_time:.0f}s: " + ", ".join(
+                f"{benchmark} {correct}/{judged} ({correct / judged:.4f})" for benchmark, (correct, judged) in sorted(stats.items())))
+        metrics.export()
+
+    if items_to_generate:
+        # A replay run serves recorded outputs and never loads the model
+        llm = open_llm(lambda: init_llm(model_path, gpu_per_node), "fused_pipeline",
+                       record_dir, replay_dir, replay_latency, logger)
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        sampling_params = SamplingParams(
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            min_p=min_p,
+            max_tokens=max_tokens
+        )
+
+        # Smaller sections put the first judgments out sooner, larger ones batch generation better
+        section_size = math.ceil(len(items_to_generate) / num_sections)
+
+        for section_idx in range(num_sections):
+            section_items = items_to_generate[section_idx * section_size:(section_idx + 1) * section_size]
+            if not section_items:
+                break
+
+            if preemption.stop_requested():
+                logger.info(f"Stopping before section {section_idx + 1}/{num_sections} ({preemption.reason})")
+                break
+
+            logger.info(f"Processing section {section_idx + 1}/{num_sections} with {len(section_items)} items")
+            with metrics.phase("render"):
+                groups, prompts, group_params = render_groups(tokenizer, sampling_params, section_items, enable_thinking)
+
+            try:
+                logger.info(f"Running vLLM inference for section {section_idx + 1}...")
+                trial_items, responses, finish_reasons = generate_trials(
+                    llm, sampling_params, groups, prompts, group_params, metrics,
+                    continue_truncated_responses, continuation_tokens, max_total_tokens
+                )
+
+                # Extract and queue each answer to the judge; judging runs while the next section generates
+                with metrics.phase("parse"):
+                    for (original_idx, item), response, finish_reason in zip(trial_items, responses, finish_reasons):
+                        response = response.strip()
+                        extracted_answer = extract_final_answer(response)
+                        item["response"] = response
+                        item["extracted_answer"] = extracted_answer if extracted_answer else "[FAILED_TO_PROCESS]"
+                        item["finish_reason"] = finish_reason
+                        if extracted_answer:
+                            in_flight[judge_queue.submit(item)] = (original_idx, item)
+                        else:
+                            item["judgment"] = ""
+                            item["is_it_correct"] = False
+                        items[original_idx] = item
+
+                metrics.count("items", len(trial_items))
+                logger.info(f"Successfully generated section {section_idx + 1}, {len(in_flight)} items being judged")
+
+            except Exception as e:
+                if preemption.requested:
+                    # The stop signal reached the vLLM workers too; the section is left for the resumed run
+                    logger.warning(f"Section {section_idx + 1} interrupted by {preemption.reason}: {str(e)}")
+                else:
+                    logger.error(f"Error processing section {section_idx + 1}: {str(e)}")
+                    # For failed items in this section, mark them as failed
+                    for original_idx, item in section_items:
+                        if "response" not in item:
+                            item["response"] = "[FAILED_TO_PROCESS]"
+                        if "extracted_answer" not in item:
+                            item["extracted_answer"] = "[FAILED_TO_PROCESS]"
+                        item.setdefault("judgment", "")
+                        item.setdefault("is_it_correct", False)
+                        items[original_idx] = item
+
+            collect_judgments(judge_queue, in_flight, items, metrics)
+            save(f"section {section_idx + 1} generated")
+
+    # Generation is done; wait for the judge, saving every DRAIN_SAVE_SECONDS
+    while in_flight and not preemption.requested:
+        logger.info(f"Waiting for {len(in_flight)} judgments...")
+        with metrics.phase("judge"):
+            collect_judgments(judge_queue, in_flight, items, metrics, DRAIN_SAVE_SECONDS)
+        save("judging")
+
+    # Everything completed is saved; unjudged rows keep their answer and are judged by the resumed run
+    if preemption.requested:
+        collect_judgments(judge_queue, in_flight, items, metrics, STOP_GRACE_SECONDS)
+        if in_flight:
+            logger.warning(f"Leaving {len(in_flight)} judgments in flight unanswered after the stop")
+        judge_queue.close()
+        in_flight.clear()
+        save("stopped")
+        preemption.stop(sum(1 for item in items if "judgment" not in item or "is_it_correct" not in item))
+        metrics.log_summary()
+        metrics.export()
+        return
+
+    judge_queue.close()
+
+    # Calculate benchmark-specific statistics
+    benchmark_stats = {}
+    for item in items:
+        benchmark = benchmark_of(item)
+        if benchmark not in benchmark_stats:
+            benchmark_stats[benchmark] = {"total": 0, "correct": 0}
+
+        benchmark_stats[benchmark]["total"] += 1
+        if item.get("is_it_correct") == True:
+            benchmark_stats[benchmark]["correct"] += 1
+
+    logger.info(f"Benchmark-specific statistics:")
+    for benchmark, stats in sorted(benchmark_stats.items()):
+        accuracy = stats["correct"] / stats["total"] if stats["total"] > 0 else 0.0
+        logger.info(f"{benchmark}: {stats['correct']}/{stats['total']} ({accuracy:.4f})")
+
+    preemption.finish()
+    logger.info(f"Successfully processed {len(items_to_generate) + len(items_to_judge)} items and saved to {output_file}")
+    metrics.log_summary()
+    metrics.export()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate, extract and judge in one job, judging each section while the next one generates.")
+    parser.add_argument("--model_path", type=str, required=True, help="Path to the generator model.")
+    parser.add_argument("--gpu_per_node", type=int, default=1, help="Number of GPUs for the generator.")
+    parser.add_argument("--input_file", type=str, required=True, help="Path to the input JSON file.")
+    parser.add_argument("--output_file", type=str, required=True, help="Path to the output JSON file (responses and judgments).")
+    parser.add_argument("--temperature", type=float, default=0.7, help="Temperature for sampling.")
+    parser.add_argument("--top_p", type=float, default=0.8, help="Top-p for sampling.")
+    parser.add_argument("--top_k", type=int, default=20, help="Top-k for sampling.")
+    parser.add_argument("--min_p", type=float, default=0.0, help="Min-p for sampling.")
+    parser.add_argument("--max_tokens", type=int, default=8192, help="Maximum tokens to generate.")
+    parser.add_argument("--enable_thinking", action="store_true", help="Enable thinking mode in chat template.")
+    parser.add_argument("--judge", type=str, default="server", choices=list(JUDGES), help="Judge with a judge_server.py on the same node, or with o3.")
+    parser.add_argument("--judge_address", type=str, help="Address of the judge server (http://host:port or unix:/path/to.sock).")
+    parser.add_argument("--judge_template", type=str, default="detailed_zero_shot", choices=list(TEMPLATES), help="Template the judge server judges with.")
+    parser.add_argument("--judge_workers", type=int, help="Judge requests in flight at once (default: 256 for the server, 32 for o3).")
+    parser.add_argument("--judge_wait", type=float, default=3600.0, help="Seconds to wait for the judge server to come up.")
+    parser.add_argument("--o3_max_tokens", type=int, default=16384, help="Maximum tokens for o3 judgments.")
+    parser.add_argument("--start_index", type=int, help="Start index for data slicing.")
+    parser.add_argument("--end_index", type=int, help="End index for data slicing.")
+    parser.add_argument("--num_samples", type=int, help="Samples per instance when the input has one row per instance (expanded to idx/trial_k).")
+    parser.add_argument("--num_sections", type=int, default=20, help="Generation sections; each is judged while the next one generates.")
+    parser.add_argument("--continue_truncated", action="store_true", help="Continue responses that hit max_tokens before </answer> instead of marking them failed.")
+    parser.add_argument("--continuation_tokens", type=int, default=4096, help="Maximum tokens generated per continuation round.")
+    parser.add_argument("--max_total_tokens", type=int, help="Cap on total response tokens across continuations (default: 2 * max_tokens); each continuation also stops at the context length.")
+    parser.add_argument("--requeue", action="store_true", help="After a stop on SIGTERM/SIGUSR1 or the walltime, requeue the SLURM job with scontrol (needs #SBATCH --requeue).")
+    parser.add_argument("--walltime_margin", type=float, default=300.0, help="Do not start a section unless it is expected to finish this many seconds before the job's end time.")
+    parser.add_argument("--metrics_file", type=str, help="Write phase timings, throughput and latency metrics here (.json, or .prom for a Prometheus textfile).")
+    parser.add_argument("--log_level", type=str, help="Logging level (DEBUG, INFO, WARNING, ERROR; default: $LOG_LEVEL, else INFO).")
+    parser.add_argument("--record_dir", type=str, help="Record every generate() request with its outputs into this directory.")
+    parser.add_argument("--replay_dir", type=str, help="Serve outputs recorded with --record_dir instead of loading the model.")
+    parser.add_argument("--replay_latency", type=float, default=0.0, help="Scale of recorded latencies simulated in replay (0 = memory speed, 1 = as recorded).")
+
+    args = parser.parse_args()
+    if args.log_level:
+        logger.setLevel(args.log_level.upper())
+
+    if args.judge == "server" and not args.judge_address:
+        parser.error("--judge server needs --judge_address")
+
+    process_benchmarks(args.model_path, args.gpu_per_node, args.input_file, args.output_file,
+                      args.temperature, args.top_p, args.top_k, args.min_p, args.max_tokens, args.enable_thinking,
+                      args.judge, args.judge_address, args.judge_template,
+                      args.judge_workers, args.judge_wait, args.o3_max_tokens,
+                      args.start_index, args.end_index, args.num_samples, args.num_sections,
+                      args.continue_truncated, args.continuation_tokens, args.max_total_tokens,
+                      args.metrics_file, args.record_dir, args.replay_dir, args.replay_latency,
+                      args.requeue, args.walltime_margin)
@@ -0,0 +1,49 @@
+#!/bin/bash
+#SBATCH --job-name=[self_motivated_lms]_qwen3_14b_think_fused_qwen25_14b_eval
+#SBATCH --output=qwen3_14b_think_fused_qwen25_14b_eval.txt
+#SBATCH --nodes=1
+#SBATCH --ntasks-per-node=1
+#SBATCH --gpus-per-node=4
+#SBATCH --cpus-per-task=80
+#SBATCH --time=24:00:00
+#SBATCH --signal=B:USR1@900
+#SBATCH --requeue
+#SBATCH --gres=gpu:4
+#SBATCH --mem=1024G
+#SBATCH --account=ram
+#SBATCH --qos=ram_high
+
+export VLLM_WORKER_MULTIPROC_METHOD=spawn
+export NCCL_P2P_DISABLE=1
+export VLLM_DISABLE_COMPILE_CACHE=1
+export VLLM_USE_V1=1
+
+judge_socket="/tmp/judge_${SLURM_JOB_ID}.sock"
+
+# Judge on GPUs 2-3; it ends with the job
+CUDA_VISIBLE_DEVICES=2,3 python3 judge_server.py \
+    --model_path /datasets/pretrained-llms/Qwen2.5-14B-Instruct \
+    --gpu_per_node 2 \
+    --unix_socket "${judge_socket}" \
+    --temperature 0.7 \
+    --top_p 0.8 \
+    --top_k 20 \
+    --min_p 0 \
+    --max_tokens 32768 &
+
+# Generator on GPUs 0-1; waits for the judge server to come up
+CUDA_VISIBLE_DEVICES=0,1 exec python3 fused_pipeline.py \
+    --model_path /datasets/pretrained-llms/Qwen3-14B \
+    --gpu_per_node 2 \
+    --input_file "./benchmarks.json" \
+    --output_file "./qwen3_14b_think_responses/fused_qwen25_14b_eval.json" \
+    --temperature 0.6 \
+    --top_p 0.95 \
+    --top_k 20 \
+    --min_p 0 \
+    --max_tokens 32768 \
+    --enable_thinking \
+    --judge server \
+    --judge_address "unix:${judge_socket}" \
+    --metrics_file "./qwen3_14b_think_responses/fused_qwen25_14b_eval_metrics.json" \
+    --requeue
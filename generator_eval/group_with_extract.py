@@ -1,5 +1,5 @@
-import json
 import os
+from storage import load_items, save_items, is_items_file
 import re
 from typing import Optional
 
@@ -72,16 +72,15 @@ def merge_json_files(directory, prefix, output_file_name):
     # Loop through all files in the directory
     for filename in os.listdir(directory):
         # Check if the file is a JSON file and starts with the prefix
-        if filename.startswith(prefix) and filename.endswith('.json'):
+        if filename.startswith(prefix) and is_items_file(filename):
             file_path = os.path.join(directory, filename)
             try:
-                with open(file_path, 'r') as file:
-                    data = json.load(file)
-                    # Ensure the data is a list of dictionaries
-                    if isinstance(data, list):
-                        merged_data.extend(data)
-                    else:
-                        print(f"Warning: {filename} does not contain a list of dictionaries. Skipping.")
+                data = load_items(file_path)
+                # Ensure the data is a list of dictionaries
+                if isinstance(data, list):
+                    merged_data.extend(data)
+                else:
+                    print(f"Warning: {filename} does not contain a list of dictionaries. Skipping.")
             except Exception as e:
                 print(f"Error reading {filename}: {e}")
     
@@ -103,8 +102,7 @@ def merge_json_files(directory, prefix, output_file_name):
 
     
     # Write the merged data to the output file
-    with open(output_file_name, 'w') as outfile:
-        json.dump(final_data, outfile, indent=4)
+    save_items(final_data, output_file_name, indent=4)
     
     # Print the number of instances in the output file
     print(f"Successfully merged {len(merged_data)} instances into {output_file_name}")
@@ -0,0 +1,95 @@
+"""
+Request hedging for the o3 path: duplicate a request that runs past a tracked latency percentile.
+
+openai_inference asks Hedger.due for the requests in flight. Once min_samples requests have
+completed, a request whose only attempt has run longer than the `percentile` latency of the
+last `window` completed requests (and at least min_delay seconds) gets a second attempt;
+whichever returns first is used. Hedges are capped at max_fraction of the requests dispatched,
+which bounds the extra cost. A losing attempt that has not started yet is cancelled; one
+already running in a worker process cannot be aborted, so its answer is discarded (its usage
+is still charged if it finishes within the section, since it is billed).
+
+The seconds saved by a hedge that won are measured when the original attempt finishes; if it is
+still running when the section ends, the time up to then is counted as a lower bound.
+"""
+import collections
+import math
+
+
+class Hedger:
+    def __init__(self, percentile=0.95, max_fraction=0.05, min_delay=30.0, min_samples=20, window=500,
+                 metrics=None, logger=None):
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self.metrics = metrics
+        self.logger = logger
+        self.dispatched = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.seconds_saved = 0.0
+        self.unfinished_losers = 0
+
+    def count(self, name, value=1):
+        if self.metrics is not None and value:
+            self.metrics.count(name, value)
+
+    def observe(self, latency):
+        """Latency of a completed attempt, measured from its own dispatch."""
+        self.latencies.append(latency)
+
+    def threshold(self):
+        """Seconds after which a request is hedged, or None until enough latencies are known."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return max(self.min_delay, ordered[max(0, math.ceil(self.percentile * len(ordered)) - 1)])
+
+    def due(self, running, now):
+        """
+        Requests to hedge now, from {request: dispatch time} of those with a single attempt
+        running, longest-running first and within the hedge cap.
+        """
+        threshold = self.threshold()
+        if threshold is None:
+            return []
+        overdue = sorted((start, request) for request, start in running.items() if now - start > threshold)
+        allowed = max(0, math.floor(self.max_fraction * self.dispatched) - self.hedges)
+        return [request for _, request in overdue[:allowed]]
+
+    def hedged(self):
+        self.hedges += 1
+        self.count("hedges")
+
+    def won(self):
+        self.hedge_wins += 1
+        self.count("hedge_wins")
+
+    def saved(self, seconds, finished=True):
+        """Time a winning hedge saved over its original attempt (a lower bound if that never finished)."""
+        self.seconds_saved += seconds
+        self.count("hedge_seconds_saved", seconds)
+        if not finished:
+            self.unfinished_losers += 1
+
+    def summary(self):
+        threshold = self.threshold()
+        return {
+            "dispatched": self.dispatched,
+            "hedges": self.hedges,
+            "hedge_fraction": round(self.hedges / self.dispatched, 4) if self.dispatched else None,
+            "hedge_wins": self.hedge_wins,
+            "seconds_saved": round(self.seconds_saved, 1),
+            "unfinished_losers": self.unfinished_losers,
+            "threshold_seconds": round(threshold, 2) if threshold is not None else None,
+        }
+
+    def log(self):
+        if not self.logger:
+            return
+        summary = self.summary()
+        self.logger.info(f"Hedging: {summary['hedges']} hedges for {summary['dispatched']} requests "
+                         f"({summary['hedge_wins']} won), {summary['seconds_saved']}s saved, "
+                         f"threshold {summary['threshold_seconds']}s")
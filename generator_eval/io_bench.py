@@ -0,0 +1,104 @@
+"""
+Size and wall-time tradeoffs of the on-disk formats for real result files.
+
+Each input file is loaded once and then written and read back through the storage layer in
+every requested format (plain, .gz and .zst at several levels, in the plain JSON or the
+normalized layout). Point --work_dir at the shared storage the runs use, since that is where
+the bytes moved matter; reads right after a write may be served from the page cache.
+
+    python3 io_bench.py ./qwen3_14b_think_responses/responses.json --work_dir /shared/scratch/io_bench
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import storage
+from storage import load_items, save_items, strip_compression
+
+DEFAULT_FORMATS = ["none", "gz:1", "gz:6", "zst:1", "zst:3", "zst:9", "zst:19"]
+
+
+def format_path(work_dir, name, codec, layout):
+    suffix = ".trials.jsonl" if layout == "normalized" else ".json"
+    return os.path.join(work_dir, name + suffix + ("" if codec == "none" else "." + codec))
+
+def files_size(path):
+    """Bytes on disk of an output file and, for trial tables, its instance table."""
+    size = os.path.getsize(path)
+    if strip_compression(path).endswith(".trials.jsonl"):
+        instances_path = path.replace(".trials.jsonl", ".instances.jsonl")
+        if os.path.exists(instances_path):
+            size += os.path.getsize(instances_path)
+    return size
+
+def bench_format(items, work_dir, name, codec, level, layout, indent):
+    path = format_path(work_dir, name, codec, layout)
+    start = time.perf_counter()
+    save_items(items, path, indent=indent, level=level)
+    write_seconds = time.perf_counter() - start
+    size = files_size(path)
+
+    # Read the instance table from disk too, not from the per-process cache save_items filled
+    storage._instance_tables.clear()
+    start = time.perf_counter()
+    loaded = load_items(path)
+    read_seconds = time.perf_counter() - start
+    return {
+        "codec": codec,
+        "level": level,
+        "layout": layout,
+        "bytes": size,
+        "write_seconds": round(write_seconds, 3),
+        "read_seconds": round(read_seconds, 3),
+        "round_trip": len(loaded) == len(items) and all(dict(a) == dict(b) for a, b in zip(loaded, items)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compressed and uncompressed storage formats on result files.")
+    parser.add_argument("input_files", type=str, nargs="+", help="Item files to benchmark (any format load_items reads).")
+    parser.add_argument("--formats", type=str, nargs="+", default=DEFAULT_FORMATS, help="Formats as none, gz:<level> or zst:<level>.")
+    parser.add_argument("--layout", type=str, default="plain", choices=["plain", "normalized"], help="On-disk layout written.")
+    parser.add_argument("--indent", type=int, default=2, help="JSON indent of the plain layout, as the drivers write it (-1 for none).")
+    parser.add_argument("--work_dir", type=str, help="Directory the formats are written to (default: a temporary directory).")
+    parser.add_argument("--results_file", type=str, default="io_bench_results.jsonl", help="JSONL file the results are appended to.")
+
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="io_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    indent = None if args.indent < 0 else args.indent
+
+    cases = []
+    try:
+        for input_file in args.input_files:
+            items = load_items(input_file)
+            name = os.path.basename(strip_compression(input_file)).split(".")[0]
+            print(f"{input_file}: {len(items)} items, {os.path.getsize(input_file) / 2**20:.1f} MB on disk")
+            baseline = None
+            for spec in args.formats:
+                codec, _, level = spec.partition(":")
+                result = bench_format(items, work_dir, name, codec, int(level) if level else None, args.layout, indent)
+                result["input_file"] = input_file
+                baseline = baseline or result
+                cases.append(result)
+                print(f"  {spec:>7}: {result['bytes'] / 2**20:9.1f} MB ({baseline['bytes'] / result['bytes']:5.1f}x smaller), "
+                      f"write {result['write_seconds']:7.2f}s, read {result['read_seconds']:7.2f}s"
+                      + ("" if result["round_trip"] else "  ROUND TRIP MISMATCH"))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "work_dir": args.work_dir,
+        "cases": cases,
+    }
+    with open(args.results_file, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Appended results to {args.results_file}")
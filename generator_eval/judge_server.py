@@ -0,0 +1,417 @@
+"""
+Long-lived verification server around the async vLLM engine.
+
+The judge model is loaded once and serves verification requests from any number of clients
+over local HTTP or a Unix socket, using the same templates and judgment parsing as
+qwen_eval.py (chat template) and oss_eval.py (Harmony). Requests are micro-batched: a batch is
+released to the engine when it reaches --max_batch_size or its oldest request has waited
+--max_wait_ms, and high-priority lanes are drained first whenever the engine has free slots.
+
+    python3 judge_server.py --model_path /datasets/pretrained-llms/Qwen3-4B --port 8300
+    python3 judge_server.py --model_path openai/gpt-oss-120b --format harmony --unix_socket /tmp/judge.sock
+
+    POST /verify   {"question", "reference", "candidate", "template", "priority", "deadline_ms"}
+                   or {"items": [...]} for several at once
+    GET  /metrics  queue depth per lane, queue/engine/request latency histograms (Prometheus text)
+    GET  /health
+"""
+import argparse
+import asyncio
+import collections
+import http.client
+import json
+import socket
+import time
+import uuid
+from vllm import AsyncLLMEngine, AsyncEngineArgs, SamplingParams
+from transformers import AutoTokenizer
+from metrics import RunMetrics, get_logger
+from qwen_eval import CONCISE_ZERO_SHOT, DETAILED_ZERO_SHOT, DETAILED_FEW_SHOT, extract_judgment
+
+
+logger = get_logger("judge_server")
+
+TEMPLATES = {
+    "concise_zero_shot": CONCISE_ZERO_SHOT,
+    "detailed_zero_shot": DETAILED_ZERO_SHOT,
+    "detailed_few_shot": DETAILED_FEW_SHOT,
+}
+
+# Drained in this order; the index is also the vLLM scheduling priority (lower runs first)
+LANES = ("high", "normal", "low")
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def fill_template(template, question, reference, candidate):
+    if type(reference) == list:
+        reference = " ".join(reference)
+    return template.replace("[HERE_IS_THE_QUESTION]", question).replace("[HERE_IS_THE_GROUND_TRUTH]", reference).replace("[HERE_IS_THE_CANDIDATE]", candidate)
+
+
+class ChatFormat:
+    """Prompts and parsing as in qwen_eval.py."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.stop = ["<End of Judgment>"]
+        self.stop_token_ids = None
+
+    def prompt(self, content):
+        messages = [
+            {"role": "user", "content": content}
+        ]
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+
+    def parse(self, completion):
+        return completion.text.strip()
+
+
+class HarmonyFormat:
+    """Prompts and parsing as in oss_eval.py."""
+
+    def __init__(self):
+        import oss_eval
+        self.oss_eval = oss_eval
+        self.encoding = oss_eval.load_harmony_encoding(oss_eval.HarmonyEncodingName.HARMONY_GPT_OSS)
+        self.stop = None
+        self.stop_token_ids = self.encoding.stop_tokens_for_assistant_actions()
+
+    def prompt(self, content):
+        oss_eval = self.oss_eval
+        convo = oss_eval.Conversation.from_messages([
+            oss_eval.Message.from_role_and_content(oss_eval.Role.SYSTEM, oss_eval.SystemContent.new()),
+            oss_eval.Message.from_role_and_content(oss_eval.Role.USER, content)
+        ])
+        return {"prompt_token_ids": self.encoding.render_conversation_for_completion(convo, oss_eval.Role.ASSISTANT)}
+
+    def parse(self, completion):
+        return self.oss_eval.parse_completion(self.encoding, completion)
+
+
+class PendingRequest:
+    __slots__ = ("prompt", "lane", "arrival", "deadline", "future")
+
+    def __init__(self, prompt, lane, deadline, future):
+        self.prompt = prompt
+        self.lane = lane
+        self.arrival = time.monotonic()
+        self.deadline = deadline
+        self.future = future
+
+
+class MicroBatcher:
+    """
+    Collects requests per priority lane and releases them to the engine in batches, keeping at
+    most max_in_flight requests inside the engine so queued high-priority work overtakes low.
+    """
+
+    def __init__(self, engine, sampling_params, metrics, max_batch_size=64, max_wait=0.01,
+                 max_in_flight=1024, engine_priority=False):
+        self.engine = engine
+        self.sampling_params = sampling_params
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self.engine_priority = engine_priority
+        self.lanes = {lane: collections.deque() for lane in LANES}
+        self.in_flight = 0
+        self.arrived = asyncio.Event()
+        self.capacity = asyncio.Event()
+
+    def queued(self):
+        return sum(len(queue) for queue in self.lanes.values())
+
+    def submit(self, request):
+        self.lanes[request.lane].append(request)
+        self.metrics.set_queue_depth(self.queued())
+        self.arrived.set()
+
+    def flush_time(self):
+        """When the current batch must go: the oldest request's max_wait or the nearest deadline."""
+        waiting = [request for queue in self.lanes.values() for request in queue]
+        flush_at = min(request.arrival for request in waiting) + self.max_wait
+        deadlines = [request.deadline for request in waiting if request.deadline is not None]
+        return min([flush_at] + deadlines)
+
+    def take(self, size):
+        batch = []
+        now = time.monotonic()
+        for lane in LANES:
+            queue = self.lanes[lane]
+            while queue and len(batch) < size:
+                request = queue.popleft()
+                if request.deadline is not None and now > request.deadline:
+                    self.metrics.count("deadline_exceeded")
+                    request.future.set_exception(DeadlineExceeded("deadline passed while queued"))
+                    continue
+                batch.append(request)
+        return batch
+
+    async def run(self):
+        while True:
+            # Requests left over from a partial take are released without waiting for a new arrival
+            if not self.queued():
+                self.arrived.clear()
+                await self.arrived.wait()
+                continue
+            # Hold the batch open until it is full or its flush time comes
+            while self.queued() < self.max_batch_size:
+                remaining = self.flush_time() - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            while self.in_flight >= self.max_in_flight:
+                self.capacity.clear()
+                await self.capacity.wait()
+
+            batch = self.take(min(self.max_batch_size, self.max_in_flight - self.in_flight))
+            if batch:
+                self.metrics.count("batches")
+                self.metrics.count("batched_requests", len(batch))
+            for request in batch:
+                self.in_flight += 1
+                asyncio.get_running_loop().create_task(self.execute(request))
+            self.metrics.set_queue_depth(self.queued())
+
+    async def execute(self, request):
+        start = time.monotonic()
+        self.metrics.observe_latency(start - request.arrival, "queue")
+        kwargs = {"priority": LANES.index(request.lane)} if self.engine_priority else {}
+        try:
+            final_output = None
+            async for output in self.engine.generate(request.prompt, self.sampling_params, uuid.uuid4().hex, **kwargs):
+                final_output = output
+            if not request.future.done():
+                request.future.set_result(final_output)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            self.in_flight -= 1
+            self.capacity.set()
+            self.metrics.observe_latency(time.monotonic() - start, "engine")
+
+
+class JudgeServer:
+    def __init__(self, engine, output_format, sampling_params, default_template="detailed_zero_shot",
+                 max_batch_size=64, max_wait=0.01, max_in_flight=1024, engine_priority=False):
+        self.output_format = output_format
+        self.default_template = default_template
+        self.metrics = RunMetrics("judge_server", logger=logger)
+        self.batcher = MicroBatcher(engine, sampling_params, self.metrics, max_batch_size, max_wait,
+                                    max_in_flight, engine_priority)
+        self.batcher_task = None
+
+    def start(self):
+        self.batcher_task = asyncio.get_running_loop().create_task(self.batcher.run())
+
+    async def verify(self, request):
+        start = time.monotonic()
+        template = TEMPLATES[request.get("template") or self.default_template]
+        lane = request.get("priority") or "normal"
+        if lane not in LANES:
+            raise ValueError(f"Unknown priority {lane!r}, expected one of {LANES}")
+        reference = request["reference"] if "reference" in request else request["answer"]
+        content = fill_template(template, request["question"], reference, request["candidate"])
+        deadline = start + request["deadline_ms"] / 1000 if request.get("deadline_ms") else None
+
+        future = asyncio.get_running_loop().create_future()
+        self.batcher.submit(PendingRequest(self.output_format.prompt(content), lane, deadline, future))
+        output = await future
+
+        judgment, is_correct = extract_judgment(self.output_format.parse(output.outputs[0]))
+        latency = time.monotonic() - start
+        self.metrics.observe_latency(latency)
+        self.metrics.count("requests")
+        return {"judgment": judgment, "is_correct": is_correct, "latency": round(latency, 4)}
+
+    async def verify_all(self, body):
+        items = body["items"] if "items" in body else [body]
+        results = await asyncio.gather(*(self.verify(item) for item in items), return_exceptions=True)
+        results = [
+            {"error": f"{type(result).__name__}: {result}"} if isinstance(result, Exception) else result
+            for result in results
+        ]
+        return {"results": results} if "items" in body else results[0]
+
+    def prometheus(self):
+        label = f'driver="{self.metrics.driver}"'
+        lines = [self.metrics.to_prometheus().rstrip("\n"), "# TYPE prometheus_rm_lane_queue_depth gauge"]
+        for lane, queue in self.batcher.lanes.items():
+            lines.append(f'prometheus_rm_lane_queue_depth{{{label},lane="{lane}"}} {len(queue)}')
+        lines += [
+            "# TYPE prometheus_rm_in_flight gauge",
+            f"prometheus_rm_in_flight{{{label}}} {self.batcher.in_flight}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "queued": self.batcher.queued(), "in_flight": self.batcher.in_flight}
+        if method == "GET" and path == "/metrics":
+            return 200, self.prometheus()
+        if method == "POST" and path == "/verify":
+            try:
+                request = json.loads(body or b"{}")
+                return 200, await self.verify_all(request)
+            except (KeyError, ValueError) as e:
+                return 400, {"error": f"{type(e).__name__}: {e}"}
+        return 404, {"error": f"Unknown route {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        """Minimal HTTP/1.1 with keep-alive: JSON in, JSON (or Prometheus text) out."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self.route(method, path.split("?")[0], body)
+                if isinstance(payload, str):
+                    data, content_type = payload.encode(), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload).encode(), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {http.client.responses.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8300, unix_socket=None):
+        self.start()
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            logger.info(f"Judge server listening on unix:{unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            logger.info(f"Judge server listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class JudgeClient:
+    """Blocking client; address is http://host:port or unix:/path/to.sock."""
+
+    def __init__(self, address, timeout=600):
+        self.address = address
+        self.timeout = timeout
+
+    def connection(self):
+        if self.address.startswith("unix:"):
+            return UnixHTTPConnection(self.address[len("unix:"):], self.timeout)
+        host_port = self.address.split("://", 1)[-1].rstrip("/")
+        return http.client.HTTPConnection(host_port, timeout=self.timeout)
+
+    def request(self, method, path, payload=None):
+        connection = self.connection()
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = response.read().decode()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"Judge server returned {response.status}: {data}")
+        return data
+
+    def verify(self, items):
+        """Verify a list of {"question", "reference", "candidate", ...} dicts; results come back in order."""
+        return json.loads(self.request("POST", "/verify", {"items": items}))["results"]
+
+    def metrics(self):
+        return self.request("GET", "/metrics")
+
+
+def build_engine(model_path, gpu_per_node, engine_priority):
+    engine_args = AsyncEngineArgs(
+        model=model_path,
+        gpu_memory_utilization=0.9,
+        max_num_batched_tokens=32768,
+        tensor_parallel_size=gpu_per_node,
+        enable_prefix_caching=True,
+        enable_chunked_prefill=True,
+        swap_space=16,
+        max_num_seqs=1024,
+        trust_remote_code=True,
+        **({"scheduling_policy": "priority"} if engine_priority else {})
+    )
+    return AsyncLLMEngine.from_engine_args(engine_args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve judge verifications from a long-lived vLLM engine.")
+    parser.add_argument("--model_path", type=str, required=True, help="Path to the judge model.")
+    parser.add_argument("--gpu_per_node", type=int, default=1, help="Number of GPUs per node.")
+    parser.add_argument("--format", type=str, default="chat", choices=["chat", "harmony"], help="Prompt format: chat template (qwen_eval) or Harmony (oss_eval).")
+    parser.add_argument("--template", type=str, default="detailed_zero_shot", choices=list(TEMPLATES), help="Template used when a request names none.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on.")
+    parser.add_argument("--port", type=int, default=8300, help="Port to listen on.")
+    parser.add_argument("--unix_socket", type=str, help="Listen on this Unix socket instead of TCP.")
+    parser.add_argument("--max_batch_size", type=int, default=64, help="Release a batch to the engine once it has this many requests.")
+    parser.add_argument("--max_wait_ms", type=float, default=10.0, help="Release a batch once its oldest request has waited this long.")
+    parser.add_argument("--max_in_flight", type=int, default=1024, help="Requests inside the engine at once; the rest wait in their priority lane.")
+    parser.add_argument("--engine_priority", action="store_true", help="Also pass lanes to vLLM's priority scheduler.")
+    parser.add_argument("--temperature", type=float, default=0.0, help="Temperature for sampling.")
+    parser.add_argument("--top_p", type=float, default=1.0, help="Top-p for sampling.")
+    parser.add_argument("--top_k", type=int, default=-1, help="Top-k for sampling.")
+    parser.add_argument("--min_p", type=float, default=0.0, help="Min-p for sampling.")
+    parser.add_argument("--max_tokens", type=int, default=8192, help="Maximum tokens to generate.")
+    parser.add_argument("--log_level", type=str, help="Logging level (DEBUG, INFO, WARNING, ERROR; default: $LOG_LEVEL, else INFO).")
+
+    args = parser.parse_args()
+    if args.log_level:
+        logger.setLevel(args.log_level.upper())
+
+    output_format = HarmonyFormat() if args.format == "harmony" else ChatFormat(AutoTokenizer.from_pretrained(args.model_path))
+    sampling_params = SamplingParams(
+        temperature=args.temperature,
+        top_p=args.top_p,
+        top_k=args.top_k,
+        min_p=args.min_p,
+        max_tokens=args.max_tokens,
+        stop=output_format.stop,
+        stop_token_ids=output_format.stop_token_ids
+    )
+    engine = build_engine(args.model_path, args.gpu_per_node, args.engine_priority)
+    server = JudgeServer(engine, output_format, sampling_params, args.template,
+                         args.max_batch_size, args.max_wait_ms / 1000, args.max_in_flight, args.engine_priority)
+    asyncio.run(server.serve(args.host, args.port, args.unix_socket))
@@ -0,0 +1,351 @@
+"""
+Load generator for the judge backends: latency percentiles, throughput and errors per load level.
+
+Judge requests built from a benchmarks or responses file are replayed against a backend at each
+level of a fixed-concurrency sweep (closed loop: every worker sends its next request as soon as
+the previous one returns) or of a target-QPS sweep (open loop: Poisson arrivals, with latency
+measured from the scheduled arrival so a saturated backend shows up as queueing, not as a lower
+send rate). Backends:
+
+    openai        chat.completions as o3_eval.py sends them, to O3_EVAL_BASE_URL / Azure, or to
+                  --base_url (e.g. a `vllm serve` judge, with --model)
+    judge_server  POST /verify on a running judge_server.py (--address)
+
+With --stand_in the backend is a local stand-in instead (the fake OpenAI server or a judge server
+on the fake async engine), so the tool runs offline; --stand_in_capacity and
+--stand_in_latency shape its saturation curve. --drain_check sends one burst above the in-flight
+cap with no arrivals after it and fails unless every request returns. Each level's results are
+printed and appended to --results_file.
+
+    python3 load_test.py --input_file ./qwen3_4b_think_responses/responses.json --backend openai --concurrency 1 8 32 64 128
+    python3 load_test.py --input_file ./benchmarks.json --backend judge_server --address unix:/tmp/judge.sock --qps 5 10 20 50
+    python3 load_test.py --input_file ./benchmarks.json --backend openai --stand_in --stand_in_capacity 32 --concurrency 8 32 128
+    python3 load_test.py --input_file ./benchmarks.json --backend judge_server --stand_in --stand_in_capacity 16 --concurrency 64 --requests_per_level 256 --drain_check 100
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import load_items
+
+
+def judge_requests(items, limit=None, seed=0):
+    """(question, reference, candidate) per item; benchmark files without responses judge the answer against itself."""
+    requests = []
+    for item in items:
+        if "question" not in item or "answer" not in item:
+            continue
+        reference = " ".join(item["answer"]) if type(item["answer"]) == list else item["answer"]
+        candidate = item.get("extracted_answer")
+        if not candidate or candidate == "[FAILED_TO_PROCESS]":
+            candidate = reference
+        requests.append((item["question"], reference, candidate))
+    random.Random(seed).shuffle(requests)
+    return requests[:limit] if limit else requests
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return round(sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)], 4)
+
+def error_name(error):
+    status = getattr(error, "status_code", None)
+    return f"{type(error).__name__} {status}" if status else type(error).__name__
+
+
+class OpenAIBackend:
+    """chat.completions as o3_eval.py sends them; retries are off so every error is counted."""
+
+    def __init__(self, base_url=None, model=None, max_tokens=8192, api_key=None):
+        from openai import OpenAI
+        from o3_eval import DETAILED_ZERO_SHOT, chat_request, create_client
+        self.template = DETAILED_ZERO_SHOT
+        self.chat_request = chat_request
+        self.model = model
+        self.max_tokens = max_tokens
+        if base_url:
+            self.client = OpenAI(base_url=base_url, api_key=api_key or os.environ.get("O3_EVAL_API_KEY", "EMPTY"), max_retries=0)
+        else:
+            self.client = create_client().with_options(max_retries=0)
+
+    def send(self, request):
+        """Prompt and completion tokens of one judged request."""
+        question, reference, candidate = request
+        content = self.template.replace("[HERE_IS_THE_QUESTION]", question).replace("[HERE_IS_THE_GROUND_TRUTH]", reference).replace("[HERE_IS_THE_CANDIDATE]", candidate)
+        body = self.chat_request({"role": "user", "content": content}, self.max_tokens)
+        if self.model:
+            body["model"] = self.model
+        completion = self.client.chat.completions.create(**body)
+        if completion.usage is None:
+            return None, None
+        return completion.usage.prompt_tokens, completion.usage.completion_tokens
+
+
+class JudgeServerBackend:
+    """POST /verify on judge_server.py, one item per request; it reports no token counts."""
+
+    def __init__(self, address, template=None, priority="normal", timeout=600):
+        from judge_server import JudgeClient
+        self.client = JudgeClient(address, timeout)
+        self.template = template
+        self.priority = priority
+
+    def send(self, request):
+        question, reference, candidate = request
+        result = self.client.verify([{"question": question, "reference": reference, "candidate": candidate,
+                                      "template": self.template, "priority": self.priority}])[0]
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return None, None
+
+
+def start_stand_in(backend, capacity, latency, error_rate, work_dir):
+    """Start a local stand-in for the backend; returns (address or base URL, stop function)."""
+    import fake_backends
+    fake_backends.install_fake_modules()
+    if backend == "openai":
+        server = fake_backends.FakeOpenAIServer(mean_words=50, latency=latency, error_rate=error_rate, capacity=capacity).start()
+        return server.base_url, server.stop
+
+    import judge_server
+    engine = fake_backends.FakeAsyncLLMEngine(fake_backends.FakeLLM(mean_words=50), seconds_per_request=latency)
+    output_format = judge_server.ChatFormat(fake_backends.FakeTokenizer())
+    sampling_params = fake_backends.FakeSamplingParams(max_tokens=8192, stop=output_format.stop)
+    server = judge_server.JudgeServer(engine, output_format, sampling_params, max_in_flight=capacity or 1024)
+    socket_path = os.path.join(work_dir, "judge.sock")
+    loop = asyncio.new_event_loop()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.create_task(server.serve(unix_socket=socket_path))
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+    # The server's daemon thread ends with the process
+    return f"unix:{socket_path}", lambda: None
+
+
+class LoadLevel:
+    """Outcomes of the requests sent at one load level."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.first_start = None
+        self.last_end = None
+
+    def send(self, backend, request, scheduled=None):
+        start = time.monotonic()
+        error = None
+        tokens = (None, None)
+        try:
+            tokens = backend.send(request)
+        except Exception as e:
+            error = error_name(e)
+        end = time.monotonic()
+        with self.lock:
+            self.first_start = min(self.first_start or start, scheduled or start)
+            self.last_end = max(self.last_end or end, end)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                return
+            # Open-loop latency counts from the scheduled arrival, including time queued in the client
+            self.latencies.append(end - (scheduled or start))
+            self.prompt_tokens += tokens[0] or 0
+            self.completion_tokens += tokens[1] or 0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        num_errors = sum(self.errors.values())
+        total = len(latencies) + num_errors
+        elapsed = (self.last_end - self.first_start) if total else 0.0
+        rate = (lambda count: round(count / elapsed, 3) if elapsed else None)
+        return {
+            "requests": total,
+            "succeeded": len(latencies),
+            "errors": num_errors,
+            "error_rate": round(num_errors / total, 4) if total else None,
+            "errors_by_type": self.errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_rps": rate(len(latencies)),
+            "prompt_tokens_per_second": rate(self.prompt_tokens) if self.prompt_tokens else None,
+            "completion_tokens_per_second": rate(self.completion_tokens) if self.completion_tokens else None,
+            "latency_mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_p99": percentile(latencies, 0.99),
+            "latency_max": round(latencies[-1], 4) if latencies else None,
+        }
+
+
+def run_concurrency(backend, requests, concurrency, duration, max_requests=None):
+    """Closed loop: `concurrency` workers send back to back until duration or max_requests is reached."""
+    level = LoadLevel()
+    pending = itertools.islice(itertools.cycle(requests), max_requests)
+    pending_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            with pending_lock:
+                request = next(pending, None)
+            if request is None:
+                return
+            level.send(backend, request)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return level
+
+def check_drain(backend, requests, burst, timeout):
+    """
+    Send `burst` requests at once and nothing after them; returns how many came back within timeout.
+    With a burst above the server's in-flight cap, a batcher that waits for a new arrival before
+    releasing what it left queued never answers the tail.
+    """
+    level = LoadLevel()
+    threads = [threading.Thread(target=level.send, args=(backend, request), daemon=True)
+               for request in itertools.islice(itertools.cycle(requests), burst)]
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    with level.lock:
+        return len(level.latencies) + sum(level.errors.values())
+
+def run_qps(backend, requests, qps, duration, max_requests=None, max_in_flight=1024, seed=0):
+    """Open loop: Poisson arrivals at `qps` for duration (or max_requests), at most max_in_flight sent at once."""
+    level = LoadLevel()
+    rng = random.Random(seed)
+    num_requests = int(qps * duration)
+    if max_requests:
+        num_requests = min(num_requests, max_requests)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        start = time.monotonic()
+        arrival = start
+        for request in itertools.islice(itertools.cycle(requests), num_requests):
+            arrival += rng.expovariate(qps)
+            delay = arrival - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(level.send, backend, request, arrival)
+    return level
+
+def format_seconds(value):
+    return f"{value:8.3f}" if value is not None else "       -"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure judge backend latency, throughput and errors across load levels.")
+    parser.add_argument("--input_file", type=str, required=True, help="Benchmarks or responses file the judge requests are built from.")
+    parser.add_argument("--backend", type=str, default="openai", choices=["openai", "judge_server"], help="Backend to load.")
+    parser.add_argument("--base_url", type=str, help="OpenAI-compatible endpoint (default: O3_EVAL_BASE_URL, else Azure o3).")
+    parser.add_argument("--model", type=str, help="Model name sent to --base_url (default: o3).")
+    parser.add_argument("--address", type=str, default="http://127.0.0.1:8300", help="judge_server.py address (http://host:port or unix:/path).")
+    parser.add_argument("--template", type=str, help="judge_server.py template name (default: the server's).")
+    parser.add_argument("--priority", type=str, default="normal", choices=["high", "normal", "low"], help="judge_server.py priority lane.")
+    parser.add_argument("--max_tokens", type=int, default=8192, help="Maximum tokens to generate (openai backend).")
+    parser.add_argument("--concurrency", type=int, nargs="+", help="Closed-loop sweep: in-flight requests per level.")
+    parser.add_argument("--qps", type=float, nargs="+", help="Open-loop sweep: target requests per second per level.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds per level.")
+    parser.add_argument("--requests_per_level", type=int, help="Stop a level after this many requests.")
+    parser.add_argument("--max_in_flight", type=int, default=1024, help="Open loop: cap on requests in flight (arrivals beyond it queue in the client).")
+    parser.add_argument("--num_prompts", type=int, help="Distinct prompts drawn from the input file (default: all).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the prompt order and the arrival times.")
+    parser.add_argument("--stop_error_rate", type=float, default=0.5, help="Stop the sweep after a level with at least this error rate.")
+    parser.add_argument("--stand_in", action="store_true", help="Run against a local stand-in of the backend instead (offline).")
+    parser.add_argument("--stand_in_capacity", type=int, default=32, help="Requests the stand-in serves at once; the rest queue.")
+    parser.add_argument("--stand_in_latency", type=float, default=0.2, help="Seconds per request of the stand-in (the openai one varies it 0.5x-2.5x per prompt).")
+    parser.add_argument("--stand_in_error_rate", type=float, default=0.0, help="Fraction of stand-in requests failing with a 500 (openai backend).")
+    parser.add_argument("--drain_check", type=int, help="After the sweep, send a burst of this many requests with none after it and fail unless all return (set it above the server's in-flight cap).")
+    parser.add_argument("--drain_timeout", type=float, default=60.0, help="Seconds the --drain_check burst has to finish.")
+    parser.add_argument("--results_file", type=str, default="load_test_results.jsonl", help="JSONL file the results are appended to.")
+
+    args = parser.parse_args()
+    if bool(args.concurrency) == bool(args.qps):
+        parser.error("pass exactly one of --concurrency and --qps")
+
+    requests = judge_requests(load_items(args.input_file), args.num_prompts, args.seed)
+    if not requests:
+        parser.error(f"no items with a question and answer in {args.input_file}")
+    print(f"{len(requests)} judge requests from {args.input_file}")
+
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    stop_stand_in = None
+    address, base_url = args.address, args.base_url
+    if args.stand_in:
+        endpoint, stop_stand_in = start_stand_in(args.backend, args.stand_in_capacity, args.stand_in_latency,
+                                                 args.stand_in_error_rate, work_dir)
+        address = base_url = endpoint
+        print(f"Stand-in {args.backend} backend at {endpoint} (capacity {args.stand_in_capacity}, {args.stand_in_latency}s per request)")
+
+    if args.backend == "openai":
+        backend = OpenAIBackend(base_url, args.model, args.max_tokens)
+    else:
+        backend = JudgeServerBackend(address, args.template, args.priority)
+
+    mode = "concurrency" if args.concurrency else "qps"
+    levels = []
+    try:
+        print(f"{mode:>11} {'requests':>8} {'errors':>7} {'req/s':>8} {'tok/s':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for value in args.concurrency or args.qps:
+            if mode == "concurrency":
+                level = run_concurrency(backend, requests, value, args.duration, args.requests_per_level)
+            else:
+                level = run_qps(backend, requests, value, args.duration, args.requests_per_level, args.max_in_flight, args.seed)
+            result = {mode: value, **level.summary()}
+            levels.append(result)
+            tokens = result["completion_tokens_per_second"]
+            print(f"{value:>11} {result['requests']:>8} {result['errors']:>7} {result['throughput_rps'] or 0:>8.2f} "
+                  f"{tokens if tokens is not None else '-':>9} {format_seconds(result['latency_p50'])} "
+                  f"{format_seconds(result['latency_p95'])} {format_seconds(result['latency_p99'])}"
+                  + (f"  {result['errors_by_type']}" if result["errors"] else ""))
+            if result["error_rate"] is not None and result["error_rate"] >= args.stop_error_rate:
+                print(f"Stopping the sweep: error rate {result['error_rate']:.1%} at {mode} {value}")
+                break
+        if args.drain_check:
+            finished = check_drain(backend, requests, args.drain_check, args.drain_timeout)
+            print(f"Drain check: {finished} of {args.drain_check} burst requests returned within {args.drain_timeout:g}s")
+            drained = finished == args.drain_check
+    finally:
+        if stop_stand_in is not None:
+            stop_stand_in()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "input_file": args.input_file,
+        "backend": args.backend,
+        "endpoint": "stand_in" if args.stand_in else (address if args.backend == "judge_server" else base_url or os.environ.get("O3_EVAL_BASE_URL") or "azure"),
+        "mode": mode,
+        "duration": args.duration,
+        "levels": levels,
+    }
+    if args.drain_check:
+        record["drain_check"] = {"burst": args.drain_check, "drained": drained}
+    with open(args.results_file, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Appended results to {args.results_file}")
+    if args.drain_check and not drained:
+        raise SystemExit("Drain check failed: requests were left queued after arrivals stopped")
@@ -0,0 +1,220 @@
+"""
+Per-phase timing, throughput and latency metrics shared by the drivers.
+
+Each driver creates one RunMetrics, wraps its phases (load, tokenize, render, generate/api,
+parse, save) in `with metrics.phase(...)`, and exports after every section so partial runs
+still leave a metrics file behind. A path ending in .prom is written in the Prometheus
+textfile format, anything else as JSON.
+"""
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def get_logger(name, level=None):
+    """Leveled logger writing to stderr; the level defaults to $LOG_LEVEL or INFO."""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel((level or os.environ.get("LOG_LEVEL", "INFO")).upper())
+    return logger
+
+def peak_rss_bytes():
+    """Peak resident set size of this process and its finished children (ru_maxrss is in KB on Linux)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * 1024
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Approximate quantile from the bucket upper bounds."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "mean": round(self.total / self.count, 4) if self.count else None,
+            "max": round(self.max, 4),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+            "overflow": self.counts[-1],
+        }
+
+
+class RunMetrics:
+    def __init__(self, driver, metrics_file=None, logger=None):
+        self.driver = driver
+        self.metrics_file = metrics_file
+        self.logger = logger
+        self.start_time = time.time()
+        self.phase_seconds = {}
+        self.phase_calls = {}
+        self.phase_last = {}
+        self.counters = {}
+        self.latency = {}
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + duration
+            self.phase_calls[name] = self.phase_calls.get(name, 0) + 1
+            self.phase_last[name] = duration
+            if self.logger:
+                self.logger.debug(f"Phase {name} took {duration:.2f} seconds")
+
+    def last_duration(self, name):
+        return self.phase_last.get(name, 0.0)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_tokens(self, prompt_tokens=0, output_tokens=0):
+        self.count("prompt_tokens", prompt_tokens)
+        self.count("output_tokens", output_tokens)
+
+    def observe_latency(self, seconds, name="request"):
+        if name not in self.latency:
+            self.latency[name] = LatencyHistogram()
+        self.latency[name].observe(seconds)
+
+    def set_queue_depth(self, depth):
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_vllm_outputs(self, outputs):
+        """Token counts and, when vLLM reports them, per-request latencies of a generate() call."""
+        for output in outputs:
+            self.add_tokens(
+                len(output.prompt_token_ids or []),
+                sum(len(completion.token_ids) for completion in output.outputs)
+            )
+            request_metrics = getattr(output, "metrics", None)
+            arrival_time = getattr(request_metrics, "arrival_time", None)
+            finished_time = getattr(request_metrics, "finished_time", None)
+            if arrival_time and finished_time:
+                self.observe_latency(finished_time - arrival_time)
+
+    def summary(self):
+        elapsed = time.time() - self.start_time
+        generate_seconds = self.phase_seconds.get("generate", 0.0) + self.phase_seconds.get("api", 0.0)
+        throughput = {}
+        for name in ("prompt_tokens", "output_tokens", "items"):
+            if name in self.counters and generate_seconds > 0:
+                throughput[f"{name}_per_second"] = round(self.counters[name] / generate_seconds, 2)
+        return {
+            "driver": self.driver,
+            "elapsed_seconds": round(elapsed, 2),
+            "phases": {
+                name: {"seconds": round(seconds, 4), "calls": self.phase_calls[name]}
+                for name, seconds in self.phase_seconds.items()
+            },
+            "counters": dict(self.counters),
+            "throughput": throughput,
+            "queue_depth": {"current": self.queue_depth, "max": self.max_queue_depth},
+            "peak_rss_bytes": peak_rss_bytes(),
+            "latency": {name: histogram.to_dict() for name, histogram in self.latency.items()},
+        }
+
+    def to_prometheus(self):
+        summary = self.summary()
+        label = f'driver="{self.driver}"'
+        lines = [
+            "# TYPE prometheus_rm_elapsed_seconds gauge",
+            f"prometheus_rm_elapsed_seconds{{{label}}} {summary['elapsed_seconds']}",
+            "# TYPE prometheus_rm_phase_seconds_total counter",
+        ]
+        for name, phase in summary["phases"].items():
+            lines.append(f'prometheus_rm_phase_seconds_total{{{label},phase="{name}"}} {phase["seconds"]}')
+        lines.append("# TYPE prometheus_rm_events_total counter")
+        for name, value in summary["counters"].items():
+            lines.append(f'prometheus_rm_events_total{{{label},name="{name}"}} {value}')
+        lines.append("# TYPE prometheus_rm_throughput gauge")
+        for name, value in summary["throughput"].items():
+            lines.append(f'prometheus_rm_throughput{{{label},name="{name}"}} {value}')
+        lines += [
+            "# TYPE prometheus_rm_queue_depth_max gauge",
+            f"prometheus_rm_queue_depth_max{{{label}}} {self.max_queue_depth}",
+            "# TYPE prometheus_rm_peak_rss_bytes gauge",
+            f"prometheus_rm_peak_rss_bytes{{{label}}} {summary['peak_rss_bytes']}",
+            "# TYPE prometheus_rm_request_latency_seconds histogram",
+        ]
+        for name, histogram in self.latency.items():
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'prometheus_rm_request_latency_seconds_bucket{{{label},name="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'prometheus_rm_request_latency_seconds_bucket{{{label},name="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'prometheus_rm_request_latency_seconds_sum{{{label},name="{name}"}} {histogram.total}')
+            lines.append(f'prometheus_rm_request_latency_seconds_count{{{label},name="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Write the current metrics to metrics_file (no-op when unset)."""
+        if not self.metrics_file:
+            return
+        tmp_path = self.metrics_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            if self.metrics_file.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+        os.replace(tmp_path, self.metrics_file)
+
+    def log_summary(self):
+        if not self.logger:
+            return
+        summary = self.summary()
+        phases = ", ".join(f"{name}={phase['seconds']:.1f}s" for name, phase in summary["phases"].items())
+        self.logger.info(f"Phase times: {phases}")
+        if summary["throughput"]:
+            throughput = ", ".join(f"{name}={value}" for name, value in summary["throughput"].items())
+            self.logger.info(f"Throughput: {throughput}")
+        for name, histogram in summary["latency"].items():
+            self.logger.info(f"Latency [{name}]: p50<={histogram['p50']}s p95<={histogram['p95']}s p99<={histogram['p99']}s max={histogram['max']}s")
+        self.logger.info(f"Peak RSS: {summary['peak_rss_bytes'] / 2**30:.2f} GiB, max queue depth: {self.max_queue_depth}")
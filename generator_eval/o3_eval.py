@@ -1,15 +1,39 @@
-from openai import AzureOpenAI
-import json
+from openai import AzureOpenAI, OpenAI
 import os
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import argparse
 import time
 import math
-import re
 from transformers import AutoTokenizer
+from storage import load_items, save_items, merge_completed, benchmark_of
+from metrics import RunMetrics, get_logger
+from replay import Recorder, ReplayStore, replay_chat_completions
+from budget import DEFAULT_PRICES, UsageBudget, usage_summary, balanced_order
+from batch_api import BatchRunner, MAX_BATCH_LINES
+from sequential import SequentialEstimator
+from hedging import Hedger
+from packing import Packer, split_usage
+from preflight import Preflight
+from preemption import Preemption
+from template_compiler import fill_template, judge_fields
 
 
+logger = get_logger("o3_eval")
+
+BATCH_DISCOUNT = 0.5
+
+# Failed requests are retried with backoff only for these statuses (and 5xx / connection errors)
+RETRYABLE_STATUS = {408, 409, 429}
+MAX_RETRIES = 12
+# Seconds between checks for requests to hedge (or a stop) while waiting on the API
+HEDGE_POLL_SECONDS = 1.0
+# Seconds requests in flight are still waited for after a stop (SLURM kills 30 s after SIGTERM by default)
+STOP_GRACE_SECONDS = 15.0
+# o3 has a 200k-token window; prompts are counted with the Qwen tokenizer, so leave a margin
+O3_CONTEXT_LENGTH = 190000
+# Most output tokens o3 generates for one request, reasoning included
+O3_MAX_COMPLETION_TOKENS = 100000
 
 CONCISE_ZERO_SHOT = """### Question: [HERE_IS_THE_QUESTION]
 
@@ -79,6 +103,10 @@ def validate_output(text):
     return False, None
 
 def create_client():
+    # Point at any OpenAI-compatible endpoint (e.g. a local stand-in server) instead of Azure
+    base_url = os.environ.get("O3_EVAL_BASE_URL")
+    if base_url:
+        return OpenAI(base_url=base_url, api_key=os.environ.get("O3_EVAL_API_KEY", "EMPTY"))
     API_key = "90679b494bad4e729238716195bced48"
     return AzureOpenAI(
         api_version="2025-02-01-preview",  # latest API version
@@ -86,42 +114,199 @@ def create_client():
         azure_endpoint=f"https://azure-services-fair-openai1-eastus2n2.azure-api.net",
     )
 
+def judge_prompt(item):
+    # Handle answer format
+    if type(item["answer"]) == list:
+        ground_truth = " ".join(item["answer"])
+    else:
+        ground_truth = item["answer"]
+    
+    # prompt_content = DETAILED_FEW_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
+    
+    # prompt_content = CONCISE_ZERO_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
+    
+    prompt_content = DETAILED_ZERO_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
+    
+    return {
+        "role": "user",
+        "content": prompt_content
+    }
+
+def fields_prompt(fields):
+    """judge_prompt from (question, ground truth, candidate) fields, for re-rendering truncated candidates."""
+    return {"role": "user", "content": fill_template(DETAILED_ZERO_SHOT, fields)}
+
+def chat_request(prompt, max_tokens):
+    return {"model": "o3", "messages": [prompt], "max_completion_tokens": max_tokens}
+
+def retryable(error):
+    """Connection errors, timeouts, rate limits and server errors are retried; other 4xx never succeed."""
+    status = getattr(error, "status_code", None)
+    return status is None or status in RETRYABLE_STATUS or status >= 500
+
 def process_prompt(prompt, max_tokens):
     client = create_client()
-    while True:
+    start_time = time.time()
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            completion = client.chat.completions.create(
-                model="o3",
-                messages=[prompt],
-                max_completion_tokens=max_tokens
-            )
-            return completion.choices[0].message.content
+            completion = client.chat.completions.create(**chat_request(prompt, max_tokens))
+            return {
+                "content": completion.choices[0].message.content,
+                "latency": time.time() - start_time,
+                "usage": completion.usage.model_dump() if completion.usage is not None else None
+            }
         except Exception as e:
-            time.sleep(5)  # Wait for 5 seconds before retrying
-            print(f"Error processing prompt: {e}")
-            continue
+            logger.warning(f"Error processing prompt: {e}")
+            if not retryable(e) or attempt == MAX_RETRIES:
+                # Returned rather than raised, so the rest of the section is still judged
+                return {"content": None, "latency": time.time() - start_time, "usage": None, "error": str(e),
+                        "retryable": retryable(e)}
+            time.sleep(min(60, 5 * 2 ** attempt))
 
-def openai_inference(prompts, max_tokens):
-    results = []
+def openai_inference(prompts, max_tokens, metrics=None, recorder=None, replay=None, budget=None, hedger=None,
+                     preemption=None):
+    """
+    Run the prompts with at most max_workers requests in flight; max_tokens is shared or one per
+    prompt (as clamped by preflight). Returns, in prompt order,
+    process_prompt's {"content", "latency", "usage"} (with "error" and "retryable" instead of
+    content when the request failed) or None for prompts the budget kept back.
+    With a hedger, slow requests get a second attempt and the first answer is used. Once
+    preemption requests a stop, nothing more is dispatched and the requests in flight are
+    waited for STOP_GRACE_SECONDS; those still running are left as None.
+    """
+    results = [None] * len(prompts)
+    if not isinstance(max_tokens, list):
+        max_tokens = [max_tokens] * len(prompts)
     
     max_workers = 32
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_prompt = {
-            executor.submit(process_prompt, prompt, max_tokens): prompt 
-            for prompt in prompts
-        }
-        
-        # Process results as they complete
-        for future in tqdm(
-            future_to_prompt, 
-            total=len(prompts), 
-            desc="Processing evaluations"
-        ):
-            x = future.result()
-            print(x)
-            results.append(x)
+    if replay is not None:
+        requests = [chat_request(prompt, prompt_max_tokens) for prompt, prompt_max_tokens in zip(prompts, max_tokens)]
+        for i, x in enumerate(replay_chat_completions(replay, requests, max_workers)):
+            # Replayed usage is charged too, so budget cut-offs can be rehearsed offline
+            if budget is not None:
+                if budget.exhausted():
+                    break
+                budget.charge(usage_summary(x["usage"]))
+            if metrics is not None and x["latency"]:
+                metrics.observe_latency(x["latency"])
+            results[i] = x
+        return results
     
+    pending = iter(range(len(prompts)))
+    in_flight = {}
+    # Per prompt with a request in flight: dispatch time of its first attempt and its number of attempts
+    open_prompts = {}
+    attempts = {}
+    hedges = set()
+    # Attempts that lost to the other attempt of their prompt but are still running, and when a hedge won
+    losers = {}
+    hedge_won_at = {}
+    completed = 0
+    # Hedges and losing attempts get a few workers of their own, so they rarely hold back dispatch
+    hedge_workers = 2 * math.ceil(max_workers * hedger.max_fraction) if hedger is not None else 0
+    executor = ProcessPoolExecutor(max_workers=max_workers + hedge_workers)
+    try:
+        with tqdm(total=len(prompts), desc="Processing evaluations") as progress:
+            def submit(i):
+                future = executor.submit(process_prompt, prompts[i], max_tokens[i])
+                in_flight[future] = i
+                attempts[i] = attempts.get(i, 0) + 1
+                return future
+            
+            def dispatch():
+                # Top up to max_workers prompts in flight unless the budget is spent or a stop was requested
+                while len(open_prompts) < max_workers:
+                    if preemption is not None and preemption.requested:
+                        return
+                    if budget is not None and budget.exhausted(len(in_flight)):
+                        return
+                    i = next(pending, None)
+                    if i is None:
+                        return
+                    open_prompts[i] = time.time()
+                    submit(i)
+                    if hedger is not None:
+                        hedger.dispatched += 1
+            
+            def hedge():
+                running = {i: start for i, start in open_prompts.items() if attempts[i] == 1}
+                for i in hedger.due(running, time.time()):
+                    if budget is not None and budget.exhausted(len(in_flight)):
+                        return
+                    hedges.add(submit(i))
+                    hedger.hedged()
+            
+            def finish_loser(future, i):
+                # A discarded answer is still billed
+                x = future.result()
+                if x["content"] is not None:
+                    hedger.observe(x["latency"])
+                if budget is not None:
+                    budget.charge(usage_summary(x["usage"]))
+                if i in hedge_won_at:
+                    hedger.saved(time.time() - hedge_won_at.pop(i))
+            
+            dispatch()
+            while in_flight:
+                polling = hedger is not None or preemption is not None
+                done, _ = wait(list(in_flight) + list(losers), timeout=HEDGE_POLL_SECONDS if polling else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in losers:
+                        finish_loser(future, losers.pop(future))
+                        continue
+                    i = in_flight.pop(future)
+                    x = future.result()
+                    if hedger is not None:
+                        if x["content"] is not None:
+                            hedger.observe(x["latency"])
+                        others = [other for other, j in in_flight.items() if j == i]
+                        # A failed attempt only counts once no other attempt of its prompt can still answer
+                        if x["content"] is None and others:
+                            continue
+                        for other in others:
+                            del in_flight[other]
+                            if not other.cancel():
+                                losers[other] = i
+                        if future in hedges:
+                            hedger.won()
+                            hedge_won_at[i] = time.time()
+                        x["latency"] = time.time() - open_prompts[i]
+                    del open_prompts[i]
+                    logger.debug(x["content"])
+                    if recorder is not None and x["content"] is not None:
+                        recorder.record(chat_request(prompts[i], max_tokens[i]), {"content": x["content"]}, x["usage"], x["latency"])
+                    if budget is not None:
+                        budget.charge(usage_summary(x["usage"]))
+                        progress.set_postfix(cost=f"${budget.cost_usd:.2f}", tokens=budget.total_tokens)
+                    completed += 1
+                    if metrics is not None:
+                        metrics.observe_latency(x["latency"])
+                        metrics.set_queue_depth(len(prompts) - completed)
+                    results[i] = x
+                    progress.update(1)
+                if preemption is not None and preemption.requested:
+                    if time.time() - preemption.requested_at > STOP_GRACE_SECONDS:
+                        logger.warning(f"Leaving {len(set(in_flight.values()))} requests in flight unanswered after the stop")
+                        break
+                    continue
+                if hedger is not None:
+                    hedge()
+                dispatch()
+    finally:
+        # Losing attempts still running are left to finish in their workers; the section does not wait for them
+        unfinished = False
+        for future, i in losers.items():
+            if future.done():
+                finish_loser(future, i)
+                continue
+            unfinished = True
+            if i in hedge_won_at:
+                hedger.saved(time.time() - hedge_won_at.pop(i), finished=False)
+        executor.shutdown(wait=not (unfinished or in_flight), cancel_futures=True)
+    
+    if recorder is not None:
+        recorder.flush()
     return results
 
 def extract_judgment(judgment_str: str) -> tuple[str, bool]:
@@ -140,50 +325,234 @@ def calculate_tokens(tokenizer, text):
     tokens = tokenizer.encode(text, add_special_tokens=False)
     return len(tokens)
 
-def process_benchmarks(input_file, output_file, max_tokens):
+def judge_with_batches(all_items, items_to_process, output_file, max_tokens, metrics, budget, recorder,
+                       poll_interval, max_poll_interval, max_attempts, max_lines, preflight=None, preemption=None,
+                       prompt_length=None):
+    """
+    Judge items through the Batch API, saving results as each batch finishes. With a budget, only
+    requests whose projected cost fits are submitted; more follow as finished batches report usage.
+    """
+    # Batch requests are billed at half the synchronous price
+    budget.prices = {name: price * BATCH_DISCOUNT for name, price in budget.prices.items()}
+    
+    # idx alone is not unique (RealMath restarts numbering per split), so the position goes along
+    requests = {}
+    positions = {}
+    with metrics.phase("render"):
+        prompts = [judge_prompt(item) for _, item in items_to_process]
+    if preflight is not None:
+        with metrics.phase("preflight"):
+            items_to_process, prompts = preflight.admit(items_to_process, prompts, judge_fields)
+    for (original_idx, item), prompt in zip(items_to_process, prompts):
+        custom_id = f"{item['idx']}#{original_idx}"
+        requests[custom_id] = chat_request(prompt, max_tokens if preflight is None else preflight.max_tokens_of(item))
+        positions[custom_id] = original_idx
+    
+    def on_results(bodies):
+        with metrics.phase("parse"):
+            judged_count = 0
+            for custom_id, body in bodies.items():
+                original_idx = positions.get(custom_id)
+                if original_idx is None:
+                    continue
+                item = all_items[original_idx]
+                content = body["choices"][0]["message"]["content"]
+                judgment, is_correct = extract_judgment(content)
+                item["judgment"] = judgment
+                item["is_it_correct"] = is_correct
+                item["usage"] = usage_summary(body.get("usage"))
+                all_items[original_idx] = item
+                budget.charge(item["usage"])
+                if recorder is not None:
+                    recorder.record(requests[custom_id], {"content": content}, body.get("usage"))
+                judged_count += 1
+        metrics.count("items", judged_count)
+        if recorder is not None:
+            recorder.flush()
+        with metrics.phase("save"):
+            save_items(all_items, output_file, indent=4)
+        logger.info(f"Saved {judged_count} batch results to {output_file}")
+        budget.log()
+        metrics.export()
+        submit_within_budget()
+    
+    runner = BatchRunner(
+        create_client(), output_file + ".batches.json",
+        max_lines=max_lines, poll_interval=poll_interval, max_poll_interval=max_poll_interval,
+        max_attempts=max_attempts, logger=logger
+    )
+    if runner.in_flight():
+        logger.info(f"Resuming {len(runner.in_flight())} in-flight batches from {runner.checkpoint_file}")
+    
+    # Spend is only known once batches finish, so every request is projected from its prompt tokens
+    # and the expected completion at batch prices before it is submitted
+    prompt_tokens = {}
+    if budget.limited:
+        with metrics.phase("tokenize"):
+            for custom_id, request in requests.items():
+                prompt_tokens[custom_id] = prompt_length(request["messages"][0])
+    
+    def submit_within_budget():
+        # Judged requests, requests in flight and requests out of attempts are never submitted again
+        in_flight_ids = runner.in_flight_ids()
+        remaining = [custom_id for custom_id in requests
+                     if custom_id not in in_flight_ids and "judgment" not in all_items[positions[custom_id]]
+                     and runner.checkpoint["attempts"].get(custom_id, 0) < max_attempts]
+        if not budget.limited:
+            if remaining:
+                runner.submit({custom_id: requests[custom_id] for custom_id in remaining})
+            return
+        # Requests in flight whose usage is not charged yet are projected too
+        projected_tokens, projected_usd = 0, 0.0
+        for custom_id in in_flight_ids:
+            if custom_id in positions and "judgment" not in all_items[positions[custom_id]]:
+                tokens, usd = budget.request_estimate(prompt_tokens[custom_id])
+                projected_tokens += tokens
+                projected_usd += usd
+        selected = {}
+        for custom_id in remaining:
+            tokens, usd = budget.request_estimate(prompt_tokens[custom_id])
+            if budget.projected_over(projected_tokens + tokens, projected_usd + usd):
+                break
+            projected_tokens += tokens
+            projected_usd += usd
+            selected[custom_id] = requests[custom_id]
+        if len(selected) < len(remaining):
+            logger.info(f"Budget: submitting {len(selected)} of {len(remaining)} remaining requests, "
+                        f"projected to ${budget.cost_usd + projected_usd:.2f} and {budget.total_tokens + projected_tokens:.0f} tokens")
+        if selected:
+            runner.submit(selected)
+    
+    with metrics.phase("api"):
+        submit_within_budget()
+        metrics.set_queue_depth(len(runner.in_flight_ids()))
+        runner.run(on_results, lambda: preemption is not None and preemption.requested)
+
+def judge_packed(packer, section_items, prompts, max_tokens, all_items, metrics, recorder, replay, budget, hedger, preemption):
+    """
+    Judge a section's packable items with packed prompts. Returns the (items, prompts) left to
+    judge one by one: items that were not packed and items whose pair could not be read back.
+    """
+    prompt_of = {original_idx: prompt for (original_idx, _), prompt in zip(section_items, prompts)}
+    with metrics.phase("pack"):
+        packs, singles = packer.pack(section_items)
+    if not packs:
+        return section_items, prompts
+    
+    logger.info(f"Judging {sum(len(group) for group, _ in packs)} items in {len(packs)} packed prompts...")
+    # Every pair gets the completion room of a single-item request, up to o3's output limit
+    with metrics.phase("api"):
+        outputs = openai_inference([{"role": "user", "content": content} for _, content in packs],
+                                   min(max_tokens * packer.pack_size, O3_MAX_COMPLETION_TOKENS),
+                                   metrics, recorder, replay, budget, hedger, preemption)
+    
+    fallbacks = []
+    judged_count = 0
+    with metrics.phase("parse"):
+        for (group, _), output in zip(packs, outputs):
+            # Kept back by the budget; left unjudged for a later run
+            if output is None:
+                continue
+            if output["content"] is None:
+                logger.warning(f"Packed request for {group[0][1]['idx']} and {len(group) - 1} more failed: {output['error']}")
+                fallbacks.extend(group)
+                continue
+            sections = packer.unpack(output["content"], len(group))
+            judged = [(slot, pair, section) for slot, (pair, section) in enumerate(zip(group, sections), 1) if section is not None]
+            fallbacks.extend(pair for pair, section in zip(group, sections) if section is None)
+            # The request's usage is kept on the items it judged, so a resumed run charges it again
+            for (slot, (original_idx, item), section), usage in zip(judged, split_usage(usage_summary(output["usage"]), len(judged))):
+                judgment, is_correct = extract_judgment(section)
+                item["judgment"] = judgment
+                item["is_it_correct"] = is_correct
+                item["usage"] = usage
+                item["packed"] = {"slot": slot, "size": len(group)}
+                all_items[original_idx] = item
+                judged_count += 1
+    metrics.count("items", judged_count)
+    if fallbacks:
+        logger.info(f"{len(fallbacks)} packed items could not be read back; judging them one by one")
+        packer.fell_back(len(fallbacks))
+    
+    remaining = singles + fallbacks
+    return remaining, [prompt_of[original_idx] for original_idx, _ in remaining]
+
+def process_benchmarks(input_file, output_file, max_tokens, metrics_file=None,
+                       record_dir=None, replay_dir=None, replay_latency=0.0,
+                       budget_tokens=None, budget_usd=None, prices=None,
+                       order="input", benchmark_priority=None, seed=0,
+                       batch=False, batch_poll_interval=30.0, batch_max_poll_interval=600.0,
+                       batch_max_attempts=3, batch_max_lines=MAX_BATCH_LINES,
+                       target_half_width=None, confidence=0.95, estimate_level="benchmark",
+                       round_size=512, min_per_stratum=10, estimate_file=None,
+                       max_model_len=O3_CONTEXT_LENGTH, overlength_policy="truncate", routed_file=None,
+                       hedge=False, hedge_percentile=0.95, hedge_max_fraction=0.05, hedge_min_delay=30.0,
+                       pack_size=1, pack_by="question", requeue=False, walltime_margin=300.0,
+                       expected_completion_tokens=None):
+    if batch and target_half_width is not None:
+        raise ValueError("Sequential estimation judges in rounds and cannot be combined with batch mode")
+    if batch and pack_size > 1:
+        raise ValueError("Packed prompts are judged with synchronous requests and cannot be combined with batch mode")
+    metrics = RunMetrics("o3_eval", metrics_file, logger)
+    # Stop between sections on SIGTERM/SIGUSR1 or before the walltime, instead of losing a section
+    preemption = Preemption(output_file, requeue, walltime_margin, logger=logger, metrics=metrics)
+    budget = UsageBudget(budget_tokens, budget_usd, prices, metrics, logger)
+    # Latencies are tracked across sections, so the hedge threshold carries over
+    hedger = Hedger(hedge_percentile, hedge_max_fraction, hedge_min_delay, metrics=metrics, logger=logger) if hedge else None
+    
+    # Record API answers for later offline reruns, or serve a recorded run instead of calling o3
+    recorder = Recorder(record_dir, "o3_eval") if record_dir else None
+    replay = ReplayStore(replay_dir, replay_latency) if replay_dir else None
+    if replay is not None:
+        logger.info(f"Replaying {replay.num_records} recorded requests from {replay_dir}")
+    
     # Initialize tokenizer for token counting
     tokenizer = AutoTokenizer.from_pretrained("/datasets/pretrained-llms/Qwen3-4B")
     
     # Load the input file - check if output file exists for resuming
-    if os.path.exists(output_file):
-        print(f"Output file {output_file} exists. Loading from it for resuming...")
-        with open(output_file, "r") as f:
-            completed_items = json.load(f)
+    with metrics.phase("load"):
+        if os.path.exists(output_file):
+            logger.info(f"Output file {output_file} exists. Loading from it for resuming...")
+            completed_items = load_items(output_file)
         
-        # Load original data from input file
-        with open(input_file, "r") as f:
-            all_items = json.load(f)
+            # Load original data from input file
+            all_items = load_items(input_file)
         
-        # Merge completed items back into all_items by matching idx
-        completed_dict = {item["idx"]: item for item in completed_items}
-        for idx, item in enumerate(all_items):
-            if item["idx"] in completed_dict:
-                all_items[idx] = completed_dict[item["idx"]]
-    else:
-        print(f"Loading from input file {input_file}")
-        with open(input_file, "r") as f:
-            all_items = json.load(f)
+            # Merge completed items back into all_items by matching idx
+            merge_completed(all_items, completed_items)
+        else:
+            logger.info(f"Loading from input file {input_file}")
+            all_items = load_items(input_file)
+    
+    # The budget covers the whole output file, so usage recorded by earlier runs counts against it
+    for item in all_items:
+        if item.get("usage"):
+            budget.charge(item["usage"], live=False)
+    if budget.requests:
+        logger.info("Usage recorded by earlier runs:")
+        budget.log()
     
     # First, handle items using simple string comparison (AIME/GPQA) or failed to process
     aime_gpqa_processed_count = 0
     failed_to_process_count = 0
     
-    for i, item in enumerate(all_items):
-        # Add token count for response if not already present
-        if "response_tokens" not in item and "response" in item:
-            item["response_tokens"] = calculate_tokens(tokenizer, item["response"])
-            all_items[i] = item
-        
-        if ("judgment" not in item or "is_it_correct" not in item):
-            # Handle [FAILED_TO_PROCESS] cases
-            if item.get("extracted_answer") == "[FAILED_TO_PROCESS]":
-                item["judgment"] = ""
-                item["is_it_correct"] = False
+    with metrics.phase("tokenize"):
+        for i, item in enumerate(all_items):
+            # Add token count for response if not already present
+            if "response_tokens" not in item and "response" in item:
+                item["response_tokens"] = calculate_tokens(tokenizer, item["response"])
                 all_items[i] = item
-                failed_to_process_count += 1
+        
+            if ("judgment" not in item or "is_it_correct" not in item):
+                # Handle [FAILED_TO_PROCESS] cases
+                if item.get("extracted_answer") == "[FAILED_TO_PROCESS]":
+                    item["judgment"] = ""
+                    item["is_it_correct"] = False
+                    all_items[i] = item
+                    failed_to_process_count += 1
     
-    print(f"Processed {aime_gpqa_processed_count} items with 'AIME' or 'GPQA' in idx using simple string comparison")
-    print(f"Processed {failed_to_process_count} '[FAILED_TO_PROCESS]' items")
+    logger.info(f"Processed {aime_gpqa_processed_count} items with 'AIME' or 'GPQA' in idx using simple string comparison")
+    logger.info(f"Processed {failed_to_process_count} '[FAILED_TO_PROCESS]' items")
     
     # Filter items that need OpenAI evaluation (not AIME/GPQA, not failed, don't have judgment)
     items_to_process = []
@@ -192,92 +561,165 @@ def process_benchmarks(input_file, output_file, max_tokens):
             ("judgment" not in item or "is_it_correct" not in item)):
             items_to_process.append((i, item))
     
-    print(f"Found {len(items_to_process)} items that need OpenAI evaluation")
+    logger.info(f"Found {len(items_to_process)} items that need OpenAI evaluation")
     
     if not items_to_process:
-        print("All items already processed. Exiting.")
+        logger.info("All items already processed. Exiting.")
+        preemption.finish()
         return
     
-    # Split into 10 sections
-    num_sections = 10
-    section_size = math.ceil(len(items_to_process) / num_sections)
+    # Interleave benchmarks so a run stopped by its budget is still a balanced sample
+    if order == "balanced":
+        items_to_process = balanced_order(items_to_process, benchmark_of, benchmark_priority, seed)
     
-    for section_idx in range(num_sections):
-        start_idx = section_idx * section_size
-        end_idx = min((section_idx + 1) * section_size, len(items_to_process))
-        
-        if start_idx >= len(items_to_process):
-            break
+    # Sequential estimation judges random rounds only until the accuracies are pinned
+    estimator = None
+    if target_half_width is not None:
+        estimator = SequentialEstimator(all_items, benchmark_of, target_half_width, confidence, estimate_level,
+                                        round_size, min_per_stratum, seed, logger)
+    
+    # Over-length prompts are truncated, skipped or routed before they reach the API, where they fail with a 400
+    def prompt_length(prompt):
+        return calculate_tokens(tokenizer, prompt["content"])
+    preflight = Preflight(max_model_len, max_tokens, lambda fields_list: [fields_prompt(fields) for fields in fields_list],
+                          prompt_length, overlength_policy, logger, metrics)
+    
+    # Until usage comes back, the budget projects a typical prompt and the expected completion per request
+    if budget.limited:
+        sample = items_to_process[:64]
+        mean_prompt_tokens = sum(prompt_length(judge_prompt(item)) for _, item in sample) / len(sample)
+        budget.expect(mean_prompt_tokens, expected_completion_tokens or max_tokens)
+    
+    # Several pairs per request share one copy of the guidelines; unreadable pairs are judged again singly
+    packer = None
+    if pack_size > 1 and max_tokens * pack_size > O3_MAX_COMPLETION_TOKENS:
+        # Groups only as large as o3's output limit leaves every pair max_tokens
+        fitting = max(1, O3_MAX_COMPLETION_TOKENS // max_tokens)
+        logger.warning(f"--pack_size {pack_size} x --max_tokens {max_tokens} exceeds o3's {O3_MAX_COMPLETION_TOKENS} "
+                       f"output tokens per request; packing {fitting} items per request instead")
+        pack_size = fitting
+    if pack_size > 1:
+        packer = Packer(DETAILED_ZERO_SHOT, pack_size, pack_by,
+                        lambda content: prompt_length({"role": "user", "content": content}) <= max_model_len - max_tokens * pack_size,
+                        metrics, logger)
+    
+    if batch and replay is None:
+        judge_with_batches(all_items, items_to_process, output_file, max_tokens, metrics, budget, recorder,
+                           batch_poll_interval, batch_max_poll_interval, batch_max_attempts, batch_max_lines, preflight,
+                           preemption, prompt_length)
+    else:
+        # Split into 10 sections
+        num_sections = 10
+        section_size = math.ceil(len(items_to_process) / num_sections)
+        sections = (items_to_process[start:start + section_size] for start in range(0, len(items_to_process), section_size))
+        if estimator is not None:
+            # Random rounds from the benchmarks whose interval is still too wide, until none is
+            sections = estimator.rounds(items_to_process)
+            num_sections = estimator.max_rounds(items_to_process)
+    
+        for section_idx, section_items in enumerate(sections):
+            if preemption.stop_requested():
+                logger.info(f"Stopping before section {section_idx + 1}/{num_sections} ({preemption.reason})")
+                break
+            if budget.exhausted():
+                logger.info(f"Budget reached, not dispatching sections {section_idx + 1}-{num_sections}")
+                break
             
-        section_items = items_to_process[start_idx:end_idx]
-        print(f"Processing section {section_idx + 1}/{num_sections} with {len(section_items)} items")
+            logger.info(f"Processing section {section_idx + 1}/{num_sections} with {len(section_items)} items")
         
-        # Prepare prompts for this section
-        prompts = []
-        for _, item in section_items:
-            # Handle answer format
-            if type(item["answer"]) == list:
-                ground_truth = " ".join(item["answer"])
-            else:
-                ground_truth = item["answer"]
-            
-            # prompt_content = DETAILED_FEW_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
-            
-            # prompt_content = CONCISE_ZERO_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
-            
-            prompt_content = DETAILED_ZERO_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
-            
-            prompts.append({
-                "role": "user",
-                "content": prompt_content
-            })
+            # Prepare prompts for this section
+            with metrics.phase("render"):
+                prompts = [judge_prompt(item) for _, item in section_items]
+            with metrics.phase("preflight"):
+                section_items, prompts = preflight.admit(section_items, prompts, judge_fields)
         
-        try:
-            # Run OpenAI inference for this section
-            print(f"Running OpenAI inference for section {section_idx + 1}...")
-            batch_outputs = openai_inference(prompts, max_tokens)
+            try:
+                if packer is not None:
+                    section_items, prompts = judge_packed(packer, section_items, prompts, max_tokens, all_items,
+                                                          metrics, recorder, replay, budget, hedger, preemption)
+                
+                # Run OpenAI inference for this section
+                logger.info(f"Running OpenAI inference for section {section_idx + 1}...")
+                metrics.set_queue_depth(len(prompts))
+                with metrics.phase("api"):
+                    batch_outputs = openai_inference(prompts, [preflight.max_tokens_of(item) for _, item in section_items],
+                                                     metrics, recorder, replay, budget, hedger, preemption)
             
-            # Process results and add to items
-            for (original_idx, item), judgment_output in zip(section_items, batch_outputs):
-                judgment, is_correct = extract_judgment(judgment_output)
+                # Process results and add to items
+                dispatched_count = 0
+                with metrics.phase("parse"):
+                    for (original_idx, item), output in zip(section_items, batch_outputs):
+                        # Kept back by the budget; left unjudged for a later run
+                        if output is None:
+                            continue
+                        if output["content"] is None and output["retryable"]:
+                            # Out of retries on a rate limit, server or connection error; left unjudged for a rerun
+                            logger.error(f"Request for {item['idx']} failed after {MAX_RETRIES} retries, left for a rerun: {output['error']}")
+                            metrics.count("retries_exhausted", 1)
+                            continue
+                        if output["content"] is None:
+                            # The API rejected the request for good (e.g. a 400); not retried on resume
+                            logger.error(f"Request for {item['idx']} failed: {output['error']}")
+                            item["judgment"] = "[FAILED_TO_PROCESS]"
+                            item["is_it_correct"] = False
+                            all_items[original_idx] = item
+                            metrics.count("failed_requests", 1)
+                            continue
+                        judgment, is_correct = extract_judgment(output["content"])
                 
-                # Add judgment and is_it_correct
-                item["judgment"] = judgment
-                item["is_it_correct"] = is_correct
+                        # Add judgment and is_it_correct
+                        item["judgment"] = judgment
+                        item["is_it_correct"] = is_correct
+                        item["usage"] = usage_summary(output["usage"])
                 
-                # Update the original item in the all_items list
-                all_items[original_idx] = item
+                        # Update the original item in the all_items list
+                        all_items[original_idx] = item
+                        dispatched_count += 1
             
-            print(f"Successfully processed section {section_idx + 1}")
+                metrics.count("items", dispatched_count)
+                logger.info(f"Successfully processed section {section_idx + 1}")
             
-        except Exception as e:
-            print(f"Error processing section {section_idx + 1}: {str(e)}")
-            # For failed items in this section, mark them as failed
-            for original_idx, item in section_items:
-                if "judgment" not in item:
-                    item["judgment"] = "[FAILED_TO_PROCESS]"
-                if "is_it_correct" not in item:
-                    item["is_it_correct"] = False
-                all_items[original_idx] = item
+            except Exception as e:
+                if preemption.requested:
+                    # Unanswered items are left for the resumed run
+                    logger.warning(f"Section {section_idx + 1} interrupted by {preemption.reason}: {str(e)}")
+                else:
+                    logger.error(f"Error processing section {section_idx + 1}: {str(e)}")
+                    # For failed items in this section, mark them as failed
+                    for original_idx, item in section_items:
+                        if "judgment" not in item:
+                            item["judgment"] = "[FAILED_TO_PROCESS]"
+                        if "is_it_correct" not in item:
+                            item["is_it_correct"] = False
+                        all_items[original_idx] = item
         
-        # Save progress after each section - save all items
-        with open(output_file, "w") as f:
-            json.dump(all_items, f, indent=4, ensure_ascii=False)
-        print(f"Saved {len(all_items)} total items to {output_file} (section {section_idx + 1} completed)")
+            # Save progress after each section - save all items
+            with metrics.phase("save"):
+                save_items(all_items, output_file, indent=4)
+            logger.info(f"Saved {len(all_items)} total items to {output_file} (section {section_idx + 1} completed)")
         
-        # Log the number of items processed so far
-        processed_count = sum(1 for item in all_items if "judgment" in item and "is_it_correct" in item)
-        print(f"Total items processed so far: {processed_count}")
+            # Log the number of items processed so far
+            processed_count = sum(1 for item in all_items if "judgment" in item and "is_it_correct" in item)
+            logger.info(f"Total items processed so far: {processed_count}")
+            budget.log()
+            if hedger is not None:
+                hedger.log()
+            if packer is not None:
+                packer.log()
+            metrics.export()
+    
+    # Everything answered is saved; record the stop and requeue instead of reporting a partial run
+    if preemption.requested:
+        preemption.stop(sum(1 for item in all_items if "judgment" not in item or "is_it_correct" not in item))
+        budget.log()
+        metrics.log_summary()
+        metrics.export()
+        return
     
     # Calculate benchmark-specific statistics
     benchmark_stats = {}
     for item in all_items:
-        idx = item.get("idx", "")
-        if "/" in idx:
-            benchmark = idx.split("/")[0]
-        else:
-            benchmark = "unknown"
-            
+        benchmark = benchmark_of(item)
         if benchmark not in benchmark_stats:
             benchmark_stats[benchmark] = {"total": 0, "correct": 0}
         
@@ -285,20 +727,86 @@ def process_benchmarks(input_file, output_file, max_tokens):
         if item.get("is_it_correct") == True:
             benchmark_stats[benchmark]["correct"] += 1
     
-    print(f"\nBenchmark-specific statistics:")
+    logger.info(f"Benchmark-specific statistics:")
     for benchmark, stats in sorted(benchmark_stats.items()):
         accuracy = stats["correct"] / stats["total"] if stats["total"] > 0 else 0.0
-        print(f"{benchmark}: {stats['correct']}/{stats['total']} ({accuracy:.4f})")
+        logger.info(f"{benchmark}: {stats['correct']}/{stats['total']} ({accuracy:.4f})")
+    
+    if estimator is not None:
+        # The counts above take unjudged items as incorrect; these are the sampled estimates
+        estimator.log_report()
+        estimator.save(estimate_file or output_file + ".estimate.json")
+    
+    preflight.log_report()
+    preflight.save(output_file + ".preflight.json")
+    preflight.save_routed(routed_file or output_file + ".routed.json")
     
-    print(f"\nSuccessfully processed {len(items_to_process)} items and saved to {output_file}")
+    remaining_count = sum(1 for item in all_items if "judgment" not in item or "is_it_correct" not in item)
+    if remaining_count and estimator is None:
+        logger.info(f"{remaining_count} items were not judged within the budget; rerun with a larger budget to resume them")
+    budget.log()
+    preemption.finish()
+    logger.info(f"Successfully processed {len(items_to_process) - remaining_count} items and saved to {output_file}")
+    metrics.log_summary()
+    metrics.export()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate responses using O3 model.")
     parser.add_argument("--input_file", type=str, required=True, help="Path to the input JSON file.")
     parser.add_argument("--output_file", type=str, required=True, help="Path to the output JSON file.")
     parser.add_argument("--max_tokens", type=int, default=8192, help="Maximum tokens to generate.")
+    parser.add_argument("--metrics_file", type=str, help="Write phase timings, throughput and latency metrics here (.json, or .prom for a Prometheus textfile).")
+    parser.add_argument("--log_level", type=str, help="Logging level (DEBUG, INFO, WARNING, ERROR; default: $LOG_LEVEL, else INFO).")
+    parser.add_argument("--record_dir", type=str, help="Record every request with its response and usage into this directory.")
+    parser.add_argument("--replay_dir", type=str, help="Serve responses recorded with --record_dir instead of calling the API.")
+    parser.add_argument("--replay_latency", type=float, default=0.0, help="Scale of recorded latencies simulated in replay (0 = memory speed, 1 = as recorded).")
+    parser.add_argument("--budget_tokens", type=int, help="Stop dispatching once prompt + completion tokens reach this (including earlier runs on the output file).")
+    parser.add_argument("--budget_usd", type=float, help="Stop dispatching once the estimated cost in USD reaches this.")
+    parser.add_argument("--expected_completion_tokens", type=int, help="Completion tokens per request the budget projects until real usage is known (default: --max_tokens).")
+    parser.add_argument("--price_input", type=float, default=DEFAULT_PRICES["input"], help="USD per 1M uncached prompt tokens.")
+    parser.add_argument("--price_cached_input", type=float, default=DEFAULT_PRICES["cached_input"], help="USD per 1M cached prompt tokens.")
+    parser.add_argument("--price_output", type=float, default=DEFAULT_PRICES["output"], help="USD per 1M completion tokens (reasoning included).")
+    parser.add_argument("--order", type=str, default="input", choices=["input", "balanced"], help="Dispatch order: input order, or interleaved across benchmarks (shuffled within each).")
+    parser.add_argument("--benchmark_priority", type=str, nargs="+", help="With --order balanced, benchmarks dispatched before the others.")
+    parser.add_argument("--seed", type=int, default=0, help="Shuffle seed for --order balanced.")
+    parser.add_argument("--batch", action="store_true", help="Submit through the Batch API instead of synchronous requests; in-flight batches are checkpointed in <output_file>.batches.json.")
+    parser.add_argument("--batch_poll_interval", type=float, default=30.0, help="Initial seconds between batch status polls.")
+    parser.add_argument("--batch_max_poll_interval", type=float, default=600.0, help="Cap on the poll interval as it backs off.")
+    parser.add_argument("--batch_max_attempts", type=int, default=3, help="Submissions per request before a failing line is given up on.")
+    parser.add_argument("--batch_max_lines", type=int, default=MAX_BATCH_LINES, help="Requests per batch file.")
+    parser.add_argument("--target_half_width", type=float, help="Sequential estimation: judge random rounds until every benchmark's accuracy interval is within ± this (e.g. 0.01).")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the sequential estimation intervals.")
+    parser.add_argument("--estimate_level", type=str, default="benchmark", choices=["benchmark", "stratum"], help="Stop per benchmark, or per (benchmark, category) stratum.")
+    parser.add_argument("--round_size", type=int, default=512, help="Items judged per sequential estimation round.")
+    parser.add_argument("--min_per_stratum", type=int, default=10, help="Items judged in every stratum before a benchmark can stop.")
+    parser.add_argument("--estimate_file", type=str, help="Where to write the estimates (default: <output_file>.estimate.json).")
+    parser.add_argument("--hedge", action="store_true", help="Send a second attempt for requests slower than --hedge_percentile of recent latencies and use whichever answers first.")
+    parser.add_argument("--hedge_percentile", type=float, default=0.95, help="Latency percentile of recent requests after which a request is hedged.")
+    parser.add_argument("--hedge_max_fraction", type=float, default=0.05, help="Cap on hedges as a fraction of the requests dispatched (bounds the extra cost).")
+    parser.add_argument("--hedge_min_delay", type=float, default=30.0, help="Never hedge a request younger than this many seconds.")
+    parser.add_argument("--pack_size", type=int, default=1, help="Judge up to this many items per request with a packed prompt (1 = one item per request).")
+    parser.add_argument("--pack_by", type=str, default="question", choices=["question", "any"], help="Pack only items sharing a question (e.g. the trials of an instance), or any items in input order.")
+    parser.add_argument("--max_model_len", type=int, default=O3_CONTEXT_LENGTH, help="Context window prompts are checked against, counted with the Qwen tokenizer; prompts that leave it less than --max_tokens get max_tokens clamped, those that do not fit are handled by --overlength_policy.")
+    parser.add_argument("--overlength_policy", type=str, default="truncate", choices=["truncate", "skip", "route"], help="Over-length prompts: truncate the candidate, skip the item, or route it to --routed_file for another judge.")
+    parser.add_argument("--routed_file", type=str, help="Where routed items are written (default: <output_file>.routed.json).")
+    parser.add_argument("--requeue", action="store_true", help="After a stop on SIGTERM/SIGUSR1 or the walltime, requeue the SLURM job with scontrol (needs #SBATCH --requeue).")
+    parser.add_argument("--walltime_margin", type=float, default=300.0, help="Do not start a section unless it is expected to finish this many seconds before the job's end time.")
     
     args = parser.parse_args()
+    if args.log_level:
+        logger.setLevel(args.log_level.upper())
     
-    process_benchmarks(args.input_file, args.output_file, args.max_tokens)
+    prices = {"input": args.price_input, "cached_input": args.price_cached_input, "output": args.price_output}
+    process_benchmarks(args.input_file, args.output_file, args.max_tokens, args.metrics_file,
+                       args.record_dir, args.replay_dir, args.replay_latency,
+                       args.budget_tokens, args.budget_usd, prices,
+                       args.order, args.benchmark_priority, args.seed,
+                       args.batch, args.batch_poll_interval, args.batch_max_poll_interval,
+                       args.batch_max_attempts, args.batch_max_lines,
+                       args.target_half_width, args.confidence, args.estimate_level,
+                       args.round_size, args.min_per_stratum, args.estimate_file,
+                       args.max_model_len, args.overlength_policy, args.routed_file,
+                       args.hedge, args.hedge_percentile, args.hedge_max_fraction, args.hedge_min_delay,
+                       args.pack_size, args.pack_by, args.requeue, args.walltime_margin,
+                       args.expected_completion_tokens)
     
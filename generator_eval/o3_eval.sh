@@ -6,12 +6,16 @@
 #SBATCH --gpus-per-node=1
 #SBATCH --cpus-per-task=80
 #SBATCH --time=24:00:00
+#SBATCH --signal=B:USR1@900
+#SBATCH --requeue
 #SBATCH --gres=gpu:1
 #SBATCH --mem=1024G
 #SBATCH --account=ram
 #SBATCH --qos=alignment_shared
 
-python3 o3_eval.py \
+exec python3 o3_eval.py \
     --input_file "./qwen3_235b_think_responses/responses.json" \
     --output_file "./qwen3_235b_think_responses/detailed_zero_shot_results.json" \
-    --max_tokens 16384
\ No newline at end of file
+    --max_tokens 16384 \
+    --metrics_file "./qwen3_235b_think_responses/detailed_zero_shot_metrics.json" \
+    --requeue
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Packed judge prompts: several (ground truth, candidate) pairs judged in one API request.
+
+A single-item prompt spends most of its input tokens on the guidelines, and the trials of an
+instance repeat the same question. Packer groups a section's items (by identical question, or in
+input order with --pack_by any), renders each group as one prompt with the guidelines once and
+numbered pairs, and asks for a "### Pair k" heading and a final judgment per pair:
+
+    ### Question: ...            (once when the pairs share it, else inside every pair)
+    ### Pair 1
+    ### Candidate 1: ...
+    ### Candidate 2: ...
+    ### Pair 2
+    ...
+    ### Guidelines: rules 1-9 of the single-item template, and a rule 10 asking for one
+    "### Pair k" section with one final judgment per pair
+
+Packer.unpack maps the response back to the group's items by pair number. A slot is malformed
+when its heading is missing or repeated, or its section has no final judgment or conflicting
+ones; those items (and every item of a request that failed) are judged again with the
+single-item prompt, so a bad packed answer costs a retry and never a wrong verdict.
+"""
+import re
+
+from template_compiler import judge_fields
+
+PACK_BY = ("question", "any")
+
+PACKED_RULE = """<Rule 10> Judge the pairs one at a time, in order and independently of each other. For each pair, start a new line with \"### Pair k\" (k is the number of the pair), reason about whether its two candidates are equivalent based on the rules above (read through all of them, not only one), and then output \"Final Judgment: Yes <End of Judgment>\" if they are equivalent or \"Final Judgment: No <End of Judgment>\" if not. Most importantly, DO NOT MAKE a judgment first. Output exactly one final judgment for each of the {} pairs.
+
+### Reasoning:
+"""
+
+# A heading is a line of its own: "### Pair 2", "Pair 2:", "**Pair 2**"
+HEADING = re.compile(r"^[ \t]*(?:#+[ \t]*|\*\*)?Pair[ \t]+(\d+)[ \t]*:?[ \t]*(?:\*\*)?[ \t]*$", re.MULTILINE)
+VERDICT = re.compile(r"Final Judgment: (Yes|No)")
+
+
+def packed_rules(template):
+    """Rules 1-9 of a detailed single-item judge template; rule 10 is replaced for packed prompts."""
+    return template[template.index("DO NOT ATTEMPT TO SOLVE"):template.index("<Rule 10>")]
+
+def split_usage(usage, parts):
+    """A request's usage summary divided over its items, the remainder going to the first, so totals are kept."""
+    if not usage or not parts:
+        return [None] * parts
+    shares = [{name: count // parts for name, count in usage.items()} for _ in range(parts)]
+    for name, count in usage.items():
+        shares[0][name] += count - parts * (count // parts)
+    return shares
+
+
+class Packer:
+    """
+    Groups of a section's items rendered as packed prompts. fits(content) says whether a packed
+    prompt leaves room for its completion; groups that do not fit are judged one by one.
+    """
+
+    def __init__(self, template, pack_size=4, pack_by="question", fits=None, metrics=None, logger=None):
+        if pack_by not in PACK_BY:
+            raise ValueError(f"Unknown pack_by {pack_by!r} (expected one of {', '.join(PACK_BY)})")
+        self.rules = packed_rules(template)
+        self.pack_size = pack_size
+        self.pack_by = pack_by
+        self.fits = fits
+        self.metrics = metrics
+        self.logger = logger
+        self.packed_requests = 0
+        self.packed_items = 0
+        self.fallbacks = 0
+        self.unfitting = 0
+
+    def count(self, name, value=1):
+        if self.metrics is not None and value:
+            self.metrics.count(name, value)
+
+    def groups(self, section_items):
+        """Groups of up to pack_size (original index, item) pairs, in order of first appearance."""
+        if self.pack_by == "any":
+            return [section_items[start:start + self.pack_size] for start in range(0, len(section_items), self.pack_size)]
+        by_question = {}
+        for original_idx, item in section_items:
+            by_question.setdefault(item["question"], []).append((original_idx, item))
+        return [same[start:start + self.pack_size]
+                for same in by_question.values() for start in range(0, len(same), self.pack_size)]
+
+    def render(self, group):
+        fields = [judge_fields(item) for _, item in group]
+        shared = len({question for question, _, _ in fields}) == 1
+        parts = [f"### Question: {fields[0][0]}\n\n"] if shared else []
+        for slot, (question, ground_truth, candidate) in enumerate(fields, 1):
+            parts.append(f"### Pair {slot}\n\n")
+            if not shared:
+                parts.append(f"### Question: {question}\n\n")
+            parts.append(f"### Candidate 1: {ground_truth}\n\n### Candidate 2: {candidate}\n\n")
+        about = "the above question" if shared else "its question"
+        parts.append(f"### Guidelines: There are {len(group)} pairs of candidates above. For each pair, please verify "
+                     f"if candidate 1 and candidate 2 predictions to {about} are equivalent or not.\n")
+        parts.append(self.rules)
+        parts.append(PACKED_RULE.format(len(group)))
+        return "".join(parts)
+
+    def pack(self, section_items):
+        """
+        ([(group, packed prompt content)], items to judge one by one). Items whose prompt was
+        truncated by the preflight stay single, as do groups of one and groups that do not fit.
+        """
+        packs, singles = [], []
+        packable = []
+        for original_idx, item in section_items:
+            (singles if "preflight" in item else packable).append((original_idx, item))
+        for group in self.groups(packable):
+            if len(group) == 1:
+                singles.extend(group)
+                continue
+            content = self.render(group)
+            if self.fits is not None and not self.fits(content):
+                self.unfitting += len(group)
+                singles.extend(group)
+                continue
+            packs.append((group, content))
+        self.packed_requests += len(packs)
+        self.packed_items += sum(len(group) for group, _ in packs)
+        self.count("packed_requests", len(packs))
+        self.count("packed_items", sum(len(group) for group, _ in packs))
+        return packs, singles
+
+    def unpack(self, content, size):
+        """The response section of each of `size` pairs, or None for a malformed slot."""
+        headings = [(int(match.group(1)), match.start(), match.end()) for match in HEADING.finditer(content)]
+        slots = {}
+        for n, (slot, _, end) in enumerate(headings):
+            following = headings[n + 1][1] if n + 1 < len(headings) else len(content)
+            slots.setdefault(slot, []).append(content[end:following].strip())
+        sections = []
+        for slot in range(1, size + 1):
+            found = slots.get(slot, [])
+            verdicts = set(VERDICT.findall(found[0])) if len(found) == 1 else set()
+            sections.append(found[0] if len(verdicts) == 1 else None)
+        return sections
+
+    def fell_back(self, count):
+        self.fallbacks += count
+        self.count("pack_fallbacks", count)
+
+    def summary(self):
+        return {
+            "packed_requests": self.packed_requests,
+            "packed_items": self.packed_items,
+            "items_per_request": round(self.packed_items / self.packed_requests, 2) if self.packed_requests else None,
+            "fallbacks": self.fallbacks,
+            "unfitting": self.unfitting,
+        }
+
+    def log(self):
+        if not self.logger or not self.packed_requests:
+            return
+        summary = self.summary()
+        self.logger.info(f"Packing: {summary['packed_items']} items in {summary['packed_requests']} requests "
+                         f"({summary['items_per_request']} per request), {summary['fallbacks']} fell back to single-item judging")
@@ -0,0 +1,230 @@
+"""
+End-to-end benchmark of the drivers' own overhead against deterministic fake backends.
+
+Synthetic workloads of realistic size are run through each driver's process_benchmarks with
+the fake vLLM engine (or the fake OpenAI-compatible server for o3_eval.py). Each case runs in its
+own process so peak memory is per case. Results are appended to a JSONL file and can be
+compared with the previous run to catch regressions in rendering, parsing, saving and resume.
+
+    python3 pipeline_bench.py --sizes 17000 100000 1000000 --compare
+"""
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import fake_backends
+
+DRIVERS = ["response_generation_qwen", "qwen_eval", "oss_eval", "o3_eval"]
+BENCHMARKS = ["Physics", "RealMath", "TheoremQA", "SciBench", "u-Math"]
+
+
+def make_corpus(rng, num_words=200000):
+    vocabulary = [
+        "the", "energy", "of", "system", "is", "given", "by", "$E = mc^2$", "therefore", "we", "find",
+        "integral", "\\frac{1}{2}", "velocity", "so", "answer", "consider", "field", "wait", "let", "check",
+        "matrix", "eigenvalue", "probability", "=", "+", "x", "y", "\\int_0^1", "dx", "units", "J/mol",
+    ]
+    return " ".join(rng.choice(vocabulary) for _ in range(num_words))
+
+def sample_text(rng, corpus, median_words, sigma=0.8, max_words=30000):
+    """Slice a lognormal-length span out of the corpus (about 6 characters per word)."""
+    num_words = min(max_words, max(5, int(rng.lognormvariate(math.log(median_words), sigma))))
+    num_chars = min(len(corpus) - 1, num_words * 6)
+    start = rng.randrange(0, len(corpus) - num_chars)
+    return corpus[start:start + num_chars]
+
+def write_workload(path, size, with_responses, seed=0, question_words=120, response_words=1200):
+    """Stream a synthetic benchmarks/responses file of `size` trial rows to path."""
+    rng = random.Random(seed)
+    corpus = make_corpus(rng)
+    items = []
+    num_instances = math.ceil(size / 4)
+    for instance in range(num_instances):
+        benchmark = BENCHMARKS[instance % len(BENCHMARKS)]
+        question = sample_text(rng, corpus, question_words, sigma=0.6)
+        answer = f"{rng.randrange(1000)} J/mol"
+        for trial in range(4):
+            if len(items) >= size:
+                break
+            item = {
+                "idx": f"{benchmark}/instance_{instance}/trial_{trial}",
+                "question": question,
+                "answer": answer,
+                "answer_type": "Diverse",
+                "category": f"category_{instance % 7}",
+            }
+            if with_responses:
+                item["response"] = "<think> " + sample_text(rng, corpus, response_words) + " </think> <answer> 42 </answer>"
+                # A few unextractable answers, as in real runs
+                item["extracted_answer"] = "[FAILED_TO_PROCESS]" if rng.random() < 0.01 else "42 J/mol"
+            items.append(item)
+    # Writing through the storage layer also covers the normalized layout
+    from storage import save_items
+    save_items(items, path, indent=None)
+
+def driver_kwargs(driver_name, input_file, output_file, metrics_file):
+    if driver_name == "response_generation_qwen":
+        return dict(model_path="fake", gpu_per_node=1, input_file=input_file, output_file=output_file,
+                    temperature=0.6, top_p=0.95, top_k=20, min_p=0.0, max_tokens=32768, enable_thinking=True,
+                    metrics_file=metrics_file)
+    if driver_name == "o3_eval":
+        return dict(input_file=input_file, output_file=output_file, max_tokens=16384, metrics_file=metrics_file)
+    return dict(model_path="fake", gpu_per_node=1, input_file=input_file, output_file=output_file,
+                temperature=0.0, top_p=1.0, top_k=-1, min_p=0.0, max_tokens=8192, metrics_file=metrics_file)
+
+def run_case(driver_name, input_file, output_file, metrics_file, mean_words, result_queue):
+    """Run one driver to completion and then resume it, in a fresh process."""
+    fake_backends.install_fake_modules()
+    driver = importlib.import_module(driver_name)
+    fake_backends.patch_driver(driver, fake_backends.FakeLLM(mean_words=mean_words))
+    driver.logger.setLevel("WARNING")
+    kwargs = driver_kwargs(driver_name, input_file, output_file, metrics_file)
+
+    start_time = time.time()
+    driver.process_benchmarks(**kwargs)
+    run_seconds = time.time() - start_time
+
+    with open(metrics_file, "r") as f:
+        run_metrics = json.load(f)
+
+    # Everything is complete now, so this measures load + merge + filter on resume
+    start_time = time.time()
+    driver.process_benchmarks(**dict(kwargs, metrics_file=None))
+    resume_seconds = time.time() - start_time
+
+    result_queue.put({
+        "run_seconds": round(run_seconds, 3),
+        "resume_seconds": round(resume_seconds, 3),
+        "phases": {name: phase["seconds"] for name, phase in run_metrics["phases"].items()},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "output_bytes": os.path.getsize(output_file),
+    })
+
+def run_benchmark(driver_name, size, work_dir, layout, mean_words, response_words):
+    suffix = ".trials.jsonl" if layout == "normalized" else ".json"
+    case_dir = os.path.join(work_dir, f"{driver_name}_{size}")
+    os.makedirs(case_dir, exist_ok=True)
+    input_file = os.path.join(case_dir, "input" + suffix)
+    output_file = os.path.join(case_dir, "output" + suffix)
+    metrics_file = os.path.join(case_dir, "metrics.json")
+
+    start_time = time.time()
+    write_workload(input_file, size, with_responses=driver_name != "response_generation_qwen",
+                   response_words=response_words)
+    workload_seconds = time.time() - start_time
+
+    context = multiprocessing.get_context("fork")
+    result_queue = context.Queue()
+    process = context.Process(target=run_case, args=(driver_name, input_file, output_file, metrics_file, mean_words, result_queue))
+    process.start()
+    result = None
+    while result is None:
+        # Checked before the wait, so a result sent just before the child exited is still read
+        alive = process.is_alive()
+        try:
+            result = result_queue.get(timeout=1.0)
+        except queue.Empty:
+            if not alive:
+                code = process.exitcode
+                cause = f"was killed by signal {-code}" if code < 0 else f"exited with code {code} (traceback above)"
+                raise RuntimeError(f"{driver_name} @ {size} {cause} before reporting results")
+    process.join()
+
+    result.update({
+        "driver": driver_name,
+        "size": size,
+        "layout": layout,
+        "workload_seconds": round(workload_seconds, 3),
+        "items_per_second": round(size / result["run_seconds"], 1),
+        "save_seconds": round(result["phases"].get("save", 0.0), 3),
+    })
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def print_comparison(results, previous):
+    previous_cases = {(case["driver"], case["size"], case.get("layout", "plain")): case for case in previous["cases"]}
+    print(f"\nComparison with run {previous['timestamp']} ({previous.get('git_commit')}):")
+    for case in results:
+        before = previous_cases.get((case["driver"], case["size"], case["layout"]))
+        if before is None:
+            continue
+        for metric in ("items_per_second", "save_seconds", "resume_seconds", "peak_rss_mb"):
+            if before.get(metric):
+                change = (case[metric] - before[metric]) / before[metric]
+                print(f"  {case['driver']} @ {case['size']} {metric}: {before[metric]} -> {case[metric]} ({change:+.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark driver overhead on synthetic workloads with fake backends.")
+    parser.add_argument("--drivers", type=str, nargs="+", default=DRIVERS, choices=DRIVERS, help="Drivers to benchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[17000, 100000, 1000000], help="Workload sizes in trial rows.")
+    parser.add_argument("--layout", type=str, default="plain", choices=["plain", "normalized"], help="On-disk layout of inputs and outputs.")
+    parser.add_argument("--response_words", type=int, default=1200, help="Median words per synthetic response.")
+    parser.add_argument("--mean_words", type=int, default=200, help="Mean words per fake completion.")
+    parser.add_argument("--api_latency", type=float, default=0.0, help="Simulated seconds per fake OpenAI request.")
+    parser.add_argument("--work_dir", type=str, help="Directory for workloads and outputs (default: a temporary directory).")
+    parser.add_argument("--keep_files", action="store_true", help="Keep the workload and output files.")
+    parser.add_argument("--results_file", type=str, default="bench_results.jsonl", help="JSONL file the results are appended to.")
+    parser.add_argument("--label", type=str, help="Free-form label stored with the results.")
+    parser.add_argument("--compare", action="store_true", help="Compare with the previous run in results_file.")
+
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="pipeline_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    server = None
+    if "o3_eval" in args.drivers:
+        server = fake_backends.FakeOpenAIServer(mean_words=args.mean_words, latency=args.api_latency).start()
+        os.environ["O3_EVAL_BASE_URL"] = server.base_url
+
+    results = []
+    try:
+        for size in args.sizes:
+            for driver_name in args.drivers:
+                result = run_benchmark(driver_name, size, work_dir, args.layout, args.mean_words, args.response_words)
+                results.append(result)
+                print(f"{driver_name} @ {size}: {result['items_per_second']} items/s, run {result['run_seconds']}s, "
+                      f"save {result['save_seconds']}s, resume {result['resume_seconds']}s, peak RSS {result['peak_rss_mb']} MB")
+    finally:
+        if server is not None:
+            server.stop()
+        if not args.keep_files and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    previous = None
+    if args.compare and os.path.exists(args.results_file):
+        with open(args.results_file, "r") as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+        previous = runs[-1] if runs else None
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "label": args.label,
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "cases": results,
+    }
+    with open(args.results_file, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Appended results to {args.results_file}")
+
+    if previous is not None:
+        print_comparison(results, previous)
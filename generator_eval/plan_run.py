@@ -0,0 +1,294 @@
+"""
+Capacity and cost plan for a run, before it is submitted.
+
+Tokenizes the prompts the backend would send for the input file (all items, or a --sample of
+them), estimates each item's output length from finished items of earlier runs (response_tokens
+for generation, the judgment, or o3's completion usage, averaged per benchmark), and scales the
+throughput recorded in the --metrics_file of earlier runs of the same driver to project wall
+time, GPU-hours, API tokens and cost. Chunks are the contiguous --start_index/--end_index
+slices the .sh launchers submit, so the projection of a chunk count is that of its slowest
+chunk; the recommended count is the smallest whose slowest chunk fits --headroom of --time.
+
+    python3 plan_run.py ./qwen3_14b_think_responses/responses.json --backend qwen_eval \
+        --tokenizer /datasets/pretrained-llms/Qwen2.5-14B-Instruct \
+        --profiles ./qwen3_4b_think_responses/qwen25_14b_eval_metrics.json \
+        --history_files ./qwen3_4b_think_responses/qwen25_14b_eval_0.json
+
+Generation time is scaled by output tokens (decoding dominates these runs), so a profile
+recorded with another model, GPU count or max_tokens only transfers approximately.
+"""
+import argparse
+import importlib
+import json
+import math
+import random
+
+from transformers import AutoTokenizer
+
+from budget import DEFAULT_PRICES, usage_cost
+from storage import load_items, benchmark_of
+from template_compiler import ChatPromptFormat, HarmonyPromptFormat, fill_template, judge_fields
+
+# Driver module and RunMetrics name of each backend; API backends are billed per token, not per GPU-hour
+BACKENDS = {
+    "response_generation": {"module": "response_generation_qwen", "driver": "response_generation", "api": False},
+    "qwen_eval": {"module": "qwen_eval", "driver": "qwen_eval", "api": False},
+    "oss_eval": {"module": "oss_eval", "driver": "oss_eval", "api": False},
+    "o3_eval": {"module": "o3_eval", "driver": "o3_eval", "api": True},
+}
+DEFAULT_CHUNKS = [1, 2, 5, 10, 20]
+
+
+def parse_walltime(text):
+    """Seconds of a SLURM --time value (minutes, MM:SS, HH:MM:SS, D-HH, D-HH:MM or D-HH:MM:SS)."""
+    days, _, clock = text.rpartition("-")
+    parts = [int(part) for part in clock.split(":")]
+    if days:
+        hours, minutes, seconds = parts + [0] * (3 - len(parts))
+    elif len(parts) == 3:
+        hours, minutes, seconds = parts
+    else:
+        hours, (minutes, seconds) = 0, (parts + [0])[:2]
+    return ((int(days or 0) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def pending(item, backend):
+    """Whether the driver would still process the item (resumed output files skip finished ones)."""
+    if backend == "response_generation":
+        return "response" not in item or "extracted_answer" not in item
+    return item.get("extracted_answer") != "[FAILED_TO_PROCESS]" and ("judgment" not in item or "is_it_correct" not in item)
+
+def prompt_counter(backend, module, tokenizer, enable_thinking):
+    """Prompt token count of an item as the backend renders it."""
+    if backend == "response_generation":
+        return lambda item: len(tokenizer.encode(module.render_prompt(tokenizer, item["question"], enable_thinking),
+                                                 add_special_tokens=False))
+    if backend == "o3_eval":
+        # o3 is counted with --tokenizer like o3_eval.py's preflight; its own tokenizer differs slightly
+        return lambda item: len(tokenizer.encode(fill_template(module.DETAILED_ZERO_SHOT, judge_fields(item)), add_special_tokens=False))
+    prompt_format = HarmonyPromptFormat() if backend == "oss_eval" else ChatPromptFormat(tokenizer)
+    return lambda item: len(prompt_format.render(fill_template(module.DETAILED_ZERO_SHOT, judge_fields(item))))
+
+def output_length(item, backend, tokenizer):
+    """Output tokens a finished item of an earlier run took, or None."""
+    if backend == "response_generation":
+        if "response_tokens" in item:
+            return item["response_tokens"]
+        text = item.get("response")
+    else:
+        # o3's completion usage includes its reasoning, which the judgment text does not show
+        if backend == "o3_eval" and item.get("usage"):
+            return item["usage"]["completion_tokens"]
+        text = item.get("judgment")
+        if text == "[FAILED_TO_PROCESS]":
+            return None
+    return len(tokenizer.encode(text, add_special_tokens=False)) if text else None
+
+
+class OutputLengths:
+    """Mean output tokens per benchmark from earlier runs, falling back to all benchmarks, then max_tokens."""
+
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+        self.totals = {}
+
+    def add(self, benchmark, tokens):
+        total, count = self.totals.get(benchmark, (0, 0))
+        self.totals[benchmark] = (total + tokens, count + 1)
+
+    def overall(self):
+        count = sum(count for _, count in self.totals.values())
+        return sum(total for total, _ in self.totals.values()) / count if count else None
+
+    def estimate(self, benchmark):
+        if benchmark in self.totals:
+            total, count = self.totals[benchmark]
+            return total / count
+        overall = self.overall()
+        return overall if overall is not None else self.max_tokens
+
+    def sources(self, benchmarks):
+        return {benchmark: self.totals.get(benchmark, (0, 0))[1] for benchmark in sorted(benchmarks)}
+
+
+def load_profile(paths, driver):
+    """Throughput of earlier runs of the driver, pooled over their JSON metrics files; None if there are none."""
+    profile = {"runs": 0, "seconds": 0.0, "other_seconds": 0.0, "startup_seconds": 0.0,
+               "items": 0, "prompt_tokens": 0, "output_tokens": 0}
+    for path in paths:
+        with open(path) as f:
+            summary = json.load(f)
+        if summary.get("driver") != driver:
+            continue
+        phases = {name: phase["seconds"] for name, phase in summary["phases"].items()}
+        counters = summary["counters"]
+        seconds = phases.pop("generate", 0.0) + phases.pop("api", 0.0)
+        if not seconds or not counters.get("items"):
+            continue
+        profile["runs"] += 1
+        profile["seconds"] += seconds
+        profile["other_seconds"] += sum(phases.values())
+        # Time outside all phases is mostly model loading
+        profile["startup_seconds"] += max(0.0, summary["elapsed_seconds"] - seconds - sum(phases.values()))
+        for name in ("items", "prompt_tokens", "output_tokens"):
+            profile[name] += counters.get(name, 0)
+    if not profile["runs"]:
+        return None
+    profile["startup_seconds"] /= profile["runs"]
+    return profile
+
+def item_seconds(profile, output_tokens):
+    """Projected seconds of one item: generation scaled by output tokens (by items for API runs), plus the other phases."""
+    if profile["output_tokens"]:
+        generate = output_tokens * profile["seconds"] / profile["output_tokens"]
+    else:
+        generate = profile["seconds"] / profile["items"]
+    return generate + profile["other_seconds"] / profile["items"]
+
+def chunk_bounds(total_items, num_chunks):
+    """The [start, end) slices the .sh launchers submit: equal chunks, the last one taking the remainder."""
+    chunk_size = total_items // num_chunks
+    return [(i * chunk_size, total_items if i == num_chunks - 1 else (i + 1) * chunk_size) for i in range(num_chunks)]
+
+def shard_plan(work, num_chunks, startup_seconds, walltime, headroom, gpus_per_node):
+    """Projection of submitting the run as num_chunks jobs, from the per-item seconds in input order."""
+    chunk_seconds = [sum(work[start:end]) for start, end in chunk_bounds(len(work), num_chunks)]
+    job_seconds = [startup_seconds + seconds for seconds in chunk_seconds]
+    return {
+        "chunks": num_chunks,
+        "slowest_job_hours": round(max(job_seconds) / 3600, 2),
+        "mean_job_hours": round(sum(job_seconds) / len(job_seconds) / 3600, 2),
+        "gpu_hours": round(sum(job_seconds) * gpus_per_node / 3600, 1),
+        "fits": max(job_seconds) <= headroom * walltime,
+    }
+
+def recommend_chunks(work, startup_seconds, walltime, headroom, gpus_per_node):
+    """Smallest chunk count whose slowest job fits headroom * walltime, or None if one item per job does not."""
+    target = headroom * walltime - startup_seconds
+    if target <= 0 or max(work, default=0.0) > target:
+        return None
+    num_chunks = max(1, math.ceil(sum(work) / target))
+    while not shard_plan(work, num_chunks, startup_seconds, walltime, headroom, gpus_per_node)["fits"]:
+        num_chunks += 1
+    return num_chunks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Project wall time, GPU-hours, API tokens and cost of a run before submitting it.")
+    parser.add_argument("input_file", type=str, help="Input file of the run (any format load_items reads).")
+    parser.add_argument("--backend", type=str, required=True, choices=list(BACKENDS), help="Driver the run uses.")
+    parser.add_argument("--tokenizer", type=str, default="/datasets/pretrained-llms/Qwen3-4B", help="Tokenizer the prompts and earlier outputs are counted with (the backend's model).")
+    parser.add_argument("--profiles", type=str, nargs="+", required=True, help="JSON --metrics_file of earlier runs; those of the backend's driver are pooled.")
+    parser.add_argument("--history_files", type=str, nargs="*", default=[], help="Output files of earlier runs of the backend, for output lengths per benchmark.")
+    parser.add_argument("--sample", type=int, help="Tokenize this many random items and scale up (default: all).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of --sample.")
+    parser.add_argument("--max_tokens", type=int, default=8192, help="Output length assumed when no earlier output is known.")
+    parser.add_argument("--num_samples", type=int, help="Samples per instance, as passed to response_generation_qwen.py.")
+    parser.add_argument("--enable_thinking", action="store_true", help="Render generation prompts in thinking mode.")
+    parser.add_argument("--time", type=str, default="24:00:00", help="SLURM walltime of each job.")
+    parser.add_argument("--headroom", type=float, default=0.8, help="Fraction of --time a job is planned to use.")
+    parser.add_argument("--startup_minutes", type=float, help="Job startup (model loading) per chunk (default: measured in the profiles).")
+    parser.add_argument("--gpus_per_node", type=int, default=2, help="GPUs per job, for GPU-hours (the profiles should use the same).")
+    parser.add_argument("--gpu_hour_usd", type=float, help="Price of a GPU-hour, to cost GPU backends.")
+    parser.add_argument("--chunks", type=int, nargs="+", default=DEFAULT_CHUNKS, help="Chunk counts to project besides the recommended one.")
+    parser.add_argument("--plan_file", type=str, help="Also write the plan here as JSON.")
+
+    args = parser.parse_args()
+    backend = BACKENDS[args.backend]
+
+    profile = load_profile(args.profiles, backend["driver"])
+    if profile is None:
+        parser.error(f"None of --profiles is the metrics file of an earlier {backend['driver']} run")
+
+    module = importlib.import_module(backend["module"])
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+
+    all_items = load_items(args.input_file)
+    if args.backend == "response_generation" and args.num_samples:
+        all_items = module.expand_instances(all_items, args.num_samples)
+    todo = [position for position, item in enumerate(all_items) if pending(item, args.backend)]
+    if not todo:
+        print(f"{args.input_file}: all {len(all_items)} items are already processed")
+        raise SystemExit(0)
+
+    lengths = OutputLengths(args.max_tokens)
+    for history_file in args.history_files:
+        for item in load_items(history_file):
+            tokens = output_length(item, args.backend, tokenizer)
+            if tokens is not None:
+                lengths.add(benchmark_of(item), tokens)
+
+    sampled = todo if args.sample is None or args.sample >= len(todo) else random.Random(args.seed).sample(todo, args.sample)
+    count_prompt = prompt_counter(args.backend, module, tokenizer, args.enable_thinking)
+    scale = len(todo) / len(sampled)
+    prompt_tokens = sum(count_prompt(all_items[position]) for position in sampled) * scale
+
+    # Per position in input order, so chunk slices line up with what the .sh launchers submit
+    output_tokens = [0.0] * len(all_items)
+    for position in todo:
+        output_tokens[position] = lengths.estimate(benchmark_of(all_items[position]))
+    work = [item_seconds(profile, tokens) if pending(item, args.backend) else 0.0
+            for item, tokens in zip(all_items, output_tokens)]
+    startup_seconds = args.startup_minutes * 60 if args.startup_minutes is not None else profile["startup_seconds"]
+    walltime = parse_walltime(args.time)
+    gpus_per_node = 0 if backend["api"] else args.gpus_per_node
+
+    recommended = recommend_chunks(work, startup_seconds, walltime, args.headroom, gpus_per_node)
+    chunk_counts = sorted(set(args.chunks + ([recommended] if recommended else [])))
+    shards = [shard_plan(work, num_chunks, startup_seconds, walltime, args.headroom, gpus_per_node)
+              for num_chunks in chunk_counts if num_chunks <= len(all_items)]
+
+    total_output_tokens = sum(output_tokens)
+    plan = {
+        "input_file": args.input_file,
+        "backend": args.backend,
+        "items": len(all_items),
+        "pending_items": len(todo),
+        "tokenized_items": len(sampled),
+        "prompt_tokens": round(prompt_tokens),
+        "output_tokens": round(total_output_tokens),
+        "output_tokens_per_item": round(total_output_tokens / len(todo), 1),
+        "history_items_per_benchmark": lengths.sources({benchmark_of(all_items[position]) for position in todo}),
+        "profile": {name: round(value, 2) if isinstance(value, float) else value for name, value in profile.items()},
+        "startup_minutes": round(startup_seconds / 60, 1),
+        "work_hours": round(sum(work) / 3600, 2),
+        "walltime_hours": round(walltime / 3600, 2),
+        "headroom": args.headroom,
+        "recommended_chunks": recommended,
+        "shards": shards,
+    }
+    if backend["api"]:
+        plan["cost_usd"] = round(usage_cost({"prompt_tokens": prompt_tokens, "cached_tokens": 0,
+                                             "completion_tokens": total_output_tokens}, DEFAULT_PRICES), 2)
+    elif args.gpu_hour_usd is not None:
+        for shard in shards:
+            shard["cost_usd"] = round(shard["gpu_hours"] * args.gpu_hour_usd, 2)
+
+    print(f"{args.input_file}: {len(todo)} of {len(all_items)} items to process with {args.backend}"
+          + (f" ({len(sampled)} tokenized)" if len(sampled) < len(todo) else ""))
+    print(f"  prompt tokens: {plan['prompt_tokens']:,}, output tokens: {plan['output_tokens']:,} "
+          f"({plan['output_tokens_per_item']} per item)")
+    missing = [benchmark for benchmark, count in plan["history_items_per_benchmark"].items() if not count]
+    if missing:
+        fallback = "the mean of the other benchmarks" if lengths.totals else f"--max_tokens {args.max_tokens}"
+        print(f"  no earlier outputs for {', '.join(missing)}; assumed {fallback}")
+    print(f"  profile: {profile['runs']} earlier runs, {profile['items']} items in {profile['seconds'] / 3600:.2f}h of "
+          f"{'API' if backend['api'] else 'generation'} time, startup {plan['startup_minutes']} min per job")
+    if backend["api"]:
+        print(f"  API cost: ${plan['cost_usd']:,.2f} at list prices")
+    print(f"  work: {plan['work_hours']}h; jobs planned to use {args.headroom:.0%} of --time {args.time}")
+    for shard in shards:
+        line = (f"  {shard['chunks']:>4} chunks: slowest job {shard['slowest_job_hours']:6.2f}h, "
+                f"mean {shard['mean_job_hours']:6.2f}h")
+        if not backend["api"]:
+            line += f", {shard['gpu_hours']:8.1f} GPU-hours"
+        if "cost_usd" in shard:
+            line += f", ${shard['cost_usd']:,.2f}"
+        line += ("" if shard["fits"] else "  EXCEEDS WALLTIME") + ("  <- recommended" if shard["chunks"] == recommended else "")
+        print(line)
+    if recommended is None:
+        print("  no chunk count fits: a single item (plus startup) takes longer than the planned walltime")
+
+    if args.plan_file:
+        with open(args.plan_file, "w") as f:
+            json.dump(plan, f, indent=2)
+        print(f"Wrote the plan to {args.plan_file}")
@@ -0,0 +1,203 @@
+"""
+Graceful stops under SLURM: preemption signals, the walltime and requeueing.
+
+The drivers only save at section boundaries, so a job killed mid-section loses the section.
+Preemption traps SIGTERM (preemption, scancel, the walltime) and SIGUSR1 (sent ahead of the
+walltime with `#SBATCH --signal=B:USR1@<seconds>`, which reaches the driver when the launcher
+execs it) and only records the request; the drivers check it between sections:
+
+    sections(items)               the items in consecutive sections sized from the measured
+                                  throughput to take about section_seconds each (keep it below the
+                                  USR1 lead time, so the section running when the signal comes
+                                  finishes and is saved before the walltime); sections are never
+                                  smaller than min_section_size items, and the first one, with no
+                                  timing to go by, is that size
+    stop_requested()              called before each section: True once a signal arrived, or when
+                                  the next section (expected to take as long as the longest one so
+                                  far) would not finish --walltime_margin seconds before the job's
+                                  end time
+    requested                     True once a stop was requested, without the walltime check;
+                                  o3_eval.py stops dispatching requests then
+    stop(pending)                 after the completed work is saved: writes the resume marker
+                                  <output_file>.preempted.json and, with requeue, runs
+                                  `scontrol requeue $SLURM_JOB_ID` (the job needs --requeue)
+
+A requeued job reruns the same command, which resumes from the output file like any rerun. A
+section interrupted anyway (vLLM's workers get SIGTERM too) is left unprocessed rather than
+marked [FAILED_TO_PROCESS]. The marker is written as soon as a stop is requested, so a job
+killed before it saves still leaves one. A second SIGTERM terminates the process at once; the
+walltime's SIGTERM after a USR1 does not, it is the signal the USR1 gave notice of. A single
+generation that takes longer than the lead time cannot be saved in time whatever the section
+size. finish() removes the marker when a run completes.
+"""
+import json
+import os
+import signal
+import subprocess
+import time
+
+STOP_SIGNALS = ("SIGTERM", "SIGUSR1")
+MARKER_SUFFIX = ".preempted.json"
+# vLLM's max_num_seqs in the drivers: a section takes at least as long as its slowest generation,
+# so a section that does not fill the engine is no faster, it only leaves sequence slots idle
+MIN_SECTION_SIZE = 1024
+# A section is at most this many times the previous one, in case it ran faster than the next will
+MAX_SECTION_GROWTH = 4
+
+
+def job_end_time():
+    """Projected end of the SLURM job as a unix time, or None outside SLURM."""
+    end_time = os.environ.get("SLURM_JOB_END_TIME")
+    if end_time:
+        return float(end_time)
+    job_id = os.environ.get("SLURM_JOB_ID")
+    if not job_id:
+        return None
+    try:
+        output = subprocess.run(["squeue", "-h", "-j", job_id, "-o", "%e"], capture_output=True, text=True, timeout=30).stdout
+        return time.mktime(time.strptime(output.strip(), "%Y-%m-%dT%H:%M:%S"))
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+class Preemption:
+    def __init__(self, output_file, requeue=False, walltime_margin=300.0, section_seconds=600.0,
+                 signals=STOP_SIGNALS, logger=None, metrics=None, min_section_size=MIN_SECTION_SIZE):
+        self.marker_file = output_file + MARKER_SUFFIX
+        self.requeue = requeue
+        self.walltime_margin = walltime_margin
+        self.section_seconds = section_seconds
+        self.min_section_size = min_section_size
+        self.logger = logger
+        self.metrics = metrics
+        self.reason = None
+        self.requested_at = None
+        self.section_started = None
+        self.longest_section = 0.0
+        self.job_id = os.environ.get("SLURM_JOB_ID")
+        self.end_time = job_end_time()
+        # Forked workers (o3_eval.py's request pool) inherit the handler and ignore the signal
+        self.pid = os.getpid()
+        for name in signals:
+            signal.signal(getattr(signal, name), self.handle)
+
+        if os.path.exists(self.marker_file):
+            with open(self.marker_file) as f:
+                marker = json.load(f)
+            pending = "killed before saving" if marker["pending_items"] is None else f"{marker['pending_items']} items were pending"
+            self.log("info", f"Resuming after a stop on {marker['reason']} at {marker['time']} ({pending})")
+
+    def log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+
+    def handle(self, signum, frame):
+        if os.getpid() != self.pid:
+            return
+        name = signal.Signals(signum).name
+        if self.reason is not None:
+            # Only a repeated SIGTERM forces the exit; after a USR1 or the walltime check the
+            # SIGTERM is the walltime itself, and the section in flight may still finish
+            if signum == signal.SIGTERM and self.reason == "SIGTERM":
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+            self.log("warning", f"{name} while stopping on {self.reason}: still finishing the work in flight")
+            return
+        self.request(name)
+
+    def request(self, reason):
+        self.reason = reason
+        self.requested_at = time.time()
+        self.log("warning", f"Stop requested ({reason}): finishing the work in flight, then saving and stopping")
+        # Rewritten with the pending count by stop(); this one is left if the job is killed first
+        self.write(self.marker(None))
+
+    @property
+    def requested(self):
+        return self.reason is not None
+
+    def stop_requested(self):
+        """Whether to stop instead of starting the next section; sections are timed between calls."""
+        now = time.time()
+        if self.section_started is not None:
+            self.longest_section = max(self.longest_section, now - self.section_started)
+        self.section_started = now
+        if self.reason is None and self.end_time is not None and now + self.longest_section + self.walltime_margin > self.end_time:
+            self.request("walltime")
+        return self.reason is not None
+
+    def sections(self, items):
+        """Consecutive slices of items, sized from the generation throughput measured so far.
+
+        The size comes from the best output tokens/s of a section and the mean output tokens per
+        item, both from the metrics' token counts: a section whose time went to a long tail
+        generates fewer tokens/s than the engine can, and its items/s would shrink the next one
+        for nothing. Without token counts the items/s of the last section is used.
+        """
+        start = 0
+        size = self.min_section_size
+        best_tokens_per_second = 0.0
+        total_tokens = 0
+        total_items = 0
+        while start < len(items):
+            section = items[start:start + size]
+            tokens_before = self.output_tokens()
+            started = time.time()
+            yield section
+            # Resumed once the caller has generated, parsed and saved the section
+            elapsed = time.time() - started
+            start += len(section)
+            section_tokens = self.output_tokens() - tokens_before
+            total_tokens += section_tokens
+            total_items += len(section)
+            if elapsed > 0 and section_tokens > 0:
+                best_tokens_per_second = max(best_tokens_per_second, section_tokens / elapsed)
+                size = int(best_tokens_per_second * self.section_seconds / (total_tokens / total_items))
+            elif elapsed > 0:
+                size = int(len(section) / elapsed * self.section_seconds)
+            size = max(self.min_section_size, min(size, MAX_SECTION_GROWTH * len(section)))
+
+    def output_tokens(self):
+        if self.metrics is None:
+            return 0
+        return self.metrics.counters.get("output_tokens", 0)
+
+    def marker(self, pending):
+        return {
+            "reason": self.reason,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "job_id": self.job_id,
+            "pending_items": pending,
+            "requeued": False,
+        }
+
+    def stop(self, pending):
+        """Write the resume marker and requeue the job if asked; call once the completed work is saved."""
+        marker = self.marker(pending)
+        if self.requeue and self.job_id:
+            try:
+                # Write the marker first: the requeue ends this job
+                marker["requeued"] = True
+                self.write(marker)
+                subprocess.run(["scontrol", "requeue", self.job_id], check=True, capture_output=True, text=True, timeout=60)
+                self.log("warning", f"Stopped with {pending} items pending; requeued job {self.job_id}")
+            except (OSError, subprocess.SubprocessError) as e:
+                marker["requeued"] = False
+                self.write(marker)
+                self.log("error", f"Could not requeue job {self.job_id}: {e}; resubmit it to resume")
+        else:
+            self.write(marker)
+            self.log("warning", f"Stopped with {pending} items pending; rerun the same command to resume")
+        if self.metrics is not None:
+            self.metrics.count("preempted", 1)
+
+    def write(self, marker):
+        tmp_path = self.marker_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(marker, f, indent=2)
+        os.replace(tmp_path, self.marker_file)
+
+    def finish(self):
+        """Remove the resume marker of an earlier stop once the run has completed."""
+        if os.path.exists(self.marker_file):
+            os.remove(self.marker_file)
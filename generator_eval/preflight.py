@@ -0,0 +1,199 @@
+"""
+Preflight admission: check every rendered judge prompt against the context window before dispatch.
+
+A prompt longer than the context window makes llm.generate raise for the whole section (and made
+o3 retry forever), so the judge drivers pass each section through Preflight.admit between
+rendering and dispatching. A prompt fits if it leaves at least MIN_OUTPUT_TOKENS (or max_tokens,
+if smaller) for the judgment; a fitting prompt that leaves less than max_tokens is generated with
+max_tokens clamped to the room left, which Preflight.max_tokens_of and sampling_params give per
+item. Oversized items are handled by the policy:
+
+    truncate  cut the middle out of the candidate until the prompt fits; items that do not fit
+              even with an empty candidate (a huge question) are skipped
+    skip      mark the item [FAILED_TO_PROCESS] without judging it
+    route     leave the item unjudged and write it to a routed file, to be judged by a driver
+              with a longer context (e.g. o3_eval.py --input_file <routed file>)
+
+Every handled item gets a "preflight" record ({"action", "prompt_tokens", "limit", ...}), clamped
+ones with the max_tokens they get, and the oversized items of the run are reported in the log and in <output_file>.preflight.json. The item's
+extracted_answer is never changed; truncation only affects the prompt.
+"""
+import json
+
+from storage import benchmark_of, save_items
+
+POLICIES = ("truncate", "skip", "route")
+TRUNCATION_MARK = "\n[... {} characters truncated ...]\n"
+# Least room a prompt must leave for the judgment; a prompt leaving less is over-length
+MIN_OUTPUT_TOKENS = 2048
+
+
+def context_length_of(llm):
+    """max_model_len of a vLLM engine, or None (replayed runs have no engine)."""
+    try:
+        return llm.llm_engine.model_config.max_model_len
+    except AttributeError:
+        return None
+
+def truncate_middle(text, keep):
+    """text with all but `keep` characters cut out of its middle, marked in place."""
+    if keep >= len(text):
+        return text
+    head = keep - keep // 2
+    return text[:head] + TRUNCATION_MARK.format(len(text) - keep) + text[len(text) - keep // 2:]
+
+
+class Preflight:
+    """
+    Admission check of rendered prompts. render maps a list of (question, ground truth, candidate)
+    fields to prompts and length gives a prompt's token count; both are only called again to
+    re-render truncated candidates.
+    """
+
+    def __init__(self, context_length, max_tokens, render, length=len, policy="truncate",
+                 logger=None, metrics=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overlength policy {policy!r} (expected one of {', '.join(POLICIES)})")
+        self.context_length = context_length
+        self.max_tokens = max_tokens
+        self.limit = context_length - min(max_tokens, MIN_OUTPUT_TOKENS)
+        self.render = render
+        self.length = length
+        self.policy = policy
+        self.logger = logger
+        self.metrics = metrics
+        self.outliers = []
+        self.routed = []
+        self.clamped = 0
+
+    def count(self, name):
+        if self.metrics is not None:
+            self.metrics.count(name, 1)
+
+    def fit_candidate(self, fields):
+        """Prompt with the longest middle-truncated candidate that fits, and the characters kept; None if none fits."""
+        question, ground_truth, candidate = fields
+        prompt = self.render([(question, ground_truth, truncate_middle(candidate, 0))])[0]
+        if self.length(prompt) > self.limit:
+            return None
+        # Binary search on the characters kept; each probe re-renders a single prompt
+        low, high = 0, len(candidate) - 1
+        while low < high:
+            keep = (low + high + 1) // 2
+            probe = self.render([(question, ground_truth, truncate_middle(candidate, keep))])[0]
+            if self.length(probe) <= self.limit:
+                low, prompt = keep, probe
+            else:
+                high = keep - 1
+        return prompt, low
+
+    def admit(self, section_items, prompts, fields_of):
+        """
+        (section items, prompts) that fit the context, with truncated prompts substituted.
+        Skipped items are marked judged and routed items are collected for save_routed.
+        """
+        admitted_items, admitted_prompts = [], []
+        for (original_idx, item), prompt in zip(section_items, prompts):
+            # A record from an earlier run no longer applies
+            item.pop("preflight", None)
+            prompt_tokens = self.length(prompt)
+            if prompt_tokens <= self.limit:
+                self.clamp(item, prompt_tokens)
+                admitted_items.append((original_idx, item))
+                admitted_prompts.append(prompt)
+                continue
+
+            record = {"prompt_tokens": prompt_tokens, "limit": self.limit}
+            action = self.policy
+            if action == "truncate":
+                fitted = self.fit_candidate(fields_of(item))
+                if fitted is None:
+                    action = "skip"
+                else:
+                    prompt, kept = fitted
+                    record["truncated_prompt_tokens"] = self.length(prompt)
+                    record["candidate_chars"] = len(item["extracted_answer"])
+                    record["kept_chars"] = kept
+                    record["max_tokens"] = min(self.max_tokens, self.context_length - record["truncated_prompt_tokens"])
+                    admitted_items.append((original_idx, item))
+                    admitted_prompts.append(prompt)
+
+            if action == "skip":
+                item["judgment"] = "[FAILED_TO_PROCESS]"
+                item["is_it_correct"] = False
+            elif action == "route":
+                self.routed.append(item)
+            record["action"] = {"truncate": "truncated", "skip": "skipped", "route": "routed"}[action]
+            item["preflight"] = record
+            self.count(f"preflight_{record['action']}")
+            self.outliers.append({"idx": item.get("idx"), "benchmark": benchmark_of(item), **record})
+        return admitted_items, admitted_prompts
+
+    def clamp(self, item, prompt_tokens):
+        """Record the clamped max_tokens of a fitting prompt that leaves less than max_tokens."""
+        room = self.context_length - prompt_tokens
+        if room >= self.max_tokens:
+            return
+        item["preflight"] = {"action": "clamped", "prompt_tokens": prompt_tokens, "max_tokens": room}
+        self.clamped += 1
+        self.count("preflight_clamped")
+
+    def max_tokens_of(self, item):
+        """max_tokens for an admitted item: clamped to the room its prompt leaves in the context."""
+        return item.get("preflight", {}).get("max_tokens", self.max_tokens)
+
+    def sampling_params(self, section_items, sampling_params):
+        """sampling_params for llm.generate: shared if no item is clamped, else one per item."""
+        if not any("max_tokens" in item.get("preflight", {}) for _, item in section_items):
+            return sampling_params
+        per_item = []
+        for _, item in section_items:
+            max_tokens = self.max_tokens_of(item)
+            if max_tokens == sampling_params.max_tokens:
+                per_item.append(sampling_params)
+                continue
+            params = sampling_params.clone()
+            params.max_tokens = max_tokens
+            per_item.append(params)
+        return per_item
+
+    def summary(self):
+        actions = {}
+        for outlier in self.outliers:
+            actions[outlier["action"]] = actions.get(outlier["action"], 0) + 1
+        return {
+            "context_length": self.context_length,
+            "limit": self.limit,
+            "policy": self.policy,
+            "clamped": self.clamped,
+            "actions": actions,
+            "outliers": sorted(self.outliers, key=lambda outlier: -outlier["prompt_tokens"]),
+        }
+
+    def log_report(self, top=5):
+        if not self.logger:
+            return
+        if self.clamped:
+            self.logger.info(f"Preflight: {self.clamped} prompts left less than max_tokens={self.max_tokens} "
+                             f"in the {self.context_length}-token context and were generated with max_tokens clamped")
+        if not self.outliers:
+            return
+        summary = self.summary()
+        counts = ", ".join(f"{count} {action}" for action, count in sorted(summary["actions"].items()))
+        self.logger.warning(f"Preflight: {len(self.outliers)} prompts over the {self.limit}-token limit ({counts})")
+        for outlier in summary["outliers"][:top]:
+            self.logger.warning(f"  {outlier['idx']}: {outlier['prompt_tokens']} tokens, {outlier['action']}")
+
+    def save(self, path):
+        if not self.outliers:
+            return
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def save_routed(self, path):
+        """Write the routed items, ready to be judged by a longer-context driver."""
+        if not self.routed:
+            return
+        save_items(self.routed, path, indent=2)
+        if self.logger:
+            self.logger.info(f"Routed {len(self.routed)} over-length items to {path}")
@@ -1,10 +1,8 @@
-import json
+from storage import load_items, benchmark_of
 
-with open("./qwen3_4b_think_responses/o3_detailed_few_shot_results.json", "r") as f:
-    data1 = json.load(f)
+data1 = load_items("./qwen3_4b_think_responses/o3_detailed_few_shot_results.json")
 
-with open("./qwen3_4b_think_responses/qwen25_14b_concise_zero_shot_results.json", "r") as f:
-    data2 = json.load(f)
+data2 = load_items("./qwen3_4b_think_responses/qwen25_14b_concise_zero_shot_results.json")
 
 total =0
 agree =0
@@ -12,7 +10,7 @@ benchmark_total = {}
 benchmark_agree = {}
 
 for item1, item2 in zip(data1, data2):
-    benchmark = item1["idx"].split("/")[0]
+    benchmark = benchmark_of(item1)
     if benchmark not in benchmark_total.keys():
         benchmark_total[benchmark] = 0
     if benchmark not in benchmark_agree.keys():
@@ -1,22 +1,22 @@
-import json
+from storage import load_items, join_key
 
-with open("./qwen3_4b_think_responses/o3_detailed_few_shot_results.json", "r") as f:
-    data1 = json.load(f)
+data1 = load_items("./qwen3_4b_think_responses/o3_detailed_few_shot_results.json")
 
-with open("./qwen3_4b_think_responses/o3_concise_zero_shot_results.json", "r") as f:
-    data2 = json.load(f)
+data2 = load_items("./qwen3_4b_think_responses/o3_concise_zero_shot_results.json")
 
+# (instance_id, trial) only matches between files sharing an instance table, idx otherwise
+key = join_key(data1, data2)
 
 judgments1 = {}
 judgments2 = {}
 for d in data1:
-    judgments1[d["idx"]] = d["is_it_correct"]
+    judgments1[key(d)] = d["is_it_correct"]
 
 for d in data2:
-    judgments2[d["idx"]] = d["is_it_correct"]
+    judgments2[key(d)] = d["is_it_correct"]
 
 for item in data1:
-    if item["is_it_correct"] != judgments2.get(item["idx"], False):
+    if item["is_it_correct"] != judgments2.get(key(item), False):
         print("Question:")
         print(item["question"])
         print()
@@ -29,7 +29,7 @@ for item in data1:
         print(item["extracted_answer"])
         print()
         print()
-        if judgments2[item["idx"]]:
+        if judgments2[key(item)]:
             print2 = "Equivalent"
         else:
             print2= "Not Equivalent"
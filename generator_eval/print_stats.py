@@ -1,16 +1,10 @@
-import json
+from storage import load_items, benchmark_of
 
-with open("./qwen3_4b_think_responses/qwen25_14b_detailed_zero_shot_results.json", "r") as f:
-    all_items = json.load(f)
+all_items = load_items("./qwen3_4b_think_responses/qwen25_14b_detailed_zero_shot_results.json")
 
 benchmark_stats = {}
 for item in all_items:
-    idx = item.get("idx", "")
-    if "/" in idx:
-        benchmark = idx.split("/")[0]
-    else:
-        benchmark = "unknown"
-        
+    benchmark = benchmark_of(item)
     if benchmark not in benchmark_stats:
         benchmark_stats[benchmark] = {"total": 0, "correct": 0}
     
@@ -1,13 +1,18 @@
 from vllm import LLM, SamplingParams
-import json
 import os
-from tqdm import tqdm
 import argparse
-import time
-import math
 from transformers import AutoTokenizer
+from storage import load_items, save_items, merge_completed, benchmark_of
+from metrics import RunMetrics, get_logger
+from replay import open_llm
+from template_compiler import ChatPromptFormat, PromptRenderer, judge_fields
+from sequential import SequentialEstimator
+from preflight import Preflight, context_length_of
+from preemption import Preemption
 
 
+logger = get_logger("qwen_eval")
+
 CONCISE_ZERO_SHOT = """### Question: [HERE_IS_THE_QUESTION]
 
 ### Candidate 1: [HERE_IS_THE_GROUND_TRUTH]
@@ -75,7 +80,7 @@ def validate_output(text):
         return True, "Final Judgment: No"
     return False, None
 
-def init_llm(model_path, gpu_per_node):
+def init_llm(model_path, gpu_per_node, max_model_len=None):
     return LLM(model=model_path, 
         gpu_memory_utilization=0.9,
         max_num_batched_tokens=32768,
@@ -83,7 +88,8 @@ def init_llm(model_path, gpu_per_node):
         enable_prefix_caching=True, 
         enable_chunked_prefill=True,
         swap_space=16,
-        max_num_seqs=1024)
+        max_num_seqs=1024,
+        max_model_len=max_model_len)
 
 def extract_judgment(judgment_str: str) -> tuple[str, bool]:
     """Extract judgment and determine if it's correct."""
@@ -103,58 +109,64 @@ def calculate_tokens(tokenizer, text):
 
 def process_benchmarks(model_path, gpu_per_node, input_file, output_file, 
                       temperature, top_p, top_k, min_p, max_tokens,
-                      start_index=None, end_index=None):
+                      start_index=None, end_index=None, metrics_file=None,
+                      record_dir=None, replay_dir=None, replay_latency=0.0,
+                      compiled_prompts=True, render_check=64, render_workers=1,
+                      target_half_width=None, confidence=0.95, estimate_level="benchmark",
+                      round_size=512, min_per_stratum=10, seed=0, estimate_file=None,
+                      max_model_len=None, overlength_policy="truncate", routed_file=None,
+                      requeue=False, walltime_margin=300.0, section_seconds=600.0):
+    metrics = RunMetrics("qwen_eval", metrics_file, logger)
+    # Stop between sections on SIGTERM/SIGUSR1 or before the walltime, instead of losing a section
+    preemption = Preemption(output_file, requeue, walltime_margin, section_seconds, logger=logger, metrics=metrics)
+    
     # Initialize tokenizer for token counting
     tokenizer = AutoTokenizer.from_pretrained(model_path)
     
     # Load the input file - check if output file exists for resuming
-    if os.path.exists(output_file):
-        print(f"Output file {output_file} exists. Loading from it for resuming...")
-        with open(output_file, "r") as f:
-            completed_items = json.load(f)
+    with metrics.phase("load"):
+        if os.path.exists(output_file):
+            logger.info(f"Output file {output_file} exists. Loading from it for resuming...")
+            completed_items = load_items(output_file)
         
-        # Load original data from input file
-        with open(input_file, "r") as f:
-            all_items = json.load(f)
+            # Load original data from input file
+            all_items = load_items(input_file)
         
-        # Merge completed items back into all_items by matching idx
-        completed_dict = {item["idx"]: item for item in completed_items}
-        for idx, item in enumerate(all_items):
-            if item["idx"] in completed_dict:
-                all_items[idx] = completed_dict[item["idx"]]
-    else:
-        print(f"Loading from input file {input_file}")
-        with open(input_file, "r") as f:
-            all_items = json.load(f)
+            # Merge completed items back into all_items by matching idx
+            merge_completed(all_items, completed_items)
+        else:
+            logger.info(f"Loading from input file {input_file}")
+            all_items = load_items(input_file)
     
     # Apply start_index and end_index slicing
     if start_index is not None or end_index is not None:
         items = all_items[start_index:end_index]
-        print(f"Processing slice [{start_index}:{end_index}] = {len(items)} items from {input_file}")
+        logger.info(f"Processing slice [{start_index}:{end_index}] = {len(items)} items from {input_file}")
     else:
         items = all_items
-        print(f"Processing all {len(items)} items from {input_file}")
+        logger.info(f"Processing all {len(items)} items from {input_file}")
     
     # First, handle items using simple string comparison (AIME/GPQA) or failed to process
     aime_gpqa_processed_count = 0
     failed_to_process_count = 0
     
-    for i, item in enumerate(items):
-        # Add token count for response if not already present
-        if "response_tokens" not in item and "response" in item:
-            item["response_tokens"] = calculate_tokens(tokenizer, item["response"])
-            items[i] = item
-        
-        if ("judgment" not in item or "is_it_correct" not in item):
-            # Handle [FAILED_TO_PROCESS] cases
-            if item.get("extracted_answer") == "[FAILED_TO_PROCESS]":
-                item["judgment"] = ""
-                item["is_it_correct"] = False
+    with metrics.phase("tokenize"):
+        for i, item in enumerate(items):
+            # Add token count for response if not already present
+            if "response_tokens" not in item and "response" in item:
+                item["response_tokens"] = calculate_tokens(tokenizer, item["response"])
                 items[i] = item
-                failed_to_process_count += 1
+        
+            if ("judgment" not in item or "is_it_correct" not in item):
+                # Handle [FAILED_TO_PROCESS] cases
+                if item.get("extracted_answer") == "[FAILED_TO_PROCESS]":
+                    item["judgment"] = ""
+                    item["is_it_correct"] = False
+                    items[i] = item
+                    failed_to_process_count += 1
     
-    print(f"Processed {aime_gpqa_processed_count} items with 'AIME' or 'GPQA' in idx using simple string comparison")
-    print(f"Processed {failed_to_process_count} '[FAILED_TO_PROCESS]' items")
+    logger.info(f"Processed {aime_gpqa_processed_count} items with 'AIME' or 'GPQA' in idx using simple string comparison")
+    logger.info(f"Processed {failed_to_process_count} '[FAILED_TO_PROCESS]' items")
     
     # Filter items that need vLLM evaluation (not AIME/GPQA, not failed, don't have judgment)
     items_to_process = []
@@ -163,14 +175,17 @@ def process_benchmarks(model_path, gpu_per_node, input_file, output_file,
             ("judgment" not in item or "is_it_correct" not in item)):
             items_to_process.append((i, item))
     
-    print(f"Found {len(items_to_process)} items that need vLLM evaluation")
+    logger.info(f"Found {len(items_to_process)} items that need vLLM evaluation")
     
     if not items_to_process:
-        print("All items already processed. Exiting.")
+        logger.info("All items already processed. Exiting.")
+        preemption.finish()
         return
     
     # Initialize LLM
-    llm = init_llm(model_path, gpu_per_node)
+    # A replay run serves recorded outputs and never loads the model
+    llm = open_llm(lambda: init_llm(model_path, gpu_per_node, max_model_len), "qwen_eval",
+                   record_dir, replay_dir, replay_latency, logger)
     
     # Create sampling parameters
     sampling_params = SamplingParams(
@@ -182,124 +197,155 @@ def process_benchmarks(model_path, gpu_per_node, input_file, output_file,
         stop=["<End of Judgment>"]
     )
     
-    # Split into 10 sections
-    num_sections = 4
-    section_size = math.ceil(len(items_to_process) / num_sections)
+    # Static template and chat scaffolding are tokenized once, per item only the fields
+    # (pass DETAILED_FEW_SHOT or CONCISE_ZERO_SHOT instead to judge with those templates)
+    renderer = PromptRenderer(DETAILED_ZERO_SHOT, ChatPromptFormat(tokenizer), render_check, render_workers,
+                              compiled_prompts, logger, metrics)
+    try:
+        # Over-length prompts are truncated, skipped or routed here instead of failing their section in generate
+        preflight = None
+        context_length = max_model_len or context_length_of(llm)
+        if context_length:
+            preflight = Preflight(context_length, max_tokens, renderer.render, len, overlength_policy, logger, metrics)
+        else:
+            logger.warning("Context length unknown, prompt lengths are not checked; pass --max_model_len to check them")
+    
+        # Sequential estimation judges random rounds only until the accuracies are pinned
+        estimator = None
+        if target_half_width is not None:
+            estimator = SequentialEstimator(items, benchmark_of, target_half_width, confidence, estimate_level,
+                                            round_size, min_per_stratum, seed, logger)
+    
+        # Sections sized to take about section_seconds each, so one started before a stop signal is saved in time
+        sections = preemption.sections(items_to_process)
+        if estimator is not None:
+            # Random rounds from the benchmarks whose interval is still too wide, until none is
+            sections = estimator.rounds(items_to_process)
     
-    for section_idx in range(num_sections):
-        start_idx = section_idx * section_size
-        end_idx = min((section_idx + 1) * section_size, len(items_to_process))
+        remaining = len(items_to_process)
+        for section_idx, section_items in enumerate(sections):
+            if preemption.stop_requested():
+                logger.info(f"Stopping before section {section_idx + 1} ({preemption.reason})")
+                break
         
-        if start_idx >= len(items_to_process):
-            break
-            
-        section_items = items_to_process[start_idx:end_idx]
-        print(f"Processing section {section_idx + 1}/{num_sections} with {len(section_items)} items")
+            logger.info(f"Processing section {section_idx + 1} with {len(section_items)} items ({remaining} left)")
+            remaining -= len(section_items)
         
-        # Prepare prompts for this section
-        prompts = []
-        for _, item in section_items:
-            # Handle answer format
-            if type(item["answer"]) == list:
-                ground_truth = " ".join(item["answer"])
-            else:
-                ground_truth = item["answer"]
-            
-            # prompt_content = DETAILED_FEW_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
-            # prompt_content = CONCISE_ZERO_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
-            prompt_content = DETAILED_ZERO_SHOT.replace("[HERE_IS_THE_QUESTION]", item["question"]).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", item["extracted_answer"])
-            
-            # Use chat template format like in response_generation_qwen.py
-            messages = [
-                {"role": "user", "content": prompt_content}
-            ]
-            text = tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
-            prompts.append(text)
+            # Prepare prompts for this section
+            with metrics.phase("render"):
+                prompt_token_ids = renderer.render(judge_fields(item) for _, item in section_items)
+            if preflight is not None:
+                with metrics.phase("preflight"):
+                    section_items, prompt_token_ids = preflight.admit(section_items, prompt_token_ids, judge_fields)
         
-        try:
-            # Run vLLM inference for this section
-            print(f"Running vLLM inference for section {section_idx + 1}...")
-            batch_outputs = llm.generate(prompts, sampling_params)
+            try:
+                # Run vLLM inference for this section
+                logger.info(f"Running vLLM inference for section {section_idx + 1}...")
+                metrics.set_queue_depth(len(prompt_token_ids))
+                # Prompts that leave less room than max_tokens in the context get max_tokens clamped
+                section_params = sampling_params if preflight is None else preflight.sampling_params(section_items, sampling_params)
+                with metrics.phase("generate"):
+                    batch_outputs = llm.generate(prompt_token_ids=prompt_token_ids, sampling_params=section_params)
+                metrics.record_vllm_outputs(batch_outputs)
             
-            # Process results and add to items
-            for (original_idx, item), output in zip(section_items, batch_outputs):
-                judgment_output = output.outputs[0].text.strip()
-                judgment, is_correct = extract_judgment(judgment_output)
+                # Process results and add to items
+                with metrics.phase("parse"):
+                    for (original_idx, item), output in zip(section_items, batch_outputs):
+                        judgment_output = output.outputs[0].text.strip()
+                        judgment, is_correct = extract_judgment(judgment_output)
                 
-                # Add judgment and is_it_correct
-                item["judgment"] = judgment
-                item["is_it_correct"] = is_correct
+                        # Add judgment and is_it_correct
+                        item["judgment"] = judgment
+                        item["is_it_correct"] = is_correct
                 
-                # Update the original item in the items list
-                items[original_idx] = item
+                        # Update the original item in the items list
+                        items[original_idx] = item
             
-            print(f"Successfully processed section {section_idx + 1}")
+                metrics.count("items", len(section_items))
+                logger.info(f"Successfully processed section {section_idx + 1}")
             
-        except Exception as e:
-            print(f"Error processing section {section_idx + 1}: {str(e)}")
-            # For failed items in this section, mark them as failed
-            for original_idx, item in section_items:
-                if "judgment" not in item:
-                    item["judgment"] = "[FAILED_TO_PROCESS]"
-                if "is_it_correct" not in item:
-                    item["is_it_correct"] = False
-                items[original_idx] = item
+            except Exception as e:
+                if preemption.requested:
+                    # The stop signal reached the vLLM workers too; the section is left for the resumed run
+                    logger.warning(f"Section {section_idx + 1} interrupted by {preemption.reason}: {str(e)}")
+                else:
+                    logger.error(f"Error processing section {section_idx + 1}: {str(e)}")
+                    # For failed items in this section, mark them as failed
+                    for original_idx, item in section_items:
+                        if "judgment" not in item:
+                            item["judgment"] = "[FAILED_TO_PROCESS]"
+                        if "is_it_correct" not in item:
+                            item["is_it_correct"] = False
+                        items[original_idx] = item
         
-        # Save progress after each section with timing
-        save_start_time = time.time()
-        print(f"Starting to save progress after section {section_idx + 1}...")
+            # Save progress after each section with timing
+            logger.info(f"Starting to save progress after section {section_idx + 1}...")
         
-        # Save progress after each section
-        if start_index is not None or end_index is not None:
-            # If we're working with a slice, save only the slice
-            items_to_save = items
-        else:
-            # Save all items (both completed and pending)
-            items_to_save = items
+            # Save progress after each section
+            if start_index is not None or end_index is not None:
+                # If we're working with a slice, save only the slice
+                items_to_save = items
+            else:
+                # Save all items (both completed and pending)
+                items_to_save = items
         
-        # Log file info (avoid expensive size calculation)
-        print(f"Preparing to save {len(items_to_save)} items to {output_file}...")
+            # Log file info (avoid expensive size calculation)
+            logger.info(f"Preparing to save {len(items_to_save)} items to {output_file}...")
         
-        # Write with reduced indentation to save space and time
-        with open(output_file, "w") as f:
-            json.dump(items_to_save, f, indent=2, ensure_ascii=False)
+            # Write with reduced indentation to save space and time
+            with metrics.phase("save"):
+                save_items(items_to_save, output_file, indent=2)
         
-        save_end_time = time.time()
-        save_duration = save_end_time - save_start_time
-        completed_count = sum(1 for item in items_to_save if "judgment" in item and "is_it_correct" in item)
-        print(f"Saved {len(items_to_save)} total items ({completed_count} completed) to {output_file} (section {section_idx + 1} completed)")
-        print(f"Save operation took {save_duration:.2f} seconds")
+            save_duration = metrics.last_duration("save")
+            completed_count = sum(1 for item in items_to_save if "judgment" in item and "is_it_correct" in item)
+            logger.info(f"Saved {len(items_to_save)} total items ({completed_count} completed) to {output_file} (section {section_idx + 1} completed)")
+            logger.info(f"Save operation took {save_duration:.2f} seconds")
         
-        # Log the number of items processed so far
-        processed_count = sum(1 for item in items if "judgment" in item and "is_it_correct" in item)
-        print(f"Total items processed so far: {processed_count}/{len(items)}")
+            # Log the number of items processed so far
+            processed_count = sum(1 for item in items if "judgment" in item and "is_it_correct" in item)
+            logger.info(f"Total items processed so far: {processed_count}/{len(items)}")
+            metrics.export()
     
-    # Calculate benchmark-specific statistics
-    benchmark_stats = {}
-    for item in items:
-        idx = item.get("idx", "")
-        if "/" in idx:
-            benchmark = idx.split("/")[0]
-        else:
-            benchmark = "unknown"
-            
-        if benchmark not in benchmark_stats:
-            benchmark_stats[benchmark] = {"total": 0, "correct": 0}
+        # Everything completed is saved; record the stop and requeue instead of reporting a partial run
+        if preemption.requested:
+            preemption.stop(sum(1 for item in items if "judgment" not in item or "is_it_correct" not in item))
+            metrics.log_summary()
+            metrics.export()
+            return
+    
+        # Calculate benchmark-specific statistics
+        benchmark_stats = {}
+        for item in items:
+            benchmark = benchmark_of(item)
+            if benchmark not in benchmark_stats:
+                benchmark_stats[benchmark] = {"total": 0, "correct": 0}
         
-        benchmark_stats[benchmark]["total"] += 1
-        if item.get("is_it_correct") == True:
-            benchmark_stats[benchmark]["correct"] += 1
+            benchmark_stats[benchmark]["total"] += 1
+            if item.get("is_it_correct") == True:
+                benchmark_stats[benchmark]["correct"] += 1
+    
+        logger.info(f"Benchmark-specific statistics:")
+        for benchmark, stats in sorted(benchmark_stats.items()):
+            accuracy = stats["correct"] / stats["total"] if stats["total"] > 0 else 0.0
+            logger.info(f"{benchmark}: {stats['correct']}/{stats['total']} ({accuracy:.4f})")
+    
+        if estimator is not None:
+            # The counts above take unjudged items as incorrect; these are the sampled estimates
+            estimator.log_report()
+            estimator.save(estimate_file or output_file + ".estimate.json")
     
-    print(f"\nBenchmark-specific statistics:")
-    for benchmark, stats in sorted(benchmark_stats.items()):
-        accuracy = stats["correct"] / stats["total"] if stats["total"] > 0 else 0.0
-        print(f"{benchmark}: {stats['correct']}/{stats['total']} ({accuracy:.4f})")
+        if preflight is not None:
+            preflight.log_report()
+            preflight.save(output_file + ".preflight.json")
+            preflight.save_routed(routed_file or output_file + ".routed.json")
     
-    print(f"\nSuccessfully processed {len(items_to_process)} items and saved to {output_file}")
+        preemption.finish()
+        logger.info(f"Successfully processed {len(items_to_process)} items and saved to {output_file}")
+        metrics.log_summary()
+        metrics.export()
+    finally:
+        # The render pool is shut down on every exit, errors included
+        renderer.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate responses using Qwen model with vLLM.")
@@ -314,9 +360,38 @@ if __name__ == "__main__":
     parser.add_argument("--max_tokens", type=int, default=8192, help="Maximum tokens to generate.")
     parser.add_argument("--start_index", type=int, help="Start index for data slicing.")
     parser.add_argument("--end_index", type=int, help="End index for data slicing.")
+    parser.add_argument("--metrics_file", type=str, help="Write phase timings, throughput and latency metrics here (.json, or .prom for a Prometheus textfile).")
+    parser.add_argument("--log_level", type=str, help="Logging level (DEBUG, INFO, WARNING, ERROR; default: $LOG_LEVEL, else INFO).")
+    parser.add_argument("--record_dir", type=str, help="Record every generate() request with its outputs into this directory.")
+    parser.add_argument("--replay_dir", type=str, help="Serve outputs recorded with --record_dir instead of loading the model.")
+    parser.add_argument("--replay_latency", type=float, default=0.0, help="Scale of recorded latencies simulated in replay (0 = memory speed, 1 = as recorded).")
+    parser.add_argument("--no_compiled_prompts", action="store_true", help="Render every prompt through the chat template instead of the compiled template.")
+    parser.add_argument("--render_check", type=int, default=64, help="Number of compiled prompts checked against the chat template (-1 = all).")
+    parser.add_argument("--render_workers", type=int, default=1, help="Worker processes for prompt tokenization.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sequential estimation draws.")
+    parser.add_argument("--target_half_width", type=float, help="Sequential estimation: judge random rounds until every benchmark's accuracy interval is within ± this (e.g. 0.01).")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the sequential estimation intervals.")
+    parser.add_argument("--estimate_level", type=str, default="benchmark", choices=["benchmark", "stratum"], help="Stop per benchmark, or per (benchmark, category) stratum.")
+    parser.add_argument("--round_size", type=int, default=512, help="Items judged per sequential estimation round.")
+    parser.add_argument("--min_per_stratum", type=int, default=10, help="Items judged in every stratum before a benchmark can stop.")
+    parser.add_argument("--estimate_file", type=str, help="Where to write the estimates (default: <output_file>.estimate.json).")
+    parser.add_argument("--max_model_len", type=int, help="Context window of the judge (default: the model's); prompts that leave it less than --max_tokens get max_tokens clamped, those that do not fit are handled by --overlength_policy.")
+    parser.add_argument("--overlength_policy", type=str, default="truncate", choices=["truncate", "skip", "route"], help="Over-length prompts: truncate the candidate, skip the item, or route it to --routed_file for a longer-context judge.")
+    parser.add_argument("--routed_file", type=str, help="Where routed items are written (default: <output_file>.routed.json).")
+    parser.add_argument("--requeue", action="store_true", help="After a stop on SIGTERM/SIGUSR1 or the walltime, requeue the SLURM job with scontrol (needs #SBATCH --requeue).")
+    parser.add_argument("--walltime_margin", type=float, default=300.0, help="Do not start a section unless it is expected to finish this many seconds before the job's end time.")
+    parser.add_argument("--section_seconds", type=float, default=600.0, help="Target seconds per section (sized from the measured throughput); keep it below the USR1 lead time of the SLURM script.")
     
     args = parser.parse_args()
+    if args.log_level:
+        logger.setLevel(args.log_level.upper())
     
     process_benchmarks(args.model_path, args.gpu_per_node, args.input_file, args.output_file,
                       args.temperature, args.top_p, args.top_k, args.min_p, args.max_tokens,
-                      args.start_index, args.end_index)
+                      args.start_index, args.end_index, args.metrics_file,
+                      args.record_dir, args.replay_dir, args.replay_latency,
+                      not args.no_compiled_prompts, args.render_check, args.render_workers,
+                      args.target_half_width, args.confidence, args.estimate_level,
+                      args.round_size, args.min_per_stratum, args.seed, args.estimate_file,
+                      args.max_model_len, args.overlength_policy, args.routed_file,
+                      args.requeue, args.walltime_margin, args.section_seconds)
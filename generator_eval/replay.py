@@ -0,0 +1,264 @@
+"""
+Record/replay layer under llm.generate and openai_inference.
+
+With --record_dir every request a driver sends (prompt plus the sampling parameters that affect
+the answer) is appended to <record_dir>/<driver>.<host>.<pid>.jsonl together with the response,
+usage and latency. With --replay_dir the driver serves those recorded answers instead of loading
+a model or calling the API, so changes to extract_judgment, stats or aggregation can be re-run
+over full datasets offline. Identical requests (e.g. two trials with the same extracted answer)
+are answered with their recordings in the order they were recorded.
+
+--replay_latency scales the recorded latencies: 0 (default) replays at memory speed, 1.0
+reproduces the recorded request latencies for throughput experiments.
+
+Requests are keyed by the prompt as sent. qwen_eval.py and oss_eval.py send prompt token ids
+since the prompt renderer; their recordings made before it are keyed by prompt strings, cannot
+be replayed, and are reported as such on the first miss.
+"""
+import glob
+import hashlib
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# SamplingParams fields that change what the engine returns for a prompt
+SAMPLING_FIELDS = ("n", "temperature", "top_p", "top_k", "min_p", "max_tokens", "seed", "stop", "stop_token_ids")
+
+
+class ReplayMiss(KeyError):
+    pass
+
+
+def request_key(request):
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+def sampling_params_dict(params):
+    fields = {}
+    for name in SAMPLING_FIELDS:
+        value = getattr(params, name, None)
+        fields[name] = list(value) if isinstance(value, (list, tuple, set)) else value
+    return fields
+
+
+class Recorder:
+    """Appends (request, response, usage, latency) records to a per-process JSONL file."""
+
+    def __init__(self, record_dir, name):
+        os.makedirs(record_dir, exist_ok=True)
+        self.path = os.path.join(record_dir, f"{name}.{socket.gethostname()}.{os.getpid()}.jsonl")
+        self.file = open(self.path, "a")
+        self.num_records = 0
+
+    def record(self, request, response, usage=None, latency=None):
+        record = {
+            "key": request_key(request),
+            "request": request,
+            "response": response,
+            "usage": usage,
+            "latency": latency,
+            "time": time.time(),
+        }
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.num_records += 1
+
+    def flush(self):
+        # Called once per batch so a killed run keeps everything it paid for
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ReplayStore:
+    """All records under a replay directory, looked up by request."""
+
+    def __init__(self, replay_dir, latency_scale=0.0):
+        self.latency_scale = latency_scale
+        self.records = {}
+        self.cursors = {}
+        paths = sorted(glob.glob(os.path.join(replay_dir, "*.jsonl")))
+        if not paths:
+            raise FileNotFoundError(f"No recordings (*.jsonl) found in {replay_dir}")
+        loaded = []
+        for path in paths:
+            with open(path, "r") as f:
+                loaded.extend(json.loads(line) for line in f if line.strip())
+        # Files are per process, so order duplicates by recording time across files
+        loaded.sort(key=lambda record: record.get("time") or 0)
+        for record in loaded:
+            self.records.setdefault(record["key"], []).append(record)
+        self.num_records = len(loaded)
+        self.num_string_prompts = sum(1 for record in loaded if isinstance(record["request"].get("prompt"), str))
+
+    def lookup(self, request):
+        """Next recording of this request; repeats cycle through the recordings in order."""
+        key = request_key(request)
+        records = self.records.get(key)
+        if not records:
+            raise ReplayMiss(key)
+        cursor = self.cursors.get(key, 0)
+        self.cursors[key] = cursor + 1
+        return records[cursor % len(records)]
+
+    def lookup_all(self, requests):
+        records = []
+        misses = 0
+        for request in requests:
+            try:
+                records.append(self.lookup(request))
+            except ReplayMiss:
+                misses += 1
+        if misses:
+            message = f"{misses}/{len(requests)} requests have no recording in the replay directory"
+            if self.num_string_prompts and any(isinstance(request.get("prompt"), dict) for request in requests):
+                message += (f"; {self.num_string_prompts} recordings are keyed by prompt string but these requests "
+                            "send prompt token ids (qwen_eval.py/oss_eval.py recordings from before the prompt "
+                            "renderer), re-record them with --record_dir")
+            raise ReplayMiss(message)
+        return records
+
+    def delay(self, latency):
+        if self.latency_scale > 0 and latency:
+            time.sleep(latency * self.latency_scale)
+
+
+### vLLM
+class ReplayCompletion:
+    def __init__(self, index, text, token_ids, finish_reason):
+        self.index = index
+        self.text = text
+        self.token_ids = token_ids
+        self.finish_reason = finish_reason
+        self.cumulative_logprob = None
+        self.logprobs = None
+
+
+class ReplayRequestOutput:
+    def __init__(self, request_id, prompt, prompt_token_ids, outputs):
+        self.request_id = request_id
+        self.prompt = prompt
+        self.prompt_token_ids = prompt_token_ids
+        self.outputs = outputs
+        self.finished = True
+        self.metrics = None
+
+
+def generate_requests(prompts, sampling_params, prompt_token_ids):
+    """One replayable request per prompt of an llm.generate call (str, token ids or {"prompt_token_ids": ...})."""
+    if prompt_token_ids is not None:
+        prompts = [{"prompt_token_ids": list(ids)} for ids in prompt_token_ids]
+    elif isinstance(prompts, (str, dict)):
+        prompts = [prompts]
+    if isinstance(sampling_params, (list, tuple)):
+        params_list = list(sampling_params)
+    else:
+        params_list = [sampling_params] * len(prompts)
+    return [
+        {"prompt": prompt, "sampling_params": sampling_params_dict(params)}
+        for prompt, params in zip(prompts, params_list)
+    ]
+
+def output_response(output):
+    return {
+        "outputs": [
+            {"text": completion.text, "token_ids": list(completion.token_ids), "finish_reason": completion.finish_reason}
+            for completion in output.outputs
+        ],
+        "num_prompt_tokens": len(output.prompt_token_ids or []),
+    }
+
+def output_latency(output, batch_seconds):
+    request_metrics = getattr(output, "metrics", None)
+    arrival_time = getattr(request_metrics, "arrival_time", None)
+    finished_time = getattr(request_metrics, "finished_time", None)
+    if arrival_time and finished_time:
+        return finished_time - arrival_time
+    return batch_seconds
+
+
+class RecordingLLM:
+    """Wraps a vLLM LLM and records every generate() request with its outputs."""
+
+    def __init__(self, llm, recorder):
+        self.llm = llm
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def generate(self, prompts=None, sampling_params=None, prompt_token_ids=None, **kwargs):
+        requests = generate_requests(prompts, sampling_params, prompt_token_ids)
+        start_time = time.time()
+        if prompt_token_ids is not None:
+            outputs = self.llm.generate(prompt_token_ids=prompt_token_ids, sampling_params=sampling_params, **kwargs)
+        else:
+            outputs = self.llm.generate(prompts, sampling_params, **kwargs)
+        batch_seconds = time.time() - start_time
+        for request, output in zip(requests, outputs):
+            response = output_response(output)
+            usage = {
+                "prompt_tokens": response["num_prompt_tokens"],
+                "completion_tokens": sum(len(completion["token_ids"]) for completion in response["outputs"]),
+            }
+            self.recorder.record(request, response, usage, output_latency(output, batch_seconds))
+        self.recorder.flush()
+        return outputs
+
+
+class ReplayLLM:
+    """Serves llm.generate from recordings; the batch takes as long as its slowest recorded request."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def generate(self, prompts=None, sampling_params=None, prompt_token_ids=None, **kwargs):
+        requests = generate_requests(prompts, sampling_params, prompt_token_ids)
+        records = self.store.lookup_all(requests)
+        self.store.delay(max((record.get("latency") or 0 for record in records), default=0))
+        outputs = []
+        for request_id, (request, record) in enumerate(zip(requests, records)):
+            prompt = request["prompt"]
+            outputs.append(ReplayRequestOutput(
+                str(request_id),
+                prompt if isinstance(prompt, str) else None,
+                prompt.get("prompt_token_ids") if isinstance(prompt, dict) else None,
+                [
+                    ReplayCompletion(index, completion["text"], completion["token_ids"], completion["finish_reason"])
+                    for index, completion in enumerate(record["response"]["outputs"])
+                ]
+            ))
+        return outputs
+
+def open_llm(init, name, record_dir=None, replay_dir=None, replay_latency=0.0, logger=None):
+    """The driver's engine: init() as is, wrapped for recording, or a replay stand-in (no model load)."""
+    if replay_dir:
+        store = ReplayStore(replay_dir, replay_latency)
+        if logger:
+            logger.info(f"Replaying {store.num_records} recorded requests from {replay_dir}")
+        return ReplayLLM(store)
+    llm = init()
+    if record_dir:
+        recorder = Recorder(record_dir, name)
+        if logger:
+            logger.info(f"Recording requests to {recorder.path}")
+        return RecordingLLM(llm, recorder)
+    return llm
+
+
+### OpenAI chat completions
+def replay_chat_completions(store, requests, max_workers=32):
+    """
+    Answer chat.completions requests from recordings, as {"content", "latency", "usage"} like
+    process_prompt. With a latency scale the delays overlap across max_workers, as with the live pool.
+    """
+    records = store.lookup_all(requests)
+    results = [
+        {"content": record["response"]["content"], "latency": record.get("latency"), "usage": record.get("usage")}
+        for record in records
+    ]
+    if store.latency_scale > 0:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(store.delay, [result["latency"] for result in results]))
+    return results
@@ -1,18 +1,27 @@
-import json
 import os
-from tqdm import tqdm
 import argparse
 from vllm import LLM, SamplingParams
 from transformers import AutoTokenizer
-import re
-import math
-import time
+from storage import load_items, save_items, merge_completed
+from metrics import RunMetrics, get_logger
+from replay import open_llm
+from group_with_extract import extract_solution_fast_accurate
+from preemption import Preemption
+from preflight import context_length_of
+
+logger = get_logger("response_generation")
 
 system_message = """The reasoning process and answer should be enclosed within <think> </think> and <answer> </answer> tags, respectively (i.e., <think> reasoning process here </think> <answer> answer here </answer>).
 Between <answer> and </answer>, you should be concise and only provide the final prediction without any additional explanations (e.g., <answer> C </answer>).
 If a question consists of multiple sub-problems and explicitly asks for more than one answer, write all answers inside <answer> and </answer> tags (e.g., <answer> *answer 1: $x$ *answer 2: $$L = \\frac{1}{2} m \\dot{x}^2 \\left(1 + \\frac{4x^2}{a^2}\\right) - \\frac{mgx^2}{a}$$ </answer>).
 Also, if your prediction is a real number, do not round it to a specific number of decimal places, but rather provide the full precision including the unit (e.g., <answer> 0.5206 m^2 </answer>)."""
 
+recovery_message = "State only the final answer to the question above, enclosed in <answer> </answer> tags, without any explanation."
+# Tokens short of max_tokens at which a response without a recorded finish_reason still counts as cut off
+TRUNCATION_SLACK_TOKENS = 16
+# Room kept free in the context by a continuation: prompt + partial response is re-tokenized as one text
+CONTEXT_SLACK_TOKENS = 16
+
 def extract_answer_content(text):
     """
     Extract content between the last <answer> and </answer> tags with validation.
@@ -58,52 +67,295 @@ def init_llm(model_path, gpu_per_node):
         max_num_seqs=1024)
 
 
+def is_truncated(item, max_tokens, tokenizer):
+    """Check if a stored response stopped on the token limit before closing its answer."""
+    response = item.get("response")
+    if not response or response == "[FAILED_TO_PROCESS]":
+        return False
+    if item.get("extracted_answer") != "[FAILED_TO_PROCESS]" or "</answer>" in response:
+        return False
+    if "finish_reason" in item:
+        return item["finish_reason"] == "length"
+    # Older outputs don't record finish_reason: only a response that used up max_tokens was cut off
+    # (re-encoding the stored, stripped text can come out a few tokens short)
+    return len(tokenizer.encode(response, add_special_tokens=False)) >= max_tokens - TRUNCATION_SLACK_TOKENS
+
+def continue_truncated(llm, sampling_params, prompts, responses, response_tokens,
+                       continuation_tokens, max_total_tokens, prompt_tokens):
+    """
+    Extend truncated responses in bounded increments until they finish or hit max_total_tokens or
+    the context length. Each round re-submits prompt + partial response, so with prefix caching only
+    the new tokens are paid for. A failed round keeps what the earlier rounds added.
+    Returns the extended responses, their token counts and their final finish reasons.
+    """
+    max_model_len = context_length_of(llm)
+    responses = list(responses)
+    response_tokens = list(response_tokens)
+    finish_reasons = ["length"] * len(prompts)
+    pending = list(range(len(prompts)))
+    
+    round_idx = 0
+    while pending:
+        requests = []
+        request_params = []
+        active = []
+        for i in pending:
+            remaining = max_total_tokens - response_tokens[i]
+            if max_model_len:
+                remaining = min(remaining, max_model_len - prompt_tokens[i] - response_tokens[i] - CONTEXT_SLACK_TOKENS)
+            if remaining <= 0:
+                continue
+            params = sampling_params.clone()
+            params.max_tokens = min(continuation_tokens, remaining)
+            requests.append(prompts[i] + responses[i])
+            request_params.append(params)
+            active.append(i)
+        
+        if not active:
+            break
+        
+        round_idx += 1
+        logger.info(f"Continuation round {round_idx}: extending {len(active)} truncated responses")
+        try:
+            outputs = llm.generate(requests, request_params)
+        except Exception as e:
+            # The responses keep finish_reason "length", so a resumed run with --continue_truncated retries them
+            logger.error(f"Continuation round {round_idx} failed, keeping the responses extended so far: {str(e)}")
+            break
+        
+        pending = []
+        for i, output in zip(active, outputs):
+            completion = output.outputs[0]
+            responses[i] += completion.text
+            response_tokens[i] += len(completion.token_ids)
+            finish_reasons[i] = completion.finish_reason
+            if completion.finish_reason == "length" and "</answer>" not in responses[i]:
+                pending.append(i)
+    
+    return responses, response_tokens, finish_reasons
+
+def needs_recovery(item):
+    """A generated response that neither the <answer> tags nor the boxed/"Final Answer" patterns extract from."""
+    response = item.get("response")
+    if not response or response == "[FAILED_TO_PROCESS]" or "answer_recovery" in item:
+        return False
+    return item.get("extracted_answer") == "[FAILED_TO_PROCESS]" and extract_solution_fast_accurate(response) is None
+
+def render_recovery_prompt(tokenizer, question, response, enable_thinking):
+    """
+    The original prompt and response verbatim, then the follow-up turn; answered without thinking.
+    Built by hand because the Qwen3 template strips <think> blocks from earlier assistant turns.
+    """
+    return (
+        render_prompt(tokenizer, question, enable_thinking) + response + "<|im_end|>\n"
+        + f"<|im_start|>user\n{recovery_message}<|im_end|>\n"
+        + "<|im_start|>assistant\n<think>\n\n</think>\n\n"
+    )
+
+def recover_answers(llm, sampling_params, tokenizer, items_to_recover, recovery_tokens, enable_thinking, metrics):
+    """
+    Ask once for the final answer of each unextractable response, in one batched call with a small
+    max_tokens. Sets extracted_answer where the follow-up gives one and records the attempt in
+    answer_recovery ("recovered" or "failed"), so resumed runs don't ask again. Recovered answers
+    also get extracted_answer_source "recovery" so graders can tell them apart, and the follow-up
+    text is kept in recovery_response. Returns the number recovered.
+    """
+    params = sampling_params.clone()
+    params.n = 1
+    params.temperature = 0.0
+    params.max_tokens = recovery_tokens
+    params.stop = ["</answer>"]
+    with metrics.phase("render"):
+        prompts = [render_recovery_prompt(tokenizer, item["question"], item["response"], enable_thinking)
+                   for _, item in items_to_recover]
+    with metrics.phase("generate"):
+        outputs = llm.generate(prompts, params)
+    metrics.record_vllm_outputs(outputs)
+    
+    recovered_count = 0
+    for (original_idx, item), output in zip(items_to_recover, outputs):
+        completion = output.outputs[0]
+        text = completion.text
+        # The stop string is not part of the output
+        if completion.finish_reason == "stop" and "</answer>" not in text:
+            text += "</answer>"
+        extracted_answer = extract_answer_content(text)
+        if extracted_answer:
+            item["extracted_answer"] = extracted_answer
+            item["extracted_answer_source"] = "recovery"
+            recovered_count += 1
+        item["answer_recovery"] = "recovered" if extracted_answer else "failed"
+        item["recovery_response"] = text
+    metrics.count("recovered", recovered_count)
+    return recovered_count
+
+def instance_key(idx):
+    """Strip the trial suffix so all trials of an instance share a key."""
+    return idx.rsplit("/trial_", 1)[0]
+
+def expand_instances(items, num_samples):
+    """Expand one-row-per-instance input into per-trial rows (idx/trial_k), keeping existing trial rows."""
+    expanded = []
+    for item in items:
+        if "/trial_" in item["idx"]:
+            expanded.append(item)
+            continue
+        for trial_idx in range(num_samples):
+            trial_item = dict(item)
+            trial_item["idx"] = f"{item['idx']}/trial_{trial_idx}"
+            expanded.append(trial_item)
+    return expanded
+
+def group_by_instance(section_items):
+    """Group pending trial rows of the same instance so their prompt is prefilled once with n samples."""
+    groups = {}
+    for original_idx, item in section_items:
+        key = (instance_key(item["idx"]), item["question"])
+        groups.setdefault(key, []).append((original_idx, item))
+    return list(groups.values())
+
+def render_prompt(tokenizer, question, enable_thinking):
+    messages = [
+        {"role": "system","content":system_message},
+        {"role": "user", "content": question}
+    ]
+    return tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True,
+        enable_thinking=enable_thinking
+    )
+
+def render_groups(tokenizer, sampling_params, section_items, enable_thinking):
+    """The section's trial rows grouped by instance, one prompt per group and its SamplingParams(n=len(group))."""
+    groups = group_by_instance(section_items)
+    prompts = []
+    group_params = []
+    for group in groups:
+        prompts.append(render_prompt(tokenizer, group[0][1]["question"], enable_thinking))
+        params = sampling_params.clone()
+        params.n = len(group)
+        group_params.append(params)
+    return groups, prompts, group_params
+
+def generate_trials(llm, sampling_params, groups, prompts, group_params, metrics,
+                    continue_truncated_responses=False, continuation_tokens=4096, max_total_tokens=None):
+    """
+    Generate a section's grouped prompts and expand the n samples of each instance back into
+    per-trial results: ([(original index, item)], responses, finish reasons), in matching order.
+    With continue_truncated_responses, responses that ran out of tokens are extended first.
+    """
+    with metrics.phase("generate"):
+        batch_outputs = llm.generate(prompts, group_params)
+    metrics.record_vllm_outputs(batch_outputs)
+
+    trial_items = []
+    trial_prompts = []
+    trial_prompt_tokens = []
+    responses = []
+    response_tokens = []
+    finish_reasons = []
+    for group, prompt, output in zip(groups, prompts, batch_outputs):
+        completions = sorted(output.outputs, key=lambda completion: completion.index)
+        for entry, completion in zip(group, completions):
+            trial_items.append(entry)
+            trial_prompts.append(prompt)
+            trial_prompt_tokens.append(len(output.prompt_token_ids or []))
+            responses.append(completion.text)
+            response_tokens.append(len(completion.token_ids))
+            finish_reasons.append(completion.finish_reason)
+
+    # Extend responses that ran out of tokens before closing </answer>
+    if continue_truncated_responses:
+        truncated = [j for j in range(len(responses))
+                     if finish_reasons[j] == "length" and "</answer>" not in responses[j]]
+        metrics.count("truncated", len(truncated))
+        with metrics.phase("generate"):
+            if truncated:
+                extended, _, extended_reasons = continue_truncated(
+                    llm, sampling_params,
+                    [trial_prompts[j] for j in truncated],
+                    [responses[j] for j in truncated],
+                    [response_tokens[j] for j in truncated],
+                    continuation_tokens, max_total_tokens,
+                    [trial_prompt_tokens[j] for j in truncated]
+                )
+                for j, response, reason in zip(truncated, extended, extended_reasons):
+                    responses[j] = response
+                    finish_reasons[j] = reason
+
+    return trial_items, responses, finish_reasons
+
 def process_benchmarks(model_path, gpu_per_node, input_file, output_file, 
                       temperature, top_p, top_k, min_p, max_tokens, enable_thinking,
-                      start_index=None, end_index=None):
+                      start_index=None, end_index=None,
+                      continue_truncated_responses=False, continuation_tokens=4096, max_total_tokens=None,
+                      num_samples=None, metrics_file=None,
+                      record_dir=None, replay_dir=None, replay_latency=0.0,
+                      recover=False, recovery_tokens=64, requeue=False, walltime_margin=300.0,
+                      section_seconds=600.0):
+    metrics = RunMetrics("response_generation", metrics_file, logger)
+    # Stop between sections on SIGTERM/SIGUSR1 or before the walltime, instead of losing a section
+    preemption = Preemption(output_file, requeue, walltime_margin, section_seconds, logger=logger, metrics=metrics)
+    
     # Load the input file - check if output file exists for resuming
-    if os.path.exists(output_file):
-        print(f"Output file {output_file} exists. Loading from it for resuming...")
-        with open(output_file, "r") as f:
-            completed_items = json.load(f)
+    with metrics.phase("load"):
+        if os.path.exists(output_file):
+            logger.info(f"Output file {output_file} exists. Loading from it for resuming...")
+            completed_items = load_items(output_file)
         
-        # Load original data from input file
-        with open(input_file, "r") as f:
-            all_items = json.load(f)
+            # Load original data from input file
+            all_items = load_items(input_file)
+            if num_samples:
+                all_items = expand_instances(all_items, num_samples)
         
-        # Merge completed items back into all_items by matching questions
-        completed_dict = {item["idx"]: item for item in completed_items}
-        for idx, item in enumerate(all_items):
-            if item["idx"] in completed_dict:
-                all_items[idx] = completed_dict[item["idx"]]
-    else:
-        print(f"Loading from input file {input_file}")
-        with open(input_file, "r") as f:
-            all_items = json.load(f)
+            # Merge completed items back into all_items by matching idx
+            merge_completed(all_items, completed_items)
+        else:
+            logger.info(f"Loading from input file {input_file}")
+            all_items = load_items(input_file)
+            if num_samples:
+                all_items = expand_instances(all_items, num_samples)
+                logger.info(f"Expanded instances to {len(all_items)} trial rows with {num_samples} samples each")
     
     # Apply start_index and end_index slicing
     if start_index is not None or end_index is not None:
         items = all_items[start_index:end_index]
-        print(f"Processing slice [{start_index}:{end_index}] = {len(items)} items from {input_file}")
+        logger.info(f"Processing slice [{start_index}:{end_index}] = {len(items)} items from {input_file}")
     else:
         items = all_items
-        print(f"Processing all {len(items)} items from {input_file}")
+        logger.info(f"Processing all {len(items)} items from {input_file}")
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
     
     # Filter items that don't have response and extracted_answer keys (for resuming)
     items_to_process = []
+    items_to_continue = []
     for i, item in enumerate(items):
         if "response" not in item or "extracted_answer" not in item:
             items_to_process.append((i, item))
+        elif continue_truncated_responses and is_truncated(item, max_tokens, tokenizer):
+            items_to_continue.append((i, item))
     
-    print(f"Found {len(items_to_process)} items that need processing")
+    logger.info(f"Found {len(items_to_process)} items that need processing")
+    if continue_truncated_responses:
+        logger.info(f"Found {len(items_to_continue)} truncated items from a previous run to continue")
+    pending_recovery_count = sum(1 for item in items if needs_recovery(item)) if recover else 0
+    if pending_recovery_count:
+        logger.info(f"Found {pending_recovery_count} unextractable items from a previous run to recover")
     
-    if not items_to_process:
-        print("All items already processed. Exiting.")
+    if not items_to_process and not items_to_continue and not pending_recovery_count:
+        logger.info("All items already processed. Exiting.")
+        preemption.finish()
         return
     
-    # Initialize LLM and tokenizer
-    llm = init_llm(model_path, gpu_per_node)
-    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if max_total_tokens is None:
+        max_total_tokens = 2 * max_tokens
+    
+    # Initialize LLM
+    # A replay run serves recorded outputs and never loads the model
+    llm = open_llm(lambda: init_llm(model_path, gpu_per_node), "response_generation",
+                   record_dir, replay_dir, replay_latency, logger)
     
     # Create sampling parameters
     sampling_params = SamplingParams(
@@ -114,67 +366,63 @@ def process_benchmarks(model_path, gpu_per_node, input_file, output_file,
         max_tokens=max_tokens
     )
     
-    # Split into 10 sections
-    num_sections = 10
-    section_size = math.ceil(len(items_to_process) / num_sections)
-    
-    for section_idx in range(num_sections):
-        start_idx = section_idx * section_size
-        end_idx = min((section_idx + 1) * section_size, len(items_to_process))
-        
-        if start_idx >= len(items_to_process):
+    # Sections sized to take about section_seconds each, so one started before a stop signal is saved in time
+    remaining = len(items_to_process)
+    for section_idx, section_items in enumerate(preemption.sections(items_to_process)):
+        if preemption.stop_requested():
+            logger.info(f"Stopping before section {section_idx + 1} ({preemption.reason})")
             break
             
-        section_items = items_to_process[start_idx:end_idx]
-        print(f"Processing section {section_idx + 1}/{num_sections} with {len(section_items)} items")
-        
-        # Prepare prompts for this section using chat template
-        prompts = []
-        for _, item in section_items:
-            messages = [
-                {"role": "system","content":system_message},
-                {"role": "user", "content": item["question"]}
-            ]
-            text = tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True,
-                enable_thinking=enable_thinking
-            )
-            prompts.append(text)
+        logger.info(f"Processing section {section_idx + 1} with {len(section_items)} items ({remaining} left)")
+        remaining -= len(section_items)
         
+        # Prepare one prompt per instance using chat template; its trials are drawn with SamplingParams(n=...)
+        with metrics.phase("render"):
+            groups, prompts, group_params = render_groups(tokenizer, sampling_params, section_items, enable_thinking)
+        metrics.set_queue_depth(len(groups))
+        logger.info(f"Rendered {len(prompts)} prompts for {len(section_items)} trials")
+
         try:
             # Run vLLM inference for this section
-            print(f"Running vLLM inference for section {section_idx + 1}...")
-            batch_outputs = llm.generate(prompts, sampling_params)
-            
+            logger.info(f"Running vLLM inference for section {section_idx + 1}...")
+            trial_items, responses, finish_reasons = generate_trials(
+                llm, sampling_params, groups, prompts, group_params, metrics,
+                continue_truncated_responses, continuation_tokens, max_total_tokens
+            )
+
             # Process results and add to items
-            for (original_idx, item), output in zip(section_items, batch_outputs):
-                response = output.outputs[0].text.strip()
-                extracted_answer = extract_answer_content(response)
+            with metrics.phase("parse"):
+                for (original_idx, item), response, finish_reason in zip(trial_items, responses, finish_reasons):
+                    response = response.strip()
+                    extracted_answer = extract_answer_content(response)
                 
-                # Add response and extracted_answer as strings
-                item["response"] = response
-                item["extracted_answer"] = extracted_answer if extracted_answer else "[FAILED_TO_PROCESS]"
+                    # Add response and extracted_answer as strings
+                    item["response"] = response
+                    item["extracted_answer"] = extracted_answer if extracted_answer else "[FAILED_TO_PROCESS]"
+                    item["finish_reason"] = finish_reason
                 
-                # Update the original item in the items list
-                items[original_idx] = item
+                    # Update the original item in the items list
+                    items[original_idx] = item
             
-            print(f"Successfully processed section {section_idx + 1}")
+            metrics.count("items", len(trial_items))
+            logger.info(f"Successfully processed section {section_idx + 1}")
             
         except Exception as e:
-            print(f"Error processing section {section_idx + 1}: {str(e)}")
-            # For failed items in this section, mark them as failed
-            for original_idx, item in section_items:
-                if "response" not in item:
-                    item["response"] = "[FAILED_TO_PROCESS]"
-                if "extracted_answer" not in item:
-                    item["extracted_answer"] = "[FAILED_TO_PROCESS]"
-                items[original_idx] = item
+            if preemption.requested:
+                # The stop signal reached the vLLM workers too; the section is left for the resumed run
+                logger.warning(f"Section {section_idx + 1} interrupted by {preemption.reason}: {str(e)}")
+            else:
+                logger.error(f"Error processing section {section_idx + 1}: {str(e)}")
+                # For failed items in this section, mark them as failed
+                for original_idx, item in section_items:
+                    if "response" not in item:
+                        item["response"] = "[FAILED_TO_PROCESS]"
+                    if "extracted_answer" not in item:
+                        item["extracted_answer"] = "[FAILED_TO_PROCESS]"
+                    items[original_idx] = item
         
         # Save progress after each section with timing
-        save_start_time = time.time()
-        print(f"Starting to save progress after section {section_idx + 1}...")
+        logger.info(f"Starting to save progress after section {section_idx + 1}...")
         
         # Save progress after each section
         if start_index is not None or end_index is not None:
@@ -185,24 +433,82 @@ def process_benchmarks(model_path, gpu_per_node, input_file, output_file,
             items_to_save = items
         
         # Log file info (avoid expensive size calculation)
-        print(f"Preparing to save {len(items_to_save)} items to {output_file}...")
+        logger.info(f"Preparing to save {len(items_to_save)} items to {output_file}...")
         
         # Write with reduced indentation to save space and time
-        with open(output_file, "w") as f:
-            json.dump(items_to_save, f, indent=2, ensure_ascii=False)
+        with metrics.phase("save"):
+            save_items(items_to_save, output_file, indent=2)
         
-        save_end_time = time.time()
-        save_duration = save_end_time - save_start_time
+        save_duration = metrics.last_duration("save")
         completed_count = sum(1 for item in items_to_save if "response" in item and "extracted_answer" in item)
-        print(f"Saved {len(items_to_save)} total items ({completed_count} completed) to {output_file} (section {section_idx + 1} completed)")
-        print(f"Save operation took {save_duration:.2f} seconds")
+        logger.info(f"Saved {len(items_to_save)} total items ({completed_count} completed) to {output_file} (section {section_idx + 1} completed)")
+        logger.info(f"Save operation took {save_duration:.2f} seconds")
         
         # Log the number of items processed so far
         processed_count = sum(1 for item in items if "response" in item and "extracted_answer" in item)
-        print(f"Total items processed so far: {processed_count}/{len(items)}")
+        logger.info(f"Total items processed so far: {processed_count}/{len(items)}")
+        metrics.export()
+    
+    # Everything completed is saved; continuation and recovery are picked up by the resumed run
+    if preemption.requested:
+        preemption.stop(sum(1 for item in items if "response" not in item or "extracted_answer" not in item))
+        metrics.log_summary()
+        metrics.export()
+        return
+    
+    # Continue responses that a previous run stored truncated
+    if items_to_continue:
+        prompts = [render_prompt(tokenizer, item["question"], enable_thinking) for _, item in items_to_continue]
+        responses = [item["response"] for _, item in items_to_continue]
+        with metrics.phase("tokenize"):
+            response_tokens = [len(tokenizer.encode(response, add_special_tokens=False)) for response in responses]
+            prompt_tokens = [len(tokenizer.encode(prompt, add_special_tokens=False)) for prompt in prompts]
+        
+        try:
+            with metrics.phase("generate"):
+                extended, _, finish_reasons = continue_truncated(
+                    llm, sampling_params, prompts, responses, response_tokens,
+                    continuation_tokens, max_total_tokens, prompt_tokens
+                )
+            recovered_count = 0
+            for (original_idx, item), response, finish_reason in zip(items_to_continue, extended, finish_reasons):
+                response = response.strip()
+                extracted_answer = extract_answer_content(response)
+                item["response"] = response
+                item["extracted_answer"] = extracted_answer if extracted_answer else "[FAILED_TO_PROCESS]"
+                item["finish_reason"] = finish_reason
+                items[original_idx] = item
+                if extracted_answer:
+                    recovered_count += 1
+            logger.info(f"Continued {len(items_to_continue)} truncated items, {recovered_count} now have an answer")
+        except Exception as e:
+            logger.error(f"Error continuing truncated items: {str(e)}")
+        
+        with metrics.phase("save"):
+            save_items(items, output_file, indent=2)
+        logger.info(f"Saved {len(items)} total items to {output_file} (continuation completed)")
+    
+    # Ask for the final answer of responses no extraction works on, instead of regenerating them
+    if recover:
+        items_to_recover = [(i, item) for i, item in enumerate(items) if needs_recovery(item)]
+        if items_to_recover:
+            logger.info(f"Asking for the final answer of {len(items_to_recover)} unextractable responses")
+            try:
+                recovered_count = recover_answers(llm, sampling_params, tokenizer, items_to_recover, recovery_tokens,
+                                                  enable_thinking, metrics)
+                logger.info(f"Recovered an answer for {recovered_count}/{len(items_to_recover)} items")
+            except Exception as e:
+                logger.error(f"Error recovering answers: {str(e)}")
+            
+            with metrics.phase("save"):
+                save_items(items, output_file, indent=2)
+            logger.info(f"Saved {len(items)} total items to {output_file} (answer recovery completed)")
     
     # Final save is redundant now since we save after each section
-    print(f"Successfully processed {len(items_to_process)} items and saved to {output_file}")
+    preemption.finish()
+    logger.info(f"Successfully processed {len(items_to_process)} items and saved to {output_file}")
+    metrics.log_summary()
+    metrics.export()
 
 
 if __name__ == "__main__":
@@ -219,9 +525,30 @@ if __name__ == "__main__":
     parser.add_argument("--enable_thinking", action="store_true", help="Enable thinking mode in chat template.")
     parser.add_argument("--start_index", type=int, help="Start index for data slicing.")
     parser.add_argument("--end_index", type=int, help="End index for data slicing.")
+    parser.add_argument("--num_samples", type=int, help="Samples per instance when the input has one row per instance (expanded to idx/trial_k).")
+    parser.add_argument("--continue_truncated", action="store_true", help="Continue responses that hit max_tokens before </answer> instead of marking them failed.")
+    parser.add_argument("--continuation_tokens", type=int, default=4096, help="Maximum tokens generated per continuation round.")
+    parser.add_argument("--max_total_tokens", type=int, help="Cap on total response tokens across continuations (default: 2 * max_tokens); each continuation also stops at the context length.")
+    parser.add_argument("--recover_answers", action="store_true", help="Ask once more, with a short follow-up prompt, for the final answer of responses no extraction works on.")
+    parser.add_argument("--recovery_tokens", type=int, default=64, help="Maximum tokens of an answer-recovery follow-up.")
+    parser.add_argument("--requeue", action="store_true", help="After a stop on SIGTERM/SIGUSR1 or the walltime, requeue the SLURM job with scontrol (needs #SBATCH --requeue).")
+    parser.add_argument("--walltime_margin", type=float, default=300.0, help="Do not start a section unless it is expected to finish this many seconds before the job's end time.")
+    parser.add_argument("--section_seconds", type=float, default=600.0, help="Target seconds per section (sized from the measured throughput); keep it below the USR1 lead time of the SLURM script.")
+    parser.add_argument("--metrics_file", type=str, help="Write phase timings, throughput and latency metrics here (.json, or .prom for a Prometheus textfile).")
+    parser.add_argument("--log_level", type=str, help="Logging level (DEBUG, INFO, WARNING, ERROR; default: $LOG_LEVEL, else INFO).")
+    parser.add_argument("--record_dir", type=str, help="Record every generate() request with its outputs into this directory.")
+    parser.add_argument("--replay_dir", type=str, help="Serve outputs recorded with --record_dir instead of loading the model.")
+    parser.add_argument("--replay_latency", type=float, default=0.0, help="Scale of recorded latencies simulated in replay (0 = memory speed, 1 = as recorded).")
     
     args = parser.parse_args()
+    if args.log_level:
+        logger.setLevel(args.log_level.upper())
     
     process_benchmarks(args.model_path, args.gpu_per_node, args.input_file, args.output_file,
                       args.temperature, args.top_p, args.top_k, args.min_p, args.max_tokens, args.enable_thinking,
-                      args.start_index, args.end_index)
+                      args.start_index, args.end_index,
+                      args.continue_truncated, args.continuation_tokens, args.max_total_tokens,
+                      args.num_samples, args.metrics_file,
+                      args.record_dir, args.replay_dir, args.replay_latency,
+                      args.recover_answers, args.recovery_tokens, args.requeue, args.walltime_margin,
+                      args.section_seconds)
@@ -25,6 +25,8 @@ for i in "${selected_indices[@]}"; do
 #SBATCH --gpus-per-node=2
 #SBATCH --cpus-per-task=80
 #SBATCH --time=24:00:00
+#SBATCH --signal=B:USR1@900
+#SBATCH --requeue
 #SBATCH --gres=gpu:2
 #SBATCH --mem=1024G
 #SBATCH --account=ram
@@ -35,7 +37,7 @@ export NCCL_P2P_DISABLE=1
 export VLLM_DISABLE_COMPILE_CACHE=1
 export VLLM_USE_V1=1
 
-python3 response_generation_qwen.py \\
+exec python3 response_generation_qwen.py \\
     --model_path /datasets/pretrained-llms/Qwen3-14B \\
     --gpu_per_node 2 \\
     --input_file "./benchmarks.json" \\
@@ -47,7 +49,8 @@ python3 response_generation_qwen.py \\
     --top_k 20 \\
     --min_p 0 \\
     --max_tokens 32768 \\
-    --enable_thinking
+    --enable_thinking \\
+    --requeue
 EOF
 
     echo "Submitted job $i with start_index=${start_index} and end_index=${end_index}"
@@ -0,0 +1,262 @@
+"""
+In-process reward function for RL rollouts.
+
+    from reward_api import LocalJudge, RewardVerifier
+    verifier = RewardVerifier(LocalJudge(llm, tokenizer, sampling_params))
+    batch = verifier.verify_batch(questions, references, rollouts, timeout=30)
+    rewards = batch.rewards()          # never waits past the deadline
+
+Each rollout goes through answer extraction (extract_answer_content, then boxed/"Final Answer"),
+cheap rule-based checks, and only then the LLM judge. Identical (question, reference, extracted
+answer) triples in a batch share one judgment, so a group of rollouts that converged on the
+same answer costs a single judge call. The judge batches requests from all concurrent
+verify_batch calls. Results not ready at the deadline get default_reward, are reported as
+"timeout", and their queued judge requests are dropped.
+"""
+import collections
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from response_generation_qwen import extract_answer_content
+from group_with_extract import extract_solution_fast_accurate
+from qwen_eval import DETAILED_ZERO_SHOT, extract_judgment
+
+NUMBER_PATTERN = re.compile(r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+CHOICE_PATTERN = re.compile(r"^\(?([A-J])\)?\.?$")
+
+
+def normalize_answer(text):
+    text = text.strip().strip("$").strip()
+    text = re.sub(r"\\text\{\s*([^{}]*)\}", r"\1", text)
+    text = re.sub(r"\\(?:,|;|!|quad|qquad)", " ", text)
+    return " ".join(text.split()).rstrip(".")
+
+def significant_equal(a, b, digits=6):
+    """Equal to `digits` significant digits, as the judge templates require."""
+    if a == b:
+        return True
+    if a == 0 or b == 0:
+        return False
+    return float(f"{a:.{digits - 1}e}") == float(f"{b:.{digits - 1}e}")
+
+def rule_check(reference, candidate):
+    """True/False when a cheap rule settles equivalence, None when the LLM judge is needed."""
+    reference = normalize_answer(reference)
+    candidate = normalize_answer(candidate)
+    if not candidate:
+        return False
+    if reference == candidate:
+        return True
+    # Bare numbers without units are compared at 6 significant digits
+    if NUMBER_PATTERN.match(reference) and NUMBER_PATTERN.match(candidate):
+        return significant_equal(float(reference), float(candidate))
+    # Single-letter multiple-choice answers
+    reference_choice = CHOICE_PATTERN.match(reference)
+    candidate_choice = CHOICE_PATTERN.match(candidate)
+    if reference_choice and candidate_choice:
+        return reference_choice.group(1) == candidate_choice.group(1)
+    return None
+
+def extract_candidate(response):
+    extracted = extract_answer_content(response)
+    if not extracted:
+        extracted = extract_solution_fast_accurate(response)
+    return extracted.strip() if extracted else None
+
+def judge_content(template, question, reference, candidate):
+    if type(reference) == list:
+        reference = " ".join(reference)
+    return template.replace("[HERE_IS_THE_QUESTION]", question).replace("[HERE_IS_THE_GROUND_TRUTH]", reference).replace("[HERE_IS_THE_CANDIDATE]", candidate)
+
+
+class LocalJudge:
+    """
+    Dynamic batching over an in-process vLLM LLM: a worker thread collects requests for up to
+    max_wait seconds or max_batch_size requests and runs them in one generate() call.
+    """
+
+    def __init__(self, llm, tokenizer, sampling_params, template=DETAILED_ZERO_SHOT, max_batch_size=256, max_wait=0.02):
+        self.llm = llm
+        self.tokenizer = tokenizer
+        self.sampling_params = sampling_params
+        self.template = template
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, question, reference, candidate):
+        """Future resolving to (judgment, is_correct)."""
+        future = Future()
+        self.requests.put((future, judge_content(self.template, question, reference, candidate)))
+        return future
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Requests the caller already gave up on (deadline passed) are dropped here
+        return [(future, content) for future, content in batch if future.set_running_or_notify_cancel()]
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                continue
+            prompts = [
+                self.tokenizer.apply_chat_template([{"role": "user", "content": content}], tokenize=False, add_generation_prompt=True)
+                for _, content in batch
+            ]
+            try:
+                outputs = self.llm.generate(prompts, self.sampling_params, use_tqdm=False)
+                for (future, _), output in zip(batch, outputs):
+                    future.set_result(extract_judgment(output.outputs[0].text.strip()))
+            except Exception as e:
+                for future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+class ServerJudge:
+    """Judge through a running judge_server.py, which does the batching itself."""
+
+    def __init__(self, address, template="detailed_zero_shot", priority="high", max_workers=64, timeout=600):
+        from judge_server import JudgeClient
+        self.client = JudgeClient(address, timeout)
+        self.template = template
+        self.priority = priority
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def verify_one(self, question, reference, candidate):
+        result = self.client.verify([{
+            "question": question, "reference": reference, "candidate": candidate,
+            "template": self.template, "priority": self.priority,
+        }])[0]
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result["judgment"], result["is_correct"]
+
+    def submit(self, question, reference, candidate):
+        return self.executor.submit(self.verify_one, question, reference, candidate)
+
+
+class RewardBatch:
+    def __init__(self, futures, deadline, default_reward, judge_futures=None):
+        self.futures = futures
+        self.deadline = deadline
+        self.default_reward = default_reward
+        # The judge future behind each rollout (None if settled without the judge), and how many
+        # rollouts still wait on each one
+        self.judge_futures = judge_futures or [None] * len(futures)
+        self.dependents = collections.Counter(judge for judge in self.judge_futures if judge is not None)
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def results(self, timeout=None):
+        """
+        One dict per rollout: reward, source (extract_failed / rule / judge / timeout / error),
+        extracted answer and judgment. Waits until the deadline (or timeout) at most.
+        """
+        if timeout is None and self.deadline is not None:
+            timeout = max(0.0, self.deadline - time.monotonic())
+        wait(set(self.futures), timeout=timeout)
+        results = []
+        for future, judge_future in zip(self.futures, self.judge_futures):
+            if not future.done():
+                future.cancel()
+                self.release(judge_future)
+                results.append({"reward": self.default_reward, "source": "timeout"})
+            elif future.cancelled():
+                results.append({"reward": self.default_reward, "source": "timeout"})
+            elif future.exception() is not None:
+                results.append({"reward": self.default_reward, "source": "error", "error": str(future.exception())})
+            else:
+                results.append(future.result())
+        return results
+
+    def release(self, judge_future):
+        """A rollout timed out; once none wait on its judge future, cancel it so the judge drops the request."""
+        if judge_future is None:
+            return
+        self.dependents[judge_future] -= 1
+        if self.dependents[judge_future] == 0:
+            judge_future.cancel()
+
+    def rewards(self, timeout=None):
+        return [result["reward"] for result in self.results(timeout)]
+
+
+class RewardVerifier:
+    def __init__(self, judge=None, default_reward=0.0):
+        self.judge = judge
+        self.default_reward = default_reward
+        self.judged = 0
+        self.deduplicated = 0
+        self.rule_settled = 0
+
+    def verify_batch(self, questions, references, candidates, timeout=None):
+        """
+        Start verifying len(candidates) rollouts (questions/references are per rollout) and return
+        a RewardBatch at once; its futures resolve as extraction, rules and the judge finish.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        futures = []
+        judge_futures = []
+        judged = {}
+        for question, reference, response in zip(questions, references, candidates):
+            extracted = extract_candidate(response)
+            future = Future()
+            if extracted is None:
+                future.set_result({"reward": 0.0, "source": "extract_failed", "extracted": None})
+                futures.append(future)
+                judge_futures.append(None)
+                continue
+
+            verdict = rule_check(reference if type(reference) != list else " ".join(reference), extracted)
+            if verdict is not None or self.judge is None:
+                self.rule_settled += verdict is not None
+                future.set_result({"reward": float(bool(verdict)), "source": "rule" if verdict is not None else "no_judge",
+                                   "extracted": extracted})
+                futures.append(future)
+                judge_futures.append(None)
+                continue
+
+            key = (question, str(reference), extracted)
+            if key in judged:
+                self.deduplicated += 1
+            else:
+                judged[key] = self.judge.submit(question, reference, extracted)
+                self.judged += 1
+            futures.append(self.chain(judged[key], extracted))
+            judge_futures.append(judged[key])
+        return RewardBatch(futures, deadline, self.default_reward, judge_futures)
+
+    @staticmethod
+    def chain(judge_future, extracted):
+        """Per-rollout future mapped from a (possibly shared) judge future."""
+        future = Future()
+
+        def resolve(done):
+            if future.done():
+                return
+            if done.cancelled():
+                future.cancel()
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                judgment, is_correct = done.result()
+                future.set_result({"reward": float(is_correct), "source": "judge", "extracted": extracted, "judgment": judgment})
+
+        judge_future.add_done_callback(resolve)
+        return future
@@ -0,0 +1,243 @@
+"""
+Sequential estimation: judge random samples until every accuracy is pinned to a target width.
+
+Items are stratified by (benchmark, category); items whose answer could not be extracted form a
+stratum of their own, which is known exactly without judging. The judge drivers take their
+sections from SequentialEstimator.rounds instead of splitting all pending items: each round
+draws up to round_size pending items, split evenly across the groups (benchmarks, or strata
+with level="stratum") whose interval is still wider than the target. Within a benchmark the
+draw is a proportional stratified sample, after at least min_per_stratum items of every
+stratum. Verdicts are read back from the items when the next round is requested, so the
+drivers' section loops and per-section saves are unchanged.
+
+Stratum intervals are Wilson score intervals with a finite population correction (a stratum
+judged in full has zero width). A benchmark's accuracy is the population-weighted mean of its
+strata, with the interval from the summed stratum variances. Trials of the same question are
+treated as independent draws, so intervals are somewhat narrow when trials agree.
+
+Items judged by an earlier run on the same output file count as samples, so a stopped run
+resumes where it left off.
+"""
+import json
+import math
+import random
+from statistics import NormalDist
+
+FAILED_STRATUM = "[FAILED_TO_PROCESS]"
+
+
+def z_value(confidence):
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+def finite_population_correction(n, population):
+    if population <= 1:
+        return 0.0
+    return max(0.0, (population - n) / (population - 1))
+
+def wilson_interval(correct, n, confidence=0.95, population=None):
+    """Wilson score interval for correct/n, narrowed by the finite population correction."""
+    if n == 0:
+        return 0.0, 1.0
+    p = correct / n
+    fpc = finite_population_correction(n, population) if population else 1.0
+    if fpc == 0:
+        return p, p
+    z = z_value(confidence)
+    n_eff = n / fpc
+    center = (p + z * z / (2 * n_eff)) / (1 + z * z / n_eff)
+    margin = z / (1 + z * z / n_eff) * math.sqrt(p * (1 - p) / n_eff + z * z / (4 * n_eff * n_eff))
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+def verdict_of(item):
+    """True/False once judged, None while unjudged or when judging failed."""
+    if "is_it_correct" not in item or item.get("judgment") == "[FAILED_TO_PROCESS]":
+        return None
+    return bool(item["is_it_correct"])
+
+def stratum_of(item, benchmark_of):
+    if item.get("extracted_answer") == "[FAILED_TO_PROCESS]":
+        return benchmark_of(item), FAILED_STRATUM
+    return benchmark_of(item), item.get("category") or ""
+
+
+class Stratum:
+    def __init__(self):
+        self.population = 0
+        self.judged = 0
+        self.correct = 0
+
+    def interval(self, confidence):
+        return wilson_interval(self.correct, self.judged, confidence, self.population)
+
+    def variance(self, z):
+        """Variance of the stratum accuracy (Agresti-Coull adjusted, finite population corrected)."""
+        p = (self.correct + z * z / 2) / (self.judged + z * z)
+        return p * (1 - p) / (self.judged + z * z) * finite_population_correction(self.judged, self.population)
+
+    def summary(self, confidence):
+        low, high = self.interval(confidence)
+        return {
+            "estimate": round(self.correct / self.judged, 6) if self.judged else None,
+            "low": round(low, 6),
+            "high": round(high, 6),
+            "judged": self.judged,
+            "total": self.population,
+        }
+
+
+class SequentialEstimator:
+    def __init__(self, items, benchmark_of, target_half_width=0.01, confidence=0.95, level="benchmark",
+                 round_size=512, min_per_stratum=10, seed=0, logger=None):
+        self.items = items
+        self.benchmark_of = benchmark_of
+        self.target_half_width = target_half_width
+        self.confidence = confidence
+        self.z = z_value(confidence)
+        self.level = level
+        self.round_size = round_size
+        self.min_per_stratum = min_per_stratum
+        self.seed = seed
+        self.logger = logger
+        self.strata = {}
+        self.counted = set()
+        for i, item in enumerate(items):
+            self.stratum(item).population += 1
+            self.observe(i, item)
+
+    def stratum(self, item):
+        key = stratum_of(item, self.benchmark_of)
+        if key not in self.strata:
+            self.strata[key] = Stratum()
+        return self.strata[key]
+
+    def observe(self, i, item):
+        verdict = verdict_of(item)
+        if verdict is None or i in self.counted:
+            return
+        self.counted.add(i)
+        stratum = self.stratum(item)
+        stratum.judged += 1
+        stratum.correct += verdict
+
+    def group_of(self, key):
+        return key[0] if self.level == "benchmark" else key
+
+    def groups(self):
+        groups = {}
+        for key, stratum in self.strata.items():
+            groups.setdefault(self.group_of(key), []).append(stratum)
+        return groups
+
+    def benchmark_estimate(self, strata):
+        """(estimate, half width) of the population-weighted mean over strata."""
+        population = sum(stratum.population for stratum in strata)
+        estimate, variance = 0.0, 0.0
+        for stratum in strata:
+            weight = stratum.population / population
+            p = stratum.correct / stratum.judged if stratum.judged else 0.5
+            estimate += weight * p
+            variance += weight * weight * (stratum.variance(self.z) if stratum.judged else 0.25)
+        return estimate, self.z * math.sqrt(variance)
+
+    def done(self, group, strata):
+        if any(stratum.judged < min(self.min_per_stratum, stratum.population) for stratum in strata):
+            return False
+        if self.level == "benchmark":
+            return self.benchmark_estimate(strata)[1] <= self.target_half_width
+        low, high = strata[0].interval(self.confidence)
+        return (high - low) / 2 <= self.target_half_width
+
+    def open_groups(self):
+        return {group for group, strata in self.groups().items() if not self.done(group, strata)}
+
+    def max_rounds(self, items_to_process):
+        return math.ceil(len(items_to_process) / self.round_size)
+
+    def draw_order(self, items_to_process):
+        """Pending items per group, ordered so every prefix is a proportional stratified sample."""
+        rng = random.Random(self.seed)
+        pending = {}
+        for i, item in items_to_process:
+            pending.setdefault(stratum_of(item, self.benchmark_of), []).append((i, item))
+        queues = {}
+        for key in sorted(pending):
+            members = pending[key]
+            rng.shuffle(members)
+            stratum = self.strata[key]
+            needed = max(0, min(self.min_per_stratum, stratum.population) - stratum.judged)
+            for j, pair in enumerate(members):
+                # Minimum samples of every stratum first, then systematic proportional allocation
+                priority = (j + 0.5) / len(members) - (1 if j < needed else 0)
+                queues.setdefault(self.group_of(key), []).append((priority, pair))
+        return {group: [pair for _, pair in sorted(queue, key=lambda entry: entry[0])] for group, queue in queues.items()}
+
+    def rounds(self, items_to_process):
+        """Yield the sections to judge; verdicts of a section are read when the next is requested."""
+        queues = self.draw_order(items_to_process)
+        positions = {group: 0 for group in queues}
+        while True:
+            open_groups = [group for group in self.open_groups()
+                           if group in queues and positions[group] < len(queues[group])]
+            if not open_groups:
+                break
+            share = max(1, self.round_size // len(open_groups))
+            section = []
+            for group in sorted(open_groups, key=str):
+                section.extend(queues[group][positions[group]:positions[group] + share])
+                positions[group] += share
+            yield section
+            for i, item in section:
+                self.observe(i, item)
+            self.log_progress()
+
+    def report(self):
+        benchmarks = {}
+        by_benchmark = {}
+        for (benchmark, category), stratum in self.strata.items():
+            by_benchmark.setdefault(benchmark, {})[category] = stratum
+        for benchmark, strata in sorted(by_benchmark.items()):
+            estimate, half_width = self.benchmark_estimate(list(strata.values()))
+            judged = sum(stratum.judged for stratum in strata.values())
+            population = sum(stratum.population for stratum in strata.values())
+            benchmarks[benchmark] = {
+                "estimate": round(estimate, 6),
+                "low": round(max(0.0, estimate - half_width), 6),
+                "high": round(min(1.0, estimate + half_width), 6),
+                "half_width": round(half_width, 6),
+                "judged": judged,
+                "total": population,
+                "fraction_judged": round(judged / population, 4) if population else None,
+                "strata": {category: stratum.summary(self.confidence) for category, stratum in sorted(strata.items())},
+            }
+        judged = sum(stratum.judged for stratum in self.strata.values())
+        total = sum(stratum.population for stratum in self.strata.values())
+        return {
+            "confidence": self.confidence,
+            "target_half_width": self.target_half_width,
+            "level": self.level,
+            "judged": judged,
+            "total": total,
+            "fraction_judged": round(judged / total, 4) if total else None,
+            "benchmarks": benchmarks,
+        }
+
+    def log_progress(self):
+        if self.logger:
+            report = self.report()
+            open_groups = self.open_groups()
+            self.logger.info(f"Sequential estimation: {report['judged']}/{report['total']} judged, "
+                             f"{len(open_groups)} of {len(self.groups())} {self.level} intervals still wider than ±{self.target_half_width}")
+
+    def log_report(self):
+        if not self.logger:
+            return
+        report = self.report()
+        self.logger.info(f"Benchmark accuracy estimates ({self.confidence:.0%} intervals):")
+        for benchmark, result in report["benchmarks"].items():
+            self.logger.info(f"{benchmark}: {result['estimate']:.4f} [{result['low']:.4f}, {result['high']:.4f}] "
+                             f"from {result['judged']}/{result['total']} items ({result['fraction_judged']:.1%} judged)")
+        self.logger.info(f"Judged {report['judged']}/{report['total']} items ({report['fraction_judged']:.1%})")
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
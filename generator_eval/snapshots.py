@@ -0,0 +1,54 @@
+"""
+Local snapshots of hub datasets, shared by the benchmark builders here and in verifier_meta_eval.
+
+A split lives under <snapshot_dir>/<hub name with / as __>/<split>, either as <split>.jsonl or
+as an Arrow directory written by save_to_disk. Its fingerprint keys the builders' caches.
+"""
+import hashlib
+import json
+import os
+
+
+def snapshot_path(snapshot_dir, hub_name, split):
+    return os.path.join(snapshot_dir, hub_name.replace("/", "__"), split)
+
+def load_split(snapshot_dir, hub_name, split, offline):
+    """
+    Load a split from its local snapshot: a JSONL file (<split>.jsonl) or an Arrow directory
+    written by save_to_disk, which is memory-mapped. Without --offline a missing snapshot is
+    downloaded once and saved, so later builds don't touch the network.
+    """
+    path = snapshot_path(snapshot_dir, hub_name, split)
+    if os.path.exists(path + ".jsonl"):
+        with open(path + ".jsonl", "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    from datasets import load_dataset, load_from_disk
+    if os.path.isdir(path):
+        return load_from_disk(path)
+    if offline:
+        raise FileNotFoundError(f"No local snapshot for {hub_name} [{split}] at {path}(.jsonl)")
+
+    print(f"Downloading {hub_name} [{split}] into snapshot {path}")
+    dataset = load_dataset(hub_name, split=split)
+    dataset.save_to_disk(path)
+    return load_from_disk(path)
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def split_fingerprint(snapshot_dir, hub_name, split):
+    """Content fingerprint of a split snapshot, or None if it has not been snapshotted yet."""
+    path = snapshot_path(snapshot_dir, hub_name, split)
+    if os.path.exists(path + ".jsonl"):
+        return file_digest(path + ".jsonl")
+    state_file = os.path.join(path, "state.json")
+    if os.path.exists(state_file):
+        # save_to_disk records a content-derived fingerprint of the Arrow data
+        with open(state_file, "r") as f:
+            return json.load(f)["_fingerprint"]
+    return None
@@ -0,0 +1,263 @@
+"""
+Normalized on-disk layout for benchmarks and results.
+
+An instance table (<name>.instances.jsonl) stores each question once, one row per line, and the
+row number is the instance id. A trial table (<name>.trials.jsonl) starts with a header line
+pointing at its instance table, followed by one row per trial holding only the per-trial fields
+(response, extracted_answer, judgment, ...) plus the integer instance_id and trial (null for
+rows of one-row-per-instance input, whose idx has no /trial_ suffix either). Generation,
+judging and stats all write trial tables against the same instance table, so question/answer
+text is never repeated.
+
+load_items/save_items handle both this layout and the plain JSON list files, so drivers work
+unchanged on either. Any of these files may carry a .zst or .gz suffix and is then compressed
+and decompressed as a stream; the level for writing comes from the level argument, then
+$STORAGE_COMPRESSION_LEVEL, then DEFAULT_LEVELS.
+"""
+import gzip
+import io
+import json
+import os
+from collections.abc import MutableMapping
+
+INSTANCE_FIELDS = ("benchmark", "question", "answer", "answer_type", "category")
+
+# zstd 3 is about as fast as writing uncompressed to shared storage; gzip is the fallback
+DEFAULT_LEVELS = {".zst": 3, ".gz": 6}
+
+_instance_tables = {}
+
+
+def compression_of(path):
+    """".zst", ".gz" or None, from the path suffix."""
+    for suffix in DEFAULT_LEVELS:
+        if path.endswith(suffix):
+            return suffix
+    return None
+
+def strip_compression(path):
+    suffix = compression_of(path)
+    return path[:-len(suffix)] if suffix else path
+
+def compression_level(compression, level=None):
+    if level is None:
+        level = os.environ.get("STORAGE_COMPRESSION_LEVEL")
+    return int(level) if level is not None else DEFAULT_LEVELS[compression]
+
+def open_file(path, mode="r", level=None, compression=None):
+    """
+    Open a text file for streaming reads or writes, (de)compressing .zst and .gz files on the fly.
+    compression overrides the suffix, e.g. for the temporary file of an atomic write.
+    """
+    compression = compression or compression_of(path)
+    if compression is None:
+        return open(path, mode)
+    if compression == ".gz":
+        return gzip.open(path, mode + "t", compresslevel=compression_level(compression, level), encoding="utf-8")
+    import zstandard
+    raw = open(path, mode + "b")
+    if mode[0] in "wa":
+        stream = zstandard.ZstdCompressor(level=compression_level(compression, level), threads=-1).stream_writer(raw, closefd=True)
+    else:
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+def is_normalized(path):
+    return strip_compression(path).endswith(".trials.jsonl")
+
+def is_items_file(path):
+    """A plain JSON list or trial table, possibly compressed."""
+    return strip_compression(path).endswith(".json") or is_normalized(path)
+
+def load_instance_table(path):
+    """Load an instance table once per process; trial tables referencing it share the rows."""
+    path = os.path.abspath(path)
+    if path not in _instance_tables:
+        with open_file(path, "r") as f:
+            _instance_tables[path] = [json.loads(line) for line in f if line.strip()]
+    return _instance_tables[path]
+
+def format_idx(instance, trial):
+    """idx of a row, Benchmark/instance_N/trial_M, without the /trial_ suffix when trial is None."""
+    if trial is None:
+        return f"{instance['benchmark']}/instance_{instance['instance']}"
+    return f"{instance['benchmark']}/instance_{instance['instance']}/trial_{trial}"
+
+
+class TrialRecord(MutableMapping):
+    """A trial row joined lazily with its instance row; idx is only formatted when asked for."""
+
+    __slots__ = ("instances_path", "instance_id", "trial", "fields", "_instances")
+
+    def __init__(self, instances_path, instances, instance_id, trial, fields):
+        self.instances_path = instances_path
+        self._instances = instances
+        self.instance_id = instance_id
+        self.trial = trial
+        self.fields = fields
+
+    @property
+    def instance(self):
+        return self._instances[self.instance_id]
+
+    @property
+    def idx(self):
+        return format_idx(self.instance, self.trial)
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return self.fields[key]
+        if key in INSTANCE_FIELDS and key in self.instance:
+            return self.instance[key]
+        if key == "idx":
+            return self.idx
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "idx":
+            raise KeyError("idx is derived from instance_id and trial")
+        self.fields[key] = value
+
+    def __delitem__(self, key):
+        del self.fields[key]
+
+    def __contains__(self, key):
+        return key in self.fields or (key in INSTANCE_FIELDS and key in self.instance) or key == "idx"
+
+    def __iter__(self):
+        # benchmark is derived from idx in the plain layout, so like idx it is not a stored field
+        yield "idx"
+        instance = self.instance
+        for key in INSTANCE_FIELDS[1:]:
+            if key in instance and key not in self.fields:
+                yield key
+        yield from self.fields
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def load_trial_table(path):
+    with open_file(path, "r") as f:
+        header = json.loads(f.readline())
+        instances_path = os.path.normpath(os.path.join(os.path.dirname(path), header["instances"]))
+        instances = load_instance_table(instances_path)
+        items = []
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            instance_id = row.pop("instance_id")
+            trial = row.pop("trial")
+            items.append(TrialRecord(instances_path, instances, instance_id, trial, row))
+    return items
+
+def load_items(path):
+    """Load a list of items from a plain JSON file or a normalized trial table."""
+    if is_normalized(path):
+        return load_trial_table(path)
+    with open_file(path, "r") as f:
+        return json.load(f)
+
+def parse_idx(idx):
+    """Split "Benchmark/instance_N[/trial_M]" into (benchmark, N, M or None)."""
+    parts = idx.split("/")
+    trial = int(parts[2][len("trial_"):]) if len(parts) > 2 else None
+    return parts[0], int(parts[1][len("instance_"):]), trial
+
+def build_instance_table(items):
+    """Deduplicate plain items into instance rows; returns (instances, [(instance_id, trial, fields)])."""
+    instances = []
+    instance_ids = {}
+    rows = []
+    for item in items:
+        benchmark, instance_num, trial = parse_idx(item["idx"])
+        # RealMath numbers instances per split, so the question is part of the key
+        key = (benchmark, instance_num, item["question"])
+        if key not in instance_ids:
+            instance_ids[key] = len(instances)
+            instance = {"benchmark": benchmark, "instance": instance_num}
+            for field in INSTANCE_FIELDS[1:]:
+                if field in item:
+                    instance[field] = item[field]
+            instances.append(instance)
+        fields = {k: v for k, v in item.items() if k != "idx" and k not in INSTANCE_FIELDS}
+        # Instance rows keep trial None, so their idx still reads as unexpanded
+        rows.append((instance_ids[key], trial, fields))
+    return instances, rows
+
+def write_atomic(path, write, level=None):
+    tmp_path = path + ".tmp"
+    with open_file(tmp_path, "w", level, compression_of(path)) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def save_instance_table(instances, path, level=None):
+    def write(f):
+        for instance in instances:
+            f.write(json.dumps(instance, ensure_ascii=False) + "\n")
+    write_atomic(path, write, level)
+    _instance_tables[os.path.abspath(path)] = instances
+
+def save_trial_table(items, path, level=None):
+    items = list(items)
+    if items and all(isinstance(item, TrialRecord) for item in items):
+        instances_path = items[0].instances_path
+        rows = [(item.instance_id, item.trial, item.fields) for item in items]
+    else:
+        # Plain items get an instance table of their own next to the trial table
+        instances, rows = build_instance_table(items)
+        instances_path = strip_compression(path)[:-len(".trials.jsonl")] + ".instances.jsonl" + (compression_of(path) or "")
+        save_instance_table(instances, instances_path, level)
+
+    header = {"instances": os.path.relpath(os.path.abspath(instances_path), os.path.dirname(os.path.abspath(path)))}
+    def write(f):
+        f.write(json.dumps(header) + "\n")
+        for instance_id, trial, fields in rows:
+            row = {"instance_id": instance_id, "trial": trial}
+            row.update(fields)
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    write_atomic(path, write, level)
+
+def save_items(items, path, indent=2, level=None):
+    """Save items as a normalized trial table (*.trials.jsonl[.zst|.gz]) or a plain JSON list."""
+    if is_normalized(path):
+        save_trial_table(items, path, level)
+        return
+    plain_items = [dict(item) if isinstance(item, TrialRecord) else item for item in items]
+    with open_file(path, "w", level) as f:
+        json.dump(plain_items, f, indent=indent, ensure_ascii=False)
+
+def item_key(item):
+    """Resume key of an item: (instance_id, trial) for trial records, otherwise its idx string."""
+    if isinstance(item, TrialRecord):
+        return (item.instance_id, item.trial)
+    return item["idx"]
+
+def join_key(*item_lists):
+    """
+    Key for matching items across files: item_key if they are trial records of one instance table,
+    otherwise idx (instance ids of different tables are unrelated).
+    """
+    samples = [items[0] for items in item_lists if items]
+    same_layout = (all(isinstance(item, TrialRecord) for item in samples)
+                   and len({item.instances_path for item in samples}) <= 1)
+    return item_key if same_layout else (lambda item: item["idx"])
+
+def merge_completed(all_items, completed_items):
+    """Replace items in all_items with their completed versions from a previous run's output."""
+    key = join_key(all_items, completed_items)
+    completed_dict = {key(item): item for item in completed_items}
+    for i, item in enumerate(all_items):
+        completed = completed_dict.get(key(item))
+        if completed is not None:
+            all_items[i] = completed
+    return all_items
+
+def benchmark_of(item):
+    if isinstance(item, TrialRecord):
+        return item.instance["benchmark"]
+    idx = item.get("idx", "")
+    if "/" in idx:
+        return idx.split("/")[0]
+    return "unknown"
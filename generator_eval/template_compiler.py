@@ -0,0 +1,257 @@
+"""
+Compiled judge prompts: tokenize the static parts of a template once, per item only the fields.
+
+A judge template is static text around three placeholders, and every prompt is wrapped in the
+same chat (or Harmony) scaffolding. CompiledTemplate tokenizes the static segments and the
+scaffolding once; an item's prompt_token_ids are then
+
+    head + static_0 + chunk(question) + static_1 + chunk(ground truth) + static_2 + chunk(candidate) + static_3 + tail
+
+where each chunk is the field plus the whitespace around its placeholder, so no BPE merge can
+cross a chunk boundary for byte-level tokenizers like Qwen's and o200k. The scaffolding is
+the common prefix and suffix of two sentinel renders.
+
+Concatenated ids are only used if they are exactly what the slow path (fill the template,
+apply the chat template or render the Harmony conversation, tokenize) produces: the template
+is checked on a synthetic item when compiled and PromptRenderer compares the first `check`
+items of the run with the slow path. On any mismatch it logs the first differing position and
+renders everything with the slow path from then on. Items whose fields contain a placeholder
+(which the chained str.replace would substitute again) always take the slow path.
+"""
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+PLACEHOLDERS = ("[HERE_IS_THE_QUESTION]", "[HERE_IS_THE_GROUND_TRUTH]", "[HERE_IS_THE_CANDIDATE]")
+PLACEHOLDER_PATTERN = re.compile(r"(\[HERE_IS_THE_[A-Z_]+\])")
+
+# First and last tokens differ, so the common prefix/suffix of the two renders is the scaffolding
+SENTINELS = ("Alpha sentinel content one", "7 beta sentinel content 8.")
+# Synthetic item the compiled template must reproduce exactly before it is used
+PROBE_FIELDS = ("What is $1 + 1$?", "2", " 2.0\n")
+
+
+def judge_fields(item):
+    """(question, ground truth, candidate) values for the placeholders, as the drivers fill them."""
+    ground_truth = " ".join(item["answer"]) if type(item["answer"]) == list else item["answer"]
+    return item["question"], ground_truth, item["extracted_answer"]
+
+def fill_template(template, fields):
+    """The drivers' chained str.replace."""
+    question, ground_truth, candidate = fields
+    return template.replace("[HERE_IS_THE_QUESTION]", question).replace("[HERE_IS_THE_GROUND_TRUTH]", ground_truth).replace("[HERE_IS_THE_CANDIDATE]", candidate)
+
+def split_template(template):
+    """
+    Static segments around the placeholders, with the whitespace next to each placeholder moved
+    out of the static segments into (before, after) padding for the field's chunk.
+    """
+    parts = PLACEHOLDER_PATTERN.split(template)
+    statics, names = parts[0::2], parts[1::2]
+    padding = []
+    for i in range(len(names)):
+        after = statics[i + 1].lstrip()
+        after_padding = statics[i + 1][:len(statics[i + 1]) - len(after)]
+        before = statics[i].rstrip()
+        before_padding = statics[i][len(before):]
+        statics[i], statics[i + 1] = before, after
+        padding.append((before_padding, after_padding))
+    return statics, names, padding
+
+def common_affixes(a, b):
+    """Lengths of the common prefix and (non-overlapping) common suffix of two id lists."""
+    prefix = 0
+    while prefix < min(len(a), len(b)) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(len(a), len(b)) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+def first_difference(a, b):
+    for position, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return position
+    return min(len(a), len(b))
+
+
+class ChatPromptFormat:
+    """
+    HF chat template with a single user turn, tokenized the way vLLM tokenizes a text prompt
+    (qwen_eval.py).
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def render(self, content):
+        text = self.tokenizer.apply_chat_template([{"role": "user", "content": content}], tokenize=False, add_generation_prompt=True)
+        return self.tokenizer.encode(text)
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+
+class HarmonyPromptFormat:
+    """Harmony conversation with the default system message and a user turn (oss_eval.py)."""
+
+    def __init__(self):
+        from openai_harmony import HarmonyEncodingName, load_harmony_encoding
+        self.encoding = load_harmony_encoding(HarmonyEncodingName.HARMONY_GPT_OSS)
+
+    # The encoding is a native object; worker processes load their own
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def render(self, content):
+        from openai_harmony import Conversation, Message, Role, SystemContent
+        convo = Conversation.from_messages([
+            Message.from_role_and_content(Role.SYSTEM, SystemContent.new()),
+            Message.from_role_and_content(Role.USER, content)
+        ])
+        return list(self.encoding.render_conversation_for_completion(convo, Role.ASSISTANT))
+
+    def encode(self, text):
+        return list(self.encoding.encode(text, allowed_special=set()))
+
+
+class CompiledTemplate:
+    def __init__(self, template, prompt_format):
+        self.template = template
+        self.prompt_format = prompt_format
+        self.statics, names, self.padding = split_template(template)
+        self.slots = [PLACEHOLDERS.index(name) for name in names]
+        self.static_ids = [prompt_format.encode(static) for static in self.statics]
+
+        first, second = (prompt_format.render(sentinel) for sentinel in SENTINELS)
+        prefix, suffix = common_affixes(first, second)
+        self.head, self.tail = first[:prefix], first[len(first) - suffix:]
+        self.error = None
+        for sentinel, rendered in zip(SENTINELS, (first, second)):
+            if self.head + prompt_format.encode(sentinel) + self.tail != rendered:
+                self.error = "the chat scaffolding does not tokenize separately from the message"
+        if self.error is None and self.render(PROBE_FIELDS) != self.slow_render(PROBE_FIELDS):
+            self.error = "the template segments do not tokenize separately from the fields"
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def chunks(self, fields):
+        return [before + fields[slot] + after for slot, (before, after) in zip(self.slots, self.padding)]
+
+    def assemble(self, chunk_ids):
+        ids = list(self.head)
+        for static_ids, field_ids in zip(self.static_ids, chunk_ids):
+            ids += static_ids
+            ids += field_ids
+        ids += self.static_ids[-1]
+        ids += self.tail
+        return ids
+
+    def render(self, fields):
+        return self.assemble([self.prompt_format.encode(chunk) for chunk in self.chunks(fields)])
+
+    def slow_render(self, fields):
+        return self.prompt_format.render(fill_template(self.template, fields))
+
+    @staticmethod
+    def compilable(fields):
+        return not any("[HERE_IS_THE_" in value for value in fields)
+
+
+# Set in each worker process by init_worker
+_worker_format = None
+
+def init_worker(prompt_format):
+    global _worker_format
+    _worker_format = prompt_format
+
+def encode_in_worker(text):
+    return _worker_format.encode(text)
+
+def render_in_worker(content):
+    return _worker_format.render(content)
+
+
+class PromptRenderer:
+    """
+    prompt_token_ids for judge items, from the compiled template where it is verified and
+    from the slow path otherwise. With workers > 1 tokenization runs in a process pool.
+    """
+
+    def __init__(self, template, prompt_format, check=64, workers=1, compiled=True, logger=None, metrics=None):
+        self.template = template
+        self.prompt_format = prompt_format
+        self.check = check
+        self.logger = logger
+        self.metrics = metrics
+        self.compiled = None
+        if compiled:
+            self.compiled = CompiledTemplate(template, prompt_format)
+            if not self.compiled.ok:
+                self.warn(f"Not using compiled prompts: {self.compiled.error}")
+                self.compiled = None
+            elif logger:
+                logger.info(f"Compiled judge template: {sum(map(len, self.compiled.static_ids))} static tokens, "
+                            f"{len(self.compiled.head) + len(self.compiled.tail)} scaffolding tokens")
+        self.pool = None
+        if workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(prompt_format,))
+
+    def warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+
+    def count(self, name, value):
+        if self.metrics is not None and value:
+            self.metrics.count(name, value)
+
+    def map(self, function, worker_function, values):
+        if self.pool is None or len(values) < 2:
+            return [function(value) for value in values]
+        chunksize = max(1, len(values) // (4 * self.pool._max_workers))
+        return list(self.pool.map(worker_function, values, chunksize=chunksize))
+
+    def slow_render_all(self, fields_list):
+        contents = [fill_template(self.template, fields) for fields in fields_list]
+        return self.map(self.prompt_format.render, render_in_worker, contents)
+
+    def render(self, fields_list):
+        fields_list = list(fields_list)
+        prompts = [None] * len(fields_list)
+        fast = [k for k, fields in enumerate(fields_list) if self.compiled is not None and self.compiled.compilable(fields)]
+        if fast:
+            chunks = [chunk for k in fast for chunk in self.compiled.chunks(fields_list[k])]
+            chunk_ids = self.map(self.prompt_format.encode, encode_in_worker, chunks)
+            per_item = len(self.compiled.slots)
+            for n, k in enumerate(fast):
+                prompts[k] = self.compiled.assemble(chunk_ids[n * per_item:(n + 1) * per_item])
+
+            # Exact check against the slow path for the first `check` compiled items of the run
+            checked = fast[:self.check] if self.check >= 0 else fast
+            if checked:
+                self.check -= len(checked) if self.check >= 0 else 0
+                for k, expected in zip(checked, self.slow_render_all([fields_list[k] for k in checked])):
+                    if prompts[k] != expected:
+                        self.warn(f"Compiled prompt differs from the chat template at token {first_difference(prompts[k], expected)} "
+                                  f"({len(prompts[k])} vs {len(expected)} tokens); using the slow path from now on")
+                        self.count("render_mismatch", 1)
+                        self.compiled = None
+                        fast = []
+                        break
+
+        compiled = set(fast)
+        slow = [k for k in range(len(fields_list)) if k not in compiled]
+        for k, ids in zip(slow, self.slow_render_all([fields_list[k] for k in slow])):
+            prompts[k] = ids
+        self.count("render_compiled", len(fast))
+        self.count("render_slow", len(slow))
+        return prompts
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -1,28 +1,69 @@
-from datasets import load_dataset
 import json
-import random
 import os
-import re
-from tqdm import tqdm
-
-data = []
-### Benchmark 5: u-Math
-init_data = load_dataset("toloka/mu-math", split="test")
-idx=0
-for item in init_data:
-    data.append({
-        "idx": f"mu-Math/instance_{idx}",
-        "question": item["problem_statement"],
-        "answer": item["golden_answer"].strip(),
-        "answer_type": "Diverse",
-        "human_judgment": item["label"],
-        "response": item["model_output"],
-        "extracted_answer": ""
-    })
-    idx += 1
-        
-
-print(f"Total items processed: {len(data)}")
-
-with open("mu_math.json", "w") as f:
-    json.dump(data, f, indent=4)
\ No newline at end of file
+import sys
+import hashlib
+import inspect
+import argparse
+
+# Snapshot loading and compressed output are shared with generator_eval
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "generator_eval"))
+from snapshots import load_split, split_fingerprint
+from storage import open_file
+
+HUB_NAME = "toloka/mu-math"
+SPLIT = "test"
+
+
+def build_mu_math(snapshot_dir, offline):
+    init_data = load_split(snapshot_dir, HUB_NAME, SPLIT, offline)
+    data = []
+    idx = 0
+    for item in init_data:
+        data.append({
+            "idx": f"mu-Math/instance_{idx}",
+            "question": item["problem_statement"],
+            "answer": item["golden_answer"].strip(),
+            "answer_type": "Diverse",
+            "human_judgment": item["label"],
+            "response": item["model_output"],
+            "extracted_answer": ""
+        })
+        idx += 1
+    return data
+
+def cache_key(snapshot_dir):
+    fingerprint = split_fingerprint(snapshot_dir, HUB_NAME, SPLIT)
+    if fingerprint is None:
+        return None
+    digest = hashlib.sha256()
+    digest.update(inspect.getsource(build_mu_math).encode())
+    digest.update(fingerprint.encode())
+    return digest.hexdigest()[:16]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the mu-Math meta-evaluation set from a local snapshot.")
+    parser.add_argument("--snapshot_dir", type=str, default="./snapshots", help="Directory with local Arrow/JSONL snapshots of hub datasets.")
+    parser.add_argument("--cache_dir", type=str, default="./.benchmark_cache", help="Directory for the cached output.")
+    parser.add_argument("--output_file", type=str, default="mu_math.json", help="Path to the output JSON file (.gz/.zst to compress).")
+    parser.add_argument("--offline", action="store_true", help="Fail instead of downloading a missing snapshot.")
+
+    args = parser.parse_args()
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+    key = cache_key(args.snapshot_dir)
+    cache_file = os.path.join(args.cache_dir, f"mu-Math.{key}.json")
+    if key is not None and os.path.exists(cache_file):
+        print(f"Using cached mu-Math build {cache_file}")
+        with open(cache_file, "r") as f:
+            data = json.load(f)
+    else:
+        data = build_mu_math(args.snapshot_dir, args.offline)
+        cache_file = os.path.join(args.cache_dir, f"mu-Math.{cache_key(args.snapshot_dir)}.json")
+        with open(cache_file, "w") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    print(f"Total items processed: {len(data)}")
+
+    with open_file(args.output_file, "w") as f:
+        json.dump(data, f)